@@ -0,0 +1,213 @@
+import re
+import math
+import time
+import hashlib
+import threading
+
+from envconf import env_bool, env_float, env_int
+
+
+# Robots d'indexation, aperçus de liens des messageries, clients HTTP scriptés
+BOT_UA_RE = re.compile(
+    r"bot\b|bot/|crawl|spider|slurp|scrap|preview|prerender|headless|lighthouse"
+    r"|facebookexternalhit|facebookcatalog|meta-externalagent|whatsapp|telegram"
+    r"|slack|discord|skypeuripreview|embedly|vkshare|pinterest|redditbot|quora link"
+    r"|bitlybot|outbrain|nuzzel|flipboard|tumblr|iframely|mastodon|pleroma|akkoma"
+    r"|curl/|wget/|python-requests|python-urllib|aiohttp|httpx|go-http-client"
+    r"|okhttp|java/|libwww|apache-httpclient|node-fetch|axios/|postmanruntime"
+    r"|monitor|uptime|pingdom|statuscake|check_http",
+    re.IGNORECASE,
+)
+
+
+def is_bot_user_agent(user_agent: str) -> bool:
+    """User-Agent absent ou reconnu comme robot."""
+    if not user_agent:
+        return True
+    return BOT_UA_RE.search(user_agent) is not None
+
+
+class WindowedBloom:
+    """
+    Filtre de Bloom à fenêtre glissante : deux générations de bits, la plus
+    ancienne est jetée toutes les `window` secondes (une clé est donc
+    reconnue entre `window` et 2 × `window` après son passage). Mémoire fixe,
+    calculée depuis `capacity` (clés par génération) et `fp_rate` ; si une
+    génération se remplit avant la fin de la fenêtre, elle tourne plus tôt
+    pour que le taux de faux positifs reste borné.
+
+    Les faux positifs sont mesurés sur un échantillon (1 clé sur
+    `sample_every`) dont on garde aussi la valeur exacte.
+    """
+
+    def __init__(self, capacity: int = 200_000, fp_rate: float = 0.001, window: float = 1800.0, sample_every: int = 64):
+        self.capacity = max(1, capacity)
+        self.fp_rate = min(max(fp_rate, 1e-9), 0.5)
+        self.window = window
+        self.sample_every = max(1, sample_every)
+
+        self.nbits = max(64, int(math.ceil(-self.capacity * math.log(self.fp_rate) / (math.log(2) ** 2))))
+        self.nhashes = max(1, int(round(self.nbits / self.capacity * math.log(2))))
+
+        self._lock = threading.Lock()
+        self._current = bytearray((self.nbits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._current_set = 0
+        self._previous_set = 0
+        self._current_keys = 0
+        self._sample_current = set()
+        self._sample_previous = set()
+        self._rotated_at = time.monotonic()
+
+        self._stats = {
+            "checks": 0,
+            "hits": 0,
+            "rotations": 0,
+            "early_rotations": 0,
+            "sampled": 0,
+            "sampled_new": 0,
+            "sampled_false_positives": 0,
+        }
+
+    def _positions(self, key: bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        nbits = self.nbits
+        return [(h1 + i * h2) % nbits for i in range(self.nhashes)], h1
+
+    def _rotate(self, early: bool = False):
+        self._previous, self._current = self._current, self._previous
+        self._current[:] = bytes(len(self._current))
+        self._previous_set, self._current_set = self._current_set, 0
+        self._current_keys = 0
+        self._sample_previous, self._sample_current = self._sample_current, set()
+        self._rotated_at = time.monotonic()
+        self._stats["rotations"] += 1
+        if early:
+            self._stats["early_rotations"] += 1
+
+    def check_and_add(self, key: str) -> bool:
+        """True si la clé a (probablement) déjà été vue dans la fenêtre."""
+        raw = key.encode("utf-8")
+        positions, h1 = self._positions(raw)
+        sampled = h1 % self.sample_every == 0
+
+        with self._lock:
+            if self.window and time.monotonic() - self._rotated_at >= self.window:
+                self._rotate()
+            elif self._current_keys >= self.capacity:
+                self._rotate(early=True)
+
+            current, previous = self._current, self._previous
+            in_current = True
+            in_previous = True
+            for pos in positions:
+                byte, bit = pos >> 3, 1 << (pos & 7)
+                if not current[byte] & bit:
+                    in_current = False
+                    current[byte] |= bit
+                    self._current_set += 1
+                if in_previous and not previous[byte] & bit:
+                    in_previous = False
+
+            seen = in_current or in_previous
+            if not in_current:
+                self._current_keys += 1
+
+            self._stats["checks"] += 1
+            if seen:
+                self._stats["hits"] += 1
+
+            if sampled:
+                self._stats["sampled"] += 1
+                if not (raw in self._sample_current or raw in self._sample_previous):
+                    self._stats["sampled_new"] += 1
+                    if seen:
+                        self._stats["sampled_false_positives"] += 1
+                self._sample_current.add(raw)
+
+        return seen
+
+    def estimated_fp_rate(self) -> float:
+        """Probabilité qu'une clé nouvelle soit prise pour un doublon, d'après le remplissage."""
+        with self._lock:
+            p_cur = (self._current_set / self.nbits) ** self.nhashes
+            p_prev = (self._previous_set / self.nbits) ** self.nhashes
+        return 1.0 - (1.0 - p_cur) * (1.0 - p_prev)
+
+    def stats(self) -> dict:
+        estimated = self.estimated_fp_rate()
+        with self._lock:
+            data = dict(self._stats)
+            data["fill_current"] = round(self._current_set / self.nbits, 6)
+            data["fill_previous"] = round(self._previous_set / self.nbits, 6)
+            data["keys_current"] = self._current_keys
+        data["estimated_fp_rate"] = round(estimated, 8)
+        data["measured_fp_rate"] = (
+            round(data["sampled_false_positives"] / data["sampled_new"], 8) if data["sampled_new"] else 0.0
+        )
+        data["capacity"] = self.capacity
+        data["target_fp_rate"] = self.fp_rate
+        data["window"] = self.window
+        data["hashes"] = self.nhashes
+        data["memory_bytes"] = 2 * len(self._current)
+        return data
+
+
+class ClickFilter:
+    """
+    Tri des clics avant le compteur : "bot" (User-Agent de robot ou
+    préchargement), "duplicate" (même code + même empreinte client dans
+    la fenêtre) ou "ok". Seuls les "ok" donnent lieu à une écriture.
+    """
+
+    def __init__(self, bloom: WindowedBloom = None, bots: bool = True):
+        self.bloom = bloom
+        self.bots = bots
+        self._lock = threading.Lock()
+        self._stats = {"accepted": 0, "bots": 0, "prefetches": 0, "duplicates": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def classify(self, code: str, fingerprint: str, user_agent: str, prefetch: bool = False) -> str:
+        if self.bots:
+            if prefetch:
+                self._count("prefetches")
+                return "bot"
+            if is_bot_user_agent(user_agent):
+                self._count("bots")
+                return "bot"
+        if self.bloom is not None and self.bloom.check_and_add(f"{code}|{fingerprint}"):
+            self._count("duplicates")
+            return "duplicate"
+        self._count("accepted")
+        return "ok"
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+        data["bot_filter"] = self.bots
+        data["dedup"] = self.bloom.stats() if self.bloom is not None else None
+        return data
+
+
+def click_filter_from_env() -> ClickFilter:
+    """
+    Variables d'environnement :
+      - CLICK_BOT_FILTER (défaut 1 ; 0 = compter aussi les robots)
+      - CLICK_DEDUP_WINDOW (s, défaut 1800 ; 0 = pas de déduplication)
+      - CLICK_DEDUP_CAPACITY (défaut 200000 clés par génération)
+      - CLICK_DEDUP_FP_RATE (défaut 0.001)
+    """
+    window = env_float("CLICK_DEDUP_WINDOW", 1800.0)
+    bloom = None
+    if window > 0:
+        bloom = WindowedBloom(
+            capacity=env_int("CLICK_DEDUP_CAPACITY", 200_000),
+            fp_rate=env_float("CLICK_DEDUP_FP_RATE", 0.001),
+            window=window,
+        )
+    return ClickFilter(bloom=bloom, bots=env_bool("CLICK_BOT_FILTER", True))
@@ -6,4 +6,4 @@ sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from app import app
 
-# Vercel utilise "app"
+# Vercel utilise "app" (wsgi_app passe par le fast path de /l/<code>, voir fastpath.py)
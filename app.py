@@ -1,11 +1,33 @@
+import io
 import os
-import secrets
+import hmac
+import json
+import time
 import datetime
-from contextlib import closing
-
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from flask import Flask, render_template, request, redirect, url_for, abort, Response, jsonify
+import functools
+
+import click
+from flask import Flask, render_template, request, redirect, url_for, abort, Response, jsonify, g, make_response
+from flask import before_render_template, template_rendered
+
+from envconf import env_bool, env_float, env_int
+from storage import storage_from_env
+from metrics import metrics_from_env
+from clicks import buffer_from_env, click_event, client_fingerprint
+from cache import MISSING, ambassador_cache_from_env, render_cache_from_env, single_flight_from_env
+from httpcache import etag_for, files_fingerprint, is_not_modified, not_modified, to_utc, with_validators
+from assets import AssetManifest, build_assets, bytecode_cache_from_env, send_precompressed, warm_templates
+from antibot import click_filter_from_env
+from ratelimit import rate_limiter_from_env
+from bans import BAN_KINDS, ban_list_from_env
+from listing import ListingError, parse_listing_args, split_page
+from search import SearchError, parse_search_args, split_results
+from stripe_sales import InvalidWebhook, verify_and_parse
+from bulk_import import ON_EXISTING, BulkImportError, ImportReport, validate_rows
+from payouts import STATEMENT_COLUMNS, PayoutError, commission_rules_from_env, parse_period
+from exports import buffered, csv_header, csv_line, gzipped, json_chunks, json_default
+from replica import primary_until, sticky_to_primary
+from fastpath import ShortLinkDispatcher, client_ip as environ_client_ip, is_prefetch
 
 # --------------------
 # dotenv (OPTIONNEL)
@@ -20,9 +42,10 @@ except Exception:
 # Mailing (OPTIONNEL)
 # --------------------
 try:
-    from mailing import send_ambassador_welcome_email  # type: ignore
+    from mailing import build_ambassador_welcome_message, mailjet_configured  # type: ignore
+    from outbox import OutboxWorker, drain_outbox  # type: ignore
 except Exception:
-    send_ambassador_welcome_email = None
+    build_ambassador_welcome_message = None
 
 
 # --------------------
@@ -35,6 +58,9 @@ if not APP_BASE_URL:
     APP_BASE_URL = None  # fallback url_for(_external=True)
 
 ADMIN_TOKEN = (os.environ.get("ADMIN_TOKEN") or "").strip()
+STRIPE_WEBHOOK_SECRET = (os.environ.get("STRIPE_WEBHOOK_SECRET") or "").strip()
+METRICS_TOKEN = (os.environ.get("METRICS_TOKEN") or "").strip() or ADMIN_TOKEN
+SERVER_TIMING = env_bool("SERVER_TIMING", True)
 
 app = Flask(
     __name__,
@@ -43,41 +69,65 @@ app = Flask(
 )
 app.secret_key = os.environ.get("SECRET_KEY", "dev-secret-change-me")
 
+# Templates compilés une fois (flask build-assets) puis relus en bytecode
+app.jinja_options = {
+    **app.jinja_options,
+    "bytecode_cache": bytecode_cache_from_env(os.path.join(BASE_DIR, ".jinja_cache")),
+}
 
 # --------------------
-# ✅ Bannissement dur par env vars (email + code)
+# Cache HTTP
 # --------------------
-BANNED_EMAILS_RAW = os.environ.get("BANNED_EMAILS", "")
-BANNED_CODES_RAW = os.environ.get("BANNED_CODES", "")
-
-
-def _parse_csv_set(raw: str, mode: str = "lower"):
-    items = []
-    for part in raw.replace("\n", ",").split(","):
-        v = (part or "").strip()
-        if not v:
-            continue
-        if mode == "lower":
-            items.append(v.lower())
-        elif mode == "upper":
-            items.append(v.upper())
-        else:
-            items.append(v)
-    return set(items)
+# Fichiers statiques : mis en cache par le navigateur, revalidés ensuite (ETag)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = env_int("STATIC_MAX_AGE", 86400)
+
+# Pages personnelles et exports : jamais servis sans revalidation (304 si inchangés)
+DASHBOARD_CACHE_CONTROL = "private, no-cache"
+EXPORT_CACHE_CONTROL = "private, no-cache"
+# Chaque passage sur /l/<code> doit atteindre l'app pour être compté
+REDIRECT_CACHE_CONTROL = "private, no-store"
+
+# Fichiers empreintés (static/dist, flask build-assets) : noms changeant avec
+# le contenu, donc cache immuable et variantes gzip / brotli précalculées
+asset_manifest = AssetManifest(app.static_folder)
+
+# Les pages référencent les URLs empreintées : elles entrent dans l'ETag
+TEMPLATES_FINGERPRINT = files_fingerprint(os.path.join(BASE_DIR, "templates")) + asset_manifest.fingerprint
+
 
+@app.template_global()
+def asset_url(filename: str) -> str:
+    return url_for("static", filename=asset_manifest.filename(filename))
 
-BANNED_EMAILS = _parse_csv_set(BANNED_EMAILS_RAW, mode="lower")
-BANNED_CODES = _parse_csv_set(BANNED_CODES_RAW, mode="upper")
 
+def static_file(filename):
+    source = asset_manifest.sources.get(filename)
+    if source is None:
+        return app.send_static_file(filename)
+    return send_precompressed(
+        app.static_folder,
+        filename,
+        source,
+        asset_manifest.encodings[filename],
+        request.headers.get("Accept-Encoding"),
+    )
 
+
+app.view_functions["static"] = static_file
+
+if env_bool("TEMPLATE_WARMUP", True):
+    warm_templates(app.jinja_env)
+
+
+# --------------------
+# ✅ Bannissement dur (table bans + env vars), voir bans.py
+# --------------------
 def is_banned_email(email: str) -> bool:
-    e = (email or "").strip().lower()
-    return bool(e) and e in BANNED_EMAILS
+    return ban_list.snapshot.email_banned(email)
 
 
 def is_banned_code(code: str) -> bool:
-    c = (code or "").strip().upper()
-    return bool(c) and c in BANNED_CODES
+    return ban_list.snapshot.code_banned(code)
 
 
 def hard_block(message: str = "Accès indisponible."):
@@ -85,83 +135,224 @@ def hard_block(message: str = "Accès indisponible."):
 
 
 # --------------------
-# DB helpers
+# Stockage (Postgres ou SQLite), voir storage.py
 # --------------------
-def get_db():
-    database_url = (os.environ.get("DATABASE_URL") or "").strip()
-    if not database_url:
-        raise RuntimeError("DATABASE_URL manquante")
+metrics = metrics_from_env()
+storage = storage_from_env()
+storage.code_banned = is_banned_code
+storage.metrics = metrics
 
-    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
 
+def check_db_schema():
+    """
+    Au démarrage. Postgres : une seule requête sur schema_migrations (aucun
+    DDL, migrations à part : `python migrations.py upgrade`). SQLite : schéma
+    embarqué appliqué s'il manque. SKIP_SCHEMA_CHECK=1 supprime le contrôle.
+    """
+    if env_bool("SKIP_SCHEMA_CHECK", False):
+        return
+    storage.check_schema()
 
-def init_db():
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS ambassadors (
-                    id SERIAL PRIMARY KEY,
 
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE NOT NULL,
-                    code TEXT UNIQUE NOT NULL,
+check_db_schema()
 
-                    payout_preference TEXT,
-                    payout_identifier TEXT,
 
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT,
+# --------------------
+# Réplique de lecture (DATABASE_READ_URL), voir pg_storage.py
+# --------------------
+# Après une inscription, le dashboard lit le primaire pendant cette fenêtre
+# (cookie), le temps que la réplique rejoue la fiche
+READ_STICKY_SECONDS = env_float("READ_STICKY_SECONDS", 15.0)
+READ_STICKY_COOKIE = "betty_primary"
 
-                    clicks INTEGER NOT NULL DEFAULT 0,
-                    signups INTEGER NOT NULL DEFAULT 0
-                )
-                """
-            )
-            conn.commit()
-
-
-def db_migrate():
-    """Ajoute des colonnes si la DB existait déjà (sans casser)."""
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT column_name
-                FROM information_schema.columns
-                WHERE table_name = 'ambassadors'
-                """
-            )
-            cols = {r["column_name"] for r in cur.fetchall()}
 
-            if "updated_at" not in cols:
-                cur.execute("ALTER TABLE ambassadors ADD COLUMN updated_at TEXT")
+def replica_route(view):
+    """Route en lecture seule : ses lectures vont sur la réplique, sauf cookie de lecture fraîche."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if sticky_to_primary(request.cookies.get(READ_STICKY_COOKIE), READ_STICKY_SECONDS):
+            return view(*args, **kwargs)
+        with storage.replica_reads():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+# --------------------
+# Instrumentation (Server-Timing + /metrics), voir metrics.py
+# --------------------
+@app.before_request
+def start_request_timer():
+    metrics.start_request()
+
 
-            conn.commit()
+@app.after_request
+def finish_request_timer(response):
+    timer = metrics.finish_request(request.endpoint, response.status_code)
+    if timer is not None and SERVER_TIMING:
+        response.headers["Server-Timing"] = timer.server_timing()
+    return response
 
 
-init_db()
-db_migrate()
+@before_render_template.connect_via(app)
+def _render_started(_sender, **_extra):
+    g.setdefault("render_started", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def _render_finished(_sender, **_extra):
+    started = g.get("render_started")
+    if started:
+        metrics.observe_phase("render", time.perf_counter() - started.pop())
 
 
 def now_utc_iso():
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 
-def generate_code(conn) -> str:
-    """Code lisible 6 chars unique."""
-    for _ in range(50):
-        candidate = secrets.token_urlsafe(4)[:6]
-        candidate = candidate.replace("-", "A").replace("_", "B").upper()
+# Le rollup prend LOCK TABLE click_events IN SHARE MODE : jamais à chaque
+# flush (toutes les 2 s), au plus une fois par intervalle ; 0 = cron seulement
+CLICK_ROLLUP_INTERVAL = env_float("CLICK_ROLLUP_INTERVAL", 60.0)
+CLICK_EVENTS_RETENTION_DAYS = env_int("CLICK_EVENTS_RETENTION_DAYS", 0)
+_last_rollup = 0.0
+
+
+def run_click_rollup():
+    """Rollup incrémental click_events -> click_daily + ambassadors.clicks."""
+    global _last_rollup
+    _last_rollup = time.monotonic()
+    ids = storage.rollup_clicks(now_utc_iso(), retention_days=CLICK_EVENTS_RETENTION_DAYS)
+    ambassador_cache.invalidate_ids(ids)
+    return ids
+
+
+def _flush_clicks(events):
+    """Insère les clics en attente en un seul INSERT multi-lignes."""
+    storage.insert_click_events(events)
 
-        with conn.cursor() as cur:
-            cur.execute("SELECT 1 FROM ambassadors WHERE code = %s", (candidate,))
-            row = cur.fetchone()
+    if CLICK_ROLLUP_INTERVAL > 0 and time.monotonic() - _last_rollup >= CLICK_ROLLUP_INTERVAL:
+        try:
+            run_click_rollup()
+        except Exception:
+            app.logger.exception("Rollup des clics impossible")
 
-        if not row:
-            return candidate
 
-    raise RuntimeError("Impossible de générer un code ambassadeur unique.")
+click_buffer = buffer_from_env(_flush_clicks)
+ambassador_cache = ambassador_cache_from_env()
+dashboard_pages = render_cache_from_env()
+# Défauts de cache simultanés sur une même clé : une seule requête en base
+single_flight = single_flight_from_env()
+click_filter = click_filter_from_env()
+commission_rules = commission_rules_from_env()
+
+# Le drapeau `banned` est mis en cache avec la fiche : vidé à chaque nouvelle liste
+ban_list = ban_list_from_env(storage, on_change=lambda _snapshot: ambassador_cache.clear())
+ban_list.start()
+
+# --------------------
+# Rate limiting (avant toute connexion DB)
+# --------------------
+# endpoint -> (règle, méthodes limitées) ; /l/<code> : voir lookup_short_link
+RATE_LIMITED_ENDPOINTS = {
+    "inscription": ("inscription", {"POST"}),
+    "dashboard": ("dashboard", {"GET"}),
+}
+
+# Proxies devant l'app qui ajoutent l'IP de leur pair à X-Forwarded-For
+# (Vercel : 1) ; 0 = REMOTE_ADDR, l'en-tête est ignoré (voir fastpath.client_ip)
+TRUSTED_PROXIES = max(0, env_int("TRUSTED_PROXIES", 1 if os.environ.get("VERCEL") else 0))
+
+rate_limiter = rate_limiter_from_env(
+    {"inscription": "5/60", "redirect": "60/60", "dashboard": "30/60"}
+)
+TOO_MANY_REQUESTS_BODY = "Trop de requêtes, réessayez dans un instant."
+
+
+@app.before_request
+def enforce_rate_limit():
+    limited = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if not limited or request.method not in limited[1]:
+        return None
+    allowed, retry_after = rate_limiter.check(limited[0], client_ip())
+    if allowed:
+        return None
+    return too_many_requests(retry_after)
+
+
+def too_many_requests(retry_after: int):
+    response = Response(TOO_MANY_REQUESTS_BODY, status=429, mimetype="text/plain")
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+# Sans identifiants Mailjet, pas de worker : les emails restent en outbox
+# jusqu'à drain-outbox / /admin/outbox/drain une fois Mailjet configuré
+outbox_worker = None
+if build_ambassador_welcome_message and mailjet_configured():
+    outbox_worker = OutboxWorker(
+        storage, interval=env_float("OUTBOX_POLL_INTERVAL", 30.0), metrics=metrics
+    )
+elif build_ambassador_welcome_message:
+    app.logger.warning("MAILJET_API_KEY / MAILJET_API_SECRET absentes : emails gardés en outbox")
+
+
+def lookup_ambassador(field: str, value: str):
+    """
+    Fiche ambassadeur par code ou email, via le cache en mémoire. Les
+    défauts simultanés sur la même clé (lien partagé qui part en rafale)
+    partagent une seule requête. Renvoie (row, banned) ou None si inconnu.
+    """
+    if field not in ("code", "email"):
+        raise ValueError(f"Champ de recherche invalide : {field}")
+
+    entry = ambassador_cache.lookup(field, value)
+    if entry is not MISSING:
+        return entry
+    return fetch_ambassador(field, value)
+
+
+def fetch_ambassador(field: str, value: str):
+    """Défaut de cache : lecture en base partagée par les appels simultanés."""
+    # Une lecture sur le primaire (cookie de lecture fraîche) ne reprend
+    # jamais le résultat d'une lecture en cours sur la réplique
+    route = "replica" if storage.reads_replica() else "primary"
+    return single_flight.do((field, value, route), lambda: load_ambassador(field, value))
+
+
+def load_ambassador(field: str, value: str):
+    """Lecture en base puis mise en cache (exécutée par un seul thread par clé)."""
+    row = storage.find_ambassador(field, value)
+
+    if not row:
+        # Cache négatif pour les codes seulement : un email inconnu peut
+        # s'inscrire à tout moment depuis un autre worker.
+        if field == "code":
+            ambassador_cache.put_missing(field, value)
+        return None
+
+    banned = is_banned_email(row["email"]) or is_banned_code(row["code"])
+    ambassador_cache.put(row, banned)
+    return row, banned
+
+
+def lookup_short_link(code: str, ip: str):
+    """
+    Fiche pour /l/<code>, sous la règle de rate limit "redirect". Seules les
+    requêtes qui lisent en base (défaut de cache) ou visent un code inconnu
+    sont comptées : un lien valide en cache, partagé en rafale derrière un
+    NAT, n'est jamais limité ; l'énumération de codes l'est.
+    Renvoie (found, retry_after) ; retry_after non nul : 429.
+    """
+    entry = ambassador_cache.lookup("code", code)
+    if entry is not MISSING and entry is not None:
+        return entry, 0
+    allowed, retry_after = rate_limiter.check("redirect", ip)
+    if not allowed:
+        return None, retry_after
+    if entry is None:
+        return None, 0
+    return fetch_ambassador("code", code), 0
 
 
 def build_dashboard_url(code: str) -> str:
@@ -180,6 +371,28 @@ def build_tracking_target(code: str) -> str:
     return f"https://www.spectramedia.online/?ref={code}"
 
 
+def welcome_email(row, is_new: bool):
+    """(kind, message) de bienvenue pour l'outbox, ou None sans mailing."""
+    if not build_ambassador_welcome_message:
+        return None
+    code = row["code"]
+    name = row["name"] or ""
+    message = build_ambassador_welcome_message(
+        to_email=row["email"],
+        firstname=name.split(" ")[0] if name else "",
+        code=code,
+        dashboard_url=build_dashboard_url(code),
+        short_link=build_short_link(code),
+        tracking_target=build_tracking_target(code),
+        is_new=is_new,
+    )
+    return "ambassador_welcome", message
+
+
+def client_ip() -> str:
+    return environ_client_ip(request.environ, TRUSTED_PROXIES)
+
+
 def require_admin():
     token = (request.args.get("token") or "").strip()
     if not ADMIN_TOKEN or token != ADMIN_TOKEN:
@@ -219,108 +432,47 @@ def inscription():
             payout_preference_db = payout_preference or None
             payout_identifier_db = payout_identifier or None
 
-            created_now = now_utc_iso()
-            updated_now = created_now
-            is_new = False
-
-            with closing(get_db()) as conn:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT * FROM ambassadors WHERE email = %s",
-                        (email,),
-                    )
-                    existing = cur.fetchone()
-
-                    if existing:
-                        code = existing["code"]
-
-                        if is_banned_code(code) or is_banned_email(existing["email"]):
-                            return hard_block("Accès indisponible.")
-
-                        updates = []
-                        params = []
-
-                        if name and name != (existing["name"] or ""):
-                            updates.append("name = %s")
-                            params.append(name)
-
-                        if (
-                            payout_preference_db is not None
-                            and payout_preference_db != existing["payout_preference"]
-                        ):
-                            updates.append("payout_preference = %s")
-                            params.append(payout_preference_db)
-
-                        if (
-                            payout_identifier_db is not None
-                            and payout_identifier_db != existing["payout_identifier"]
-                        ):
-                            updates.append("payout_identifier = %s")
-                            params.append(payout_identifier_db)
-
-                        updates.append("updated_at = %s")
-                        params.append(updated_now)
-
-                        params.append(email)
-
-                        cur.execute(
-                            f"UPDATE ambassadors SET {', '.join(updates)} WHERE email = %s",
-                            tuple(params),
-                        )
-                        conn.commit()
-                    else:
-                        code = generate_code(conn)
-
-                        if is_banned_code(code):
-                            return hard_block("Inscription indisponible.")
-
-                        cur.execute(
-                            """
-                            INSERT INTO ambassadors (
-                                name, email, code,
-                                payout_preference, payout_identifier,
-                                created_at, updated_at
-                            )
-                            VALUES (%s, %s, %s, %s, %s, %s, %s)
-                            """,
-                            (
-                                name,
-                                email,
-                                code,
-                                payout_preference_db,
-                                payout_identifier_db,
-                                created_now,
-                                updated_now,
-                            ),
-                        )
-                        conn.commit()
-                        is_new = True
-
-            if send_ambassador_welcome_email:
-                try:
-                    firstname = name.split(" ")[0] if name else ""
-                    dashboard_url = build_dashboard_url(code)
-                    short_link = build_short_link(code)
-                    tracking_target = build_tracking_target(code)
-
-                    send_ambassador_welcome_email(
-                        to_email=email,
-                        firstname=firstname,
-                        code=code,
-                        dashboard_url=dashboard_url,
-                        short_link=short_link,
-                        tracking_target=tracking_target,
-                        is_new=is_new,
-                    )
-                except Exception:
-                    app.logger.exception("Erreur envoi email Mailjet (inscription ambassadeur)")
-
-            return redirect(url_for("dashboard", code=code))
+            def accept(row):
+                return not (is_banned_code(row["code"]) or is_banned_email(row["email"]))
+
+            signed_up = storage.signup(
+                name,
+                email,
+                payout_preference_db,
+                payout_identifier_db,
+                now_utc_iso(),
+                accept=accept,
+                # Email mis en outbox dans la même transaction que l'écriture
+                email_for=welcome_email,
+            )
+            if not signed_up:
+                return hard_block("Accès indisponible.")
+            row, _is_new = signed_up
+            code = row["code"]
+
+            # La ligne fraîche sert directement la redirection vers /dashboard
+            ambassador_cache.put(row, False)
+
+            if outbox_worker:
+                outbox_worker.kick()
+
+            response = redirect(url_for("dashboard", code=code))
+            # Lire ses propres écritures : le dashboard qui suit reste sur le primaire
+            response.set_cookie(
+                READ_STICKY_COOKIE,
+                primary_until(READ_STICKY_SECONDS),
+                max_age=int(READ_STICKY_SECONDS) + 1,
+                path=url_for("dashboard"),
+                httponly=True,
+                samesite="Lax",
+            )
+            return response
 
     return render_template("inscription.html", error=error)
 
 
 @app.route("/dashboard")
+@replica_route
 def dashboard():
     code = (request.args.get("code") or request.args.get("ref") or "").strip().upper()
     email = (request.args.get("email") or "").strip().lower()
@@ -330,58 +482,130 @@ def dashboard():
     if email and is_banned_email(email):
         return hard_block("Accès indisponible.")
 
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            ambassador = None
-
-            if code:
-                cur.execute("SELECT * FROM ambassadors WHERE code = %s", (code,))
-                ambassador = cur.fetchone()
-            elif email:
-                cur.execute("SELECT * FROM ambassadors WHERE email = %s", (email,))
-                ambassador = cur.fetchone()
-
-        if not ambassador:
-            return render_template("dashboard.html", ambassador=None, stats=None, not_found=True)
-
-        if is_banned_email(ambassador["email"]) or is_banned_code(ambassador["code"]):
-            return hard_block("Accès indisponible.")
-
-        clicks = int(ambassador["clicks"] or 0)
-        signups = int(ambassador["signups"] or 0)
-
-        price = 129.0
-        upfront_per = 0.30 * price
-        recurring_per_month = 10.0
-
-        est_upfront_total = signups * upfront_per
-        est_monthly_recurring = signups * recurring_per_month
-        est_6m_total = signups * (upfront_per + recurring_per_month * 6)
-
-        short_link = build_short_link(ambassador["code"])
-        tracking_link = short_link
-
-        stats = {
-            "clicks": clicks,
-            "signups": signups,
-            "tracking_link": tracking_link,
-            "short_link": short_link,
-            "upfront_per": upfront_per,
-            "est_upfront_total": est_upfront_total,
-            "est_monthly_recurring": est_monthly_recurring,
-            "est_6m_total": est_6m_total,
-        }
+    found = None
+    if code:
+        found = lookup_ambassador("code", code)
+    elif email:
+        found = lookup_ambassador("email", email)
+
+    if not found:
+        return render_template("dashboard.html", ambassador=None, stats=None, not_found=True)
+
+    ambassador, banned = found
+    if banned:
+        return hard_block("Accès indisponible.")
+
+    pending = click_buffer.pending_for(ambassador["id"])
+    # Clics déjà en base mais pas encore dans ambassadors.clicks / click_daily
+    unrolled = storage.unrolled_clicks(ambassador["id"])
+    etag, last_modified = dashboard_validators(ambassador, pending, unrolled)
+    if is_not_modified(etag, last_modified):
+        return not_modified(etag, last_modified, DASHBOARD_CACHE_CONTROL)
+
+    html = dashboard_pages.get(etag) if dashboard_pages is not None else MISSING
+    if html is MISSING:
+        html = single_flight.do(("dashboard", etag), lambda: cache_dashboard(etag, ambassador, pending, unrolled))
+
+    return with_validators(make_response(html), etag, last_modified, DASHBOARD_CACHE_CONTROL)
+
+
+def dashboard_validators(ambassador, pending: int, unrolled: dict):
+    """
+    ETag : fiche complète (compteurs, updated_at, que les ventes Stripe font
+    aussi avancer), clics encore en buffer ou pas encore agrégés, jour courant
+    (fenêtre glissante de 30 jours), URL de base et templates. Last-Modified :
+    updated_at, ou minuit si plus récent ; omis tant que des clics hors de la
+    fiche sont comptés.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    etag = etag_for(
+        TEMPLATES_FINGERPRINT,
+        APP_BASE_URL or request.host_url,
+        now.date(),
+        pending,
+        sorted(unrolled.items()),
+        sorted(ambassador.items()),
+    )
+    last_modified = None
+    updated = to_utc(ambassador.get("updated_at") or ambassador.get("created_at"))
+    if updated is not None and not pending and not unrolled:
+        last_modified = max(updated, now.replace(hour=0, minute=0, second=0, microsecond=0))
+    return etag, last_modified
+
+
+def cache_dashboard(etag: str, ambassador, pending: int, unrolled: dict) -> str:
+    html = render_dashboard(ambassador, pending, unrolled)
+    if dashboard_pages is not None:
+        dashboard_pages.set(etag, html)
+    return html
+
+
+def render_dashboard(ambassador, pending: int, unrolled: dict) -> str:
+    clicks = int(ambassador["clicks"] or 0) + pending + sum(unrolled.values())
+    signups = int(ambassador["signups"] or 0)
+
+    short_link = build_short_link(ambassador["code"])
+    tracking_link = short_link
+
+    # Agrégats tenus à jour par le webhook Stripe : une seule ligne
+    series, sales_stats = storage.dashboard_data(ambassador["id"], days=30)
+    series = [(day, n + unrolled.get(day, 0)) for day, n in series]
+
+    revenue = int(sales_stats.get("revenue_cents") or 0) / 100
+    commission_paid = int(sales_stats.get("commission_paid_cents") or 0) / 100
+    commission_unpaid = int(sales_stats.get("commission_unpaid_cents") or 0) / 100
+    active_subscriptions = int(sales_stats.get("active_subscriptions") or 0)
+    total_commission = commission_paid + commission_unpaid
+
+    stats = {
+        "clicks": clicks,
+        "signups": signups,
+        "tracking_link": tracking_link,
+        "short_link": short_link,
+        "revenue": revenue,
+        "commission_paid": commission_paid,
+        "commission_unpaid": commission_unpaid,
+        "active_subscriptions": active_subscriptions,
+        "clicks_30d": sum(n for _day, n in series),
+        "series_max": max([n for _day, n in series] + [1]),
+    }
+
+    return render_template(
+        "dashboard.html",
+        ambassador=ambassador,
+        betty_link=tracking_link,
+        total_sales=signups,
+        total_clicks=clicks,
+        total_commission=total_commission,
+        clicks_series=series,
+        stats=stats,
+        not_found=False,
+    )
 
-        return render_template(
-            "dashboard.html",
-            ambassador=ambassador,
-            betty_link=tracking_link,
-            total_sales=signups,
-            total_clicks=clicks,
-            total_commission=est_6m_total,
-            stats=stats,
-            not_found=False,
+
+# --------------------
+# Stripe
+# --------------------
+@app.route("/webhooks/stripe", methods=["POST"])
+def stripe_webhook():
+    if not STRIPE_WEBHOOK_SECRET:
+        abort(503)
+
+    try:
+        event = verify_and_parse(
+            request.get_data(),
+            request.headers.get("Stripe-Signature"),
+            STRIPE_WEBHOOK_SECRET,
         )
+    except InvalidWebhook as e:
+        app.logger.warning("Webhook Stripe refusé : %s", e)
+        abort(400)
+
+    # Erreur = 500 : la transaction (déduplication comprise) est annulée et Stripe réessaie
+    touched = storage.apply_stripe_events([event], commission_rules)
+
+    ambassador_cache.invalidate_ids(touched)
+    return jsonify({"received": True})
 
 
 @app.route("/l/<code>")
@@ -391,119 +615,551 @@ def redirect_with_ref(code):
     if is_banned_code(code):
         abort(404)
 
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM ambassadors WHERE code = %s", (code,))
-            ambassador = cur.fetchone()
-
-            if ambassador:
-                if is_banned_email(ambassador["email"]) or is_banned_code(ambassador["code"]):
-                    abort(404)
-
-                cur.execute(
-                    "UPDATE ambassadors SET clicks = clicks + 1, updated_at = %s WHERE id = %s",
-                    (now_utc_iso(), ambassador["id"]),
-                )
-                conn.commit()
-
-    return redirect(build_tracking_target(code))
+    found, retry_after = lookup_short_link(code, client_ip())
+    if retry_after:
+        return too_many_requests(retry_after)
+
+    if found:
+        ambassador, banned = found
+        if banned:
+            abort(404)
+        user_agent = request.headers.get("User-Agent")
+        fingerprint = client_fingerprint(client_ip(), user_agent, app.secret_key)
+        prefetch = request.method == "HEAD" or "prefetch" in (
+            request.headers.get("Sec-Purpose") or request.headers.get("Purpose") or ""
+        ).lower()
+        # Robots, préchargements et rechargements : redirigés mais pas comptés
+        if click_filter.classify(ambassador["code"], fingerprint, user_agent, prefetch) == "ok":
+            click_buffer.record(ambassador["id"], click_event(ambassador["id"], ambassador["code"], fingerprint))
+
+    response = redirect(build_tracking_target(code))
+    response.headers["Cache-Control"] = REDIRECT_CACHE_CONTROL
+    return response
+
+
+NOT_FOUND_BODY = b"Not Found"
+
+
+def fast_redirect(code: str, environ):
+    """
+    /l/<code> hors Flask (fastpath.ShortLinkDispatcher) : mêmes étapes que
+    redirect_with_ref (bannissements, fiche en cache, rate limit, clic), mêmes
+    métriques sous le même endpoint.
+    """
+    metrics.start_request()
+    code = code.upper()
+    ip = environ_client_ip(environ, TRUSTED_PROXIES)
+    headers = [("Cache-Control", REDIRECT_CACHE_CONTROL)]
+
+    status, body = 302, b""
+    try:
+        found, retry_after = ((None, True), 0) if is_banned_code(code) else lookup_short_link(code, ip)
+    except Exception:
+        app.logger.exception("Lecture de la fiche %s impossible", code)
+        found, retry_after = None, 0
+        status, body = 500, b"Internal Server Error"
+        headers = [("Content-Type", "text/plain; charset=utf-8")]
+    if retry_after:
+        status, body = 429, TOO_MANY_REQUESTS_BODY.encode("utf-8")
+        headers = [("Content-Type", "text/plain; charset=utf-8"), ("Retry-After", str(retry_after))]
+    elif found and found[1]:
+        status, body = 404, NOT_FOUND_BODY
+        headers = [("Content-Type", "text/plain; charset=utf-8")]
+    elif found:
+        ambassador = found[0]
+        user_agent = environ.get("HTTP_USER_AGENT")
+        fingerprint = client_fingerprint(ip, user_agent, app.secret_key)
+        if click_filter.classify(ambassador["code"], fingerprint, user_agent, is_prefetch(environ)) == "ok":
+            click_buffer.record(ambassador["id"], click_event(ambassador["id"], ambassador["code"], fingerprint))
+    if status == 302:
+        headers.append(("Location", build_tracking_target(code)))
+
+    timer = metrics.finish_request("redirect_with_ref", status)
+    if timer is not None and SERVER_TIMING:
+        headers.append(("Server-Timing", timer.server_timing()))
+    return status, headers, body
+
+
+# Monté sur wsgi_app : Vercel (api/index.py), gunicorn et app.run passent
+# tous par le fast path. SHORTLINK_FAST_PATH=0 rend /l/<code> à Flask.
+if env_bool("SHORTLINK_FAST_PATH", True):
+    app.wsgi_app = ShortLinkDispatcher(app.wsgi_app, fast_redirect)
 
 
 # --------------------
 # ADMIN
 # --------------------
+def admin_listing_opts():
+    try:
+        return parse_listing_args(request.args)
+    except ListingError as e:
+        abort(400, description=str(e))
+
+
+def fetch_listing_page(opts):
+    try:
+        rows = storage.listing_page(opts)
+    except ListingError as e:
+        abort(400, description=str(e))
+
+    return split_page(rows, opts)
+
+
+def search_page(args):
+    """(opts, lignes de la page, offset suivant) d'une recherche admin."""
+    try:
+        opts = parse_search_args(args)
+    except SearchError as e:
+        abort(400, description=str(e))
+    rows, next_offset = split_results(storage.search_ambassadors(opts), opts)
+    return opts, rows, next_offset
+
+
 @app.route("/admin/ambassadors")
+@replica_route
 def admin_ambassadors():
     require_admin()
 
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, name, email, code,
-                       payout_preference, payout_identifier,
-                       created_at, updated_at,
-                       clicks, signups
-                FROM ambassadors
-                ORDER BY created_at DESC
-                """
-            )
-            rows = cur.fetchall()
-
-    return render_template("admin_ambassadors.html", ambassadors=rows)
+    opts = admin_listing_opts()
+    search = None
+    if (request.args.get("q") or "").strip():
+        search, rows, next_offset = search_page(request.args)
+        next_args = None
+        if next_offset is not None:
+            next_args = {k: v for k, v in request.args.items() if k != "cursor"}
+            next_args["offset"] = next_offset
+    else:
+        rows, next_cursor = fetch_listing_page(opts)
+        next_args = None
+        if next_cursor:
+            next_args = request.args.to_dict()
+            next_args["cursor"] = next_cursor
+
+    return render_template(
+        "admin_ambassadors.html",
+        ambassadors=rows,
+        filters=opts,
+        search=search,
+        next_args=next_args,
+    )
+
+
+@app.route("/admin/ambassadors/search.json")
+@replica_route
+def admin_ambassadors_search():
+    """?q= (nom, email, code, identifiant de paiement), &limit=, &offset= ; classé par pertinence."""
+    require_admin()
+    opts, rows, next_offset = search_page(request.args)
+    payload = {
+        "db": storage.name,
+        "q": opts["q"],
+        "count": len(rows),
+        "ambassadors": [dict(r) for r in rows],
+        "next_offset": next_offset,
+    }
+    return Response(json.dumps(payload, default=json_default), mimetype="application/json")
+
+
+EXPORT_BATCH_SIZE = env_int("EXPORT_BATCH_SIZE", 2000)
+EXPORT_CSV_COPY = env_bool("EXPORT_CSV_COPY", True)
+
+
+def export_etag() -> str:
+    """
+    ETag des exports : version de la table ambassadors (lue avant les
+    données : au pire un ETag trop ancien, jamais un contenu périmé) et
+    paramètres de la requête, hors jeton.
+    """
+    args = sorted((k, v) for k, v in request.args.items(multi=True) if k != "token")
+    return etag_for(storage.name, request.path, storage.listing_version(), args)
+
+
+def _export_response(chunks, mimetype: str, etag: str):
+    """Réponse en flux, compressée en gzip si le client l'accepte."""
+    body = buffered(chunks)
+    headers = {}
+    if "gzip" in (request.headers.get("Accept-Encoding") or "").lower():
+        body = gzipped(body)
+        headers["Content-Encoding"] = "gzip"
+    response = Response(body, mimetype=mimetype, headers=headers)
+    return with_validators(response, etag, cache_control=EXPORT_CACHE_CONTROL, vary="Accept-Encoding")
 
 
 @app.route("/admin/ambassadors.json")
+@replica_route
 def admin_ambassadors_json():
     require_admin()
 
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, name, email, code,
-                       payout_preference, payout_identifier,
-                       created_at, updated_at,
-                       clicks, signups
-                FROM ambassadors
-                ORDER BY created_at DESC
-                """
-            )
-            rows = cur.fetchall()
-
-    data = []
-    for r in rows:
-        data.append(dict(r))
+    opts = admin_listing_opts()
+    etag = export_etag()
+    if is_not_modified(etag):
+        return not_modified(etag, cache_control=EXPORT_CACHE_CONTROL, vary="Accept-Encoding")
+
+    # Page par clé si ?limit / ?cursor, sinon export complet (filtré) en flux
+    if opts["limit"] or opts["cursor"]:
+        rows, next_cursor = fetch_listing_page(opts)
+        payload = {
+            "db": storage.name,
+            "count": len(rows),
+            "ambassadors": [dict(r) for r in rows],
+            "next_cursor": next_cursor,
+        }
+        response = Response(json.dumps(payload, default=json_default), mimetype="application/json")
+        return with_validators(response, etag, cache_control=EXPORT_CACHE_CONTROL, vary="Accept-Encoding")
 
-    return jsonify({"db": "postgres", "count": len(data), "ambassadors": data})
+    rows = storage.iter_listing(opts, batch_size=EXPORT_BATCH_SIZE)
+    return _export_response(json_chunks(rows, db=storage.name), "application/json", etag)
 
 
 @app.route("/admin/ambassadors.csv")
+@replica_route
 def admin_ambassadors_csv():
     require_admin()
 
-    with closing(get_db()) as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, name, email, code,
-                       payout_preference, payout_identifier,
-                       created_at, updated_at,
-                       clicks, signups
-                FROM ambassadors
-                ORDER BY created_at DESC
-                """
-            )
-            rows = cur.fetchall()
-
-    header = "id,name,email,code,payout_preference,payout_identifier,created_at,updated_at,clicks,signups\n"
-    lines = [header]
-
-    def esc(v):
-        v = "" if v is None else str(v)
-        v = v.replace('"', '""')
-        return f'"{v}"'
-
-    for r in rows:
-        lines.append(
-            ",".join(
-                [
-                    esc(r["id"]),
-                    esc(r["name"]),
-                    esc(r["email"]),
-                    esc(r["code"]),
-                    esc(r["payout_preference"]),
-                    esc(r["payout_identifier"]),
-                    esc(r["created_at"]),
-                    esc(r["updated_at"]),
-                    esc(r["clicks"]),
-                    esc(r["signups"]),
-                ]
-            )
-            + "\n"
-        )
+    opts = admin_listing_opts()
+    etag = export_etag()
+    if is_not_modified(etag):
+        return not_modified(etag, cache_control=EXPORT_CACHE_CONTROL, vary="Accept-Encoding")
+
+    # Fast path : la base produit le CSV elle-même (Postgres : COPY)
+    chunks = storage.listing_csv(opts) if EXPORT_CSV_COPY else None
+    if chunks is None:
+
+        def generate():
+            yield csv_header()
+            for row in storage.iter_listing(opts, batch_size=EXPORT_BATCH_SIZE):
+                yield csv_line(row)
+
+        chunks = generate()
+
+    return _export_response(chunks, "text/csv", etag)
+
+
+def run_import(text_stream, on_existing: str = "update", send_emails: bool = True) -> dict:
+    """Import CSV en masse (endpoint admin et commande CLI), voir bulk_import.py."""
+    report = ImportReport()
+    storage.import_ambassadors(
+        validate_rows(text_stream, report, is_banned_email),
+        now_utc_iso(),
+        report,
+        on_existing=on_existing,
+        email_for=welcome_email if send_emails else None,
+    )
+    # Fiches mises à jour et codes jusque-là inconnus (cache négatif)
+    ambassador_cache.clear()
+    if report.emails and outbox_worker:
+        outbox_worker.kick()
+    return report.as_dict()
+
+
+@app.route("/admin/ambassadors/import", methods=["POST"])
+def admin_ambassadors_import():
+    """
+    CSV en champ de formulaire `file` ou en corps brut (text/csv), colonnes
+    name, email, [payout_preference], [payout_identifier].
+    ?on_existing=update|skip (défaut update), ?emails=0 : pas d'email de bienvenue.
+    Tout ou rien pour les lignes valides ; les lignes refusées sont listées.
+    """
+    require_admin()
+
+    on_existing = (request.args.get("on_existing") or "update").strip().lower()
+    if on_existing not in ON_EXISTING:
+        abort(400, description=f"on_existing doit valoir {', '.join(ON_EXISTING)}")
+    send_emails = (request.args.get("emails") or "1").strip() != "0"
+
+    upload = request.files.get("file")
+    text = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8-sig", newline="")
+    try:
+        report = run_import(text, on_existing, send_emails)
+    except (BulkImportError, UnicodeDecodeError) as e:
+        abort(400, description=str(e))
+    return jsonify(report)
+
+
+@app.route("/admin/outbox/drain")
+def admin_outbox_drain():
+    """Vide l'outbox (pratique en cron Vercel, où les threads de fond dorment)."""
+    require_admin()
+    if not build_ambassador_welcome_message:
+        abort(503)
+    return jsonify({"outbox": drain_outbox(storage, metrics=metrics)})
+
+
+@app.route("/admin/bans", methods=["GET", "POST"])
+def admin_bans():
+    """
+    GET : liste de la table bans. POST kind=email|domain|code, value=...,
+    [reason=...], [action=remove] : ajout ou retrait, effectif tout de suite
+    sur cette instance et au prochain polling sur les autres.
+    """
+    require_admin()
+
+    if request.method == "POST":
+        kind = (request.values.get("kind") or "").strip().lower()
+        value = request.values.get("value") or ""
+        action = (request.values.get("action") or "add").strip().lower()
+        if kind not in BAN_KINDS:
+            abort(400, description=f"kind doit valoir {', '.join(BAN_KINDS)}")
+        try:
+            if action == "remove":
+                return jsonify({"removed": ban_list.remove(kind, value), "version": ban_list.snapshot.version})
+            value = ban_list.add(kind, value, (request.values.get("reason") or "").strip() or None)
+        except ValueError as e:
+            abort(400, description=str(e))
+        return jsonify({"added": {"kind": kind, "value": value}, "version": ban_list.snapshot.version})
+
+    return Response(
+        json.dumps({"version": ban_list.snapshot.version, "bans": ban_list.list()}, default=json_default),
+        mimetype="application/json",
+    )
+
+
+@app.route("/admin/commissions.csv")
+@replica_route
+def admin_commissions_csv():
+    """
+    Relevé des commissions depuis le grand livre (flask commission-run) :
+    ?period=AAAA-MM (défaut : toutes), ?ambassador_id=...
+    """
+    require_admin()
+    try:
+        period = parse_period(request.args.get("period"))
+        ambassador_id = int(request.args["ambassador_id"]) if request.args.get("ambassador_id") else None
+    except (PayoutError, ValueError) as e:
+        abort(400, description=str(e))
+
+    rows = storage.commission_statement(now_utc_iso(), period, ambassador_id)
+    body = csv_header(STATEMENT_COLUMNS) + "".join(csv_line(r, STATEMENT_COLUMNS) for r in rows)
+    return Response(body, mimetype="text/csv", headers={"Cache-Control": EXPORT_CACHE_CONTROL})
+
+
+def runtime_stats() -> dict:
+    return {
+        "storage": storage.stats(),
+        "clicks": click_buffer.stats(),
+        "ambassador_cache": ambassador_cache.stats(),
+        "single_flight": single_flight.stats(),
+        "click_filter": click_filter.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "bans": ban_list.stats(),
+        "assets": asset_manifest.stats(),
+    }
+
+
+@app.route("/admin/stats.json")
+def admin_stats_json():
+    require_admin()
+    return jsonify({**runtime_stats(), "metrics": metrics.stats()})
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """
+    Exposition Prometheus : histogrammes (requêtes, phases, SQL) et compteurs
+    de /admin/stats.json. Jeton METRICS_TOKEN (défaut ADMIN_TOKEN) en
+    `Authorization: Bearer ...` ou `?token=`.
+    """
+    if not metrics.enabled:
+        abort(404)
+    auth = request.headers.get("Authorization") or ""
+    token = auth[7:].strip() if auth.lower().startswith("bearer ") else (request.args.get("token") or "").strip()
+    if not METRICS_TOKEN or not hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        abort(403)
+    return Response(metrics.render(runtime_stats()), mimetype="text/plain; version=0.0.4")
+
 
-    return Response("".join(lines), mimetype="text/csv")
+# --------------------
+# CLI
+# --------------------
+@app.cli.command("rollup-clicks")
+def rollup_clicks_command():
+    """Vide le buffer puis agrège les nouveaux clics (à lancer en cron)."""
+    click_buffer.flush()
+    ids = run_click_rollup()
+    print(f"{len(ids)} ambassadeur(s) mis à jour")
+
+
+@app.cli.command("drain-outbox")
+def drain_outbox_command():
+    """Envoie les emails en attente dans l'outbox."""
+    counts = drain_outbox(storage, metrics=metrics)
+    print(
+        f"{counts['sent']} envoyé(s), {counts['retried']} à réessayer, "
+        f"{counts['failed']} en échec définitif"
+    )
+
+
+@app.cli.command("import-ambassadors")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--skip-existing", is_flag=True, help="ne pas modifier les emails déjà inscrits")
+@click.option("--no-email", is_flag=True, help="ne pas mettre d'email de bienvenue en outbox")
+def import_ambassadors_command(path, skip_existing, no_email):
+    """Importe un CSV d'ambassadeurs (name, email, [payout_preference], [payout_identifier])."""
+    send_emails = not no_email and build_ambassador_welcome_message is not None
+    if send_emails and not APP_BASE_URL:
+        # Hors requête, url_for ne connaît pas l'hôte public
+        raise click.UsageError("APP_BASE_URL requise pour les liens des emails (ou --no-email)")
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        try:
+            report = run_import(f, "skip" if skip_existing else "update", send_emails)
+        except BulkImportError as e:
+            raise click.ClickException(str(e))
+
+    print(
+        f"{report['rows']} ligne(s) : {report['inserted']} créée(s), {report['updated']} mise(s) à jour, "
+        f"{report['skipped']} ignorée(s), {report['rejected']} refusée(s), "
+        f"{report['emails_queued']} email(s) en outbox"
+    )
+    for error in report["errors"][:20]:
+        print(f"  ligne {error['line']} ({error['email'] or '-'}) : {error['error']}")
+
+
+@app.cli.command("send-campaign")
+@click.argument("template")
+@click.option("--id", "campaign_id", help="identifiant de reprise (défaut : <template>-<date du jour>)")
+@click.option("--workers", type=int, help="appels Mailjet simultanés (CAMPAIGN_WORKERS)")
+@click.option("--rate", type=float, help="messages par seconde, 0 = sans limite (CAMPAIGN_RATE)")
+@click.option("--batch-size", type=int, help="messages par appel Mailjet, 50 max (CAMPAIGN_BATCH_SIZE)")
+@click.option("--limit", type=int, help="nombre maximal de destinataires pour ce passage")
+@click.option("--var", "variables", multiple=True, metavar="CLE=VALEUR", help="variable du template (répétable)")
+def send_campaign_command(template, campaign_id, workers, rate, batch_size, limit, variables):
+    """Envoie (ou reprend) une campagne email à tous les ambassadeurs."""
+    from campaigns import CampaignError, campaign_runner_from_env
+
+    if not APP_BASE_URL:
+        raise click.UsageError("APP_BASE_URL requise pour les liens des emails")
+    params = {}
+    for item in variables:
+        key, sep, value = item.partition("=")
+        if not sep or not key.strip():
+            raise click.BadParameter(f"{item!r} (attendu CLE=VALEUR)", param_hint="--var")
+        params[key.strip()] = value
+
+    def campaign_context(row):
+        name = row["name"] or ""
+        return {
+            "firstname": name.split(" ")[0] if name else "",
+            "dashboard_url": build_dashboard_url(row["code"]),
+            "short_link": build_short_link(row["code"]),
+        }
+
+    campaign_id = campaign_id or f"{template}-{datetime.date.today().isoformat()}"
+    try:
+        runner = campaign_runner_from_env(
+            storage,
+            campaign_id,
+            template,
+            params=params,
+            context_for=campaign_context,
+            is_excluded=lambda row: is_banned_email(row["email"]) or is_banned_code(row["code"]),
+            metrics=metrics,
+            workers=workers,
+            rate=rate,
+            batch_size=batch_size,
+        )
+        result = runner.run(limit=limit)
+    except CampaignError as e:
+        raise click.ClickException(str(e))
+
+    state, counts = result["campaign"], result["run"]
+    print(
+        f"Campagne {campaign_id} ({state['status']}) : {counts['sent']} envoyé(s), "
+        f"{counts['failed']} en échec, {counts['skipped']} exclu(s) ce passage ; "
+        f"total {state['sent']} envoyé(s), reprise après l'ambassadeur {state['last_ambassador_id']}"
+    )
+    if result.get("error"):
+        raise click.ClickException(f"{result['error']} : relancer la même commande pour reprendre")
+
+
+@app.cli.command("campaign-status")
+@click.argument("campaign_id")
+def campaign_status_command(campaign_id):
+    """Affiche l'état d'une campagne email."""
+    state = storage.get_campaign(campaign_id)
+    if not state:
+        raise click.ClickException(f"campagne inconnue : {campaign_id}")
+    print(json.dumps(state, default=json_default, ensure_ascii=False, indent=2))
+
+
+@app.cli.command("commission-run")
+@click.option("--full", is_flag=True, help="repartir de la première vente (ventes rattachées tardivement)")
+def commission_run_command(full):
+    """Porte au grand livre les commissions des nouvelles ventes (à lancer en cron)."""
+    result = storage.update_commission_ledger(commission_rules, full=full)
+    print(
+        f"{result['entries']} commission(s), {result['amount_cents'] / 100:.2f} € "
+        f"(ventes après {result['after']}, reprise après {result['checkpoint']})"
+    )
+
+
+@app.cli.command("commission-statement")
+@click.option("--period", help="mois AAAA-MM (défaut : toutes les périodes)")
+@click.option("--ambassador-id", type=int)
+@click.option("--output", "-o", type=click.File("w", encoding="utf-8"), default="-", help="fichier CSV (défaut : sortie standard)")
+def commission_statement_command(period, ambassador_id, output):
+    """Relevé CSV des commissions (en attente, acquises, versées) par période et ambassadeur."""
+    try:
+        period = parse_period(period)
+    except PayoutError as e:
+        raise click.BadParameter(str(e), param_hint="--period")
+    output.write(csv_header(STATEMENT_COLUMNS))
+    for row in storage.commission_statement(now_utc_iso(), period, ambassador_id):
+        output.write(csv_line(row, STATEMENT_COLUMNS))
+
+
+@app.cli.command("pay-commissions")
+@click.argument("reference")
+@click.option("--through", help="dernier mois versé AAAA-MM (défaut : tous)")
+def pay_commissions_command(reference, through):
+    """
+    Enregistre le versement de tous les soldes acquis sous REFERENCE (libellé
+    du lot de virements) ; relancer avec la même référence ne verse rien deux fois.
+    """
+    try:
+        through = parse_period(through)
+    except PayoutError as e:
+        raise click.BadParameter(str(e), param_hint="--through")
+
+    rows = storage.pay_commissions(reference, now_utc_iso(), through)
+    ambassador_cache.invalidate_ids({r["ambassador_id"] for r in rows})
+    for row in rows:
+        print(f"  ambassadeur {row['ambassador_id']} : {row['cents'] / 100:.2f} €")
+    print(f"Versement {reference} : {len(rows)} ambassadeur(s), {sum(r['cents'] for r in rows) / 100:.2f} €")
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Empreinte et précompresse static/ (static/dist) et remplit le cache de bytecode Jinja."""
+    manifest = build_assets(app.static_folder)
+    asset_manifest.load()
+    for logical, entry in sorted(manifest["files"].items()):
+        print(f"{logical} -> {entry['path']} ({entry['size']} o{', ' if entry['encodings'] else ''}{', '.join(entry['encodings'])})")
+
+    cache = app.jinja_env.bytecode_cache
+    if cache is None:
+        print("Cache de bytecode Jinja désactivé (JINJA_BYTECODE_CACHE=0)")
+        return
+    cache.clear()
+    app.jinja_env.cache.clear()
+    names = warm_templates(app.jinja_env)
+    print(f"{len(names)} template(s) compilé(s) dans {cache.directory}")
+
+
+@app.cli.command("stripe-replay")
+@click.argument("paths", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def stripe_replay_command(paths):
+    """Rejoue des événements Stripe enregistrés (JSON) en un seul lot, sans réseau."""
+    events = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        events.extend(data if isinstance(data, list) else [data])
+
+    touched = storage.apply_stripe_events(events, commission_rules)
+
+    ambassador_cache.invalidate_ids(touched)
+    print(f"{len(events)} événement(s) rejoué(s), {len(touched)} ambassadeur(s) mis à jour")
 
 
 if __name__ == "__main__":
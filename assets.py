@@ -0,0 +1,242 @@
+import os
+import io
+import gzip
+import json
+import shutil
+import hashlib
+import logging
+import mimetypes
+
+from jinja2 import FileSystemBytecodeCache
+from flask import send_from_directory
+
+from envconf import env_bool
+
+try:
+    import brotli  # type: ignore
+except Exception:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = "dist"  # sous static/ : manifeste + variantes .gz / .br des fichiers empreintés
+MANIFEST_NAME = "manifest.json"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".html", ".xml", ".map"}
+MIN_COMPRESS_SIZE = 256
+MIN_COMPRESS_GAIN = 0.9  # variante gardée si elle fait moins de 90 % de l'original
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))  # ordre de préférence
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# --------------------
+# Build
+# --------------------
+def _compressed_variants(data: bytes):
+    """[(encoding, extension, octets)] qui valent la peine d'être servis."""
+    variants = []
+    # mtime=0 : même entrée, même .gz (build reproductible)
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=9, mtime=0) as f:
+        f.write(data)
+    variants.append(("gzip", ".gz", buf.getvalue()))
+    if brotli is not None:
+        variants.append(("br", ".br", brotli.compress(data, quality=11)))
+    return [v for v in variants if len(v[2]) < len(data) * MIN_COMPRESS_GAIN]
+
+
+def build_assets(static_dir: str) -> dict:
+    """
+    Donne à chaque fichier de `static_dir` un nom portant l'empreinte de son
+    contenu (css/betty.css -> dist/css/betty.<hash>.css) et précalcule ses
+    variantes gzip / brotli (brotli si le paquet est installé) pour les types
+    texte. Seules les variantes sont écrites sous dist/ : le nom empreinté
+    est servi depuis le fichier d'origine. Écrit et renvoie le manifeste.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist_dir, ignore_errors=True)
+
+    files = {}
+    for root, dirs, names in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir):
+            dirs[:] = [d for d in dirs if d != DIST_DIR]
+        dirs.sort()
+        for name in sorted(names):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, "/")
+            sha = _sha256(source)
+            stem, ext = os.path.splitext(logical)
+            target = f"{DIST_DIR}/{stem}.{sha[:12]}{ext}"
+            target_path = os.path.join(static_dir, *target.split("/"))
+
+            encodings = []
+            with open(source, "rb") as f:
+                data = f.read()
+            if ext.lower() in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                for encoding, suffix, payload in _compressed_variants(data):
+                    with open(target_path + suffix, "wb") as f:
+                        f.write(payload)
+                    encodings.append(encoding)
+
+            files[logical] = {"path": target, "sha256": sha, "size": len(data), "encodings": encodings}
+
+    manifest = {"files": files}
+    os.makedirs(dist_dir, exist_ok=True)
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# --------------------
+# Runtime
+# --------------------
+class AssetManifest:
+    """
+    URLs des fichiers statiques empreintés (manifeste de build_assets).
+    Une entrée dont la source a changé depuis le build (autre taille, ou
+    modifiée après le manifeste) est ignorée : le fichier est alors servi
+    sous son nom d'origine (cache court + ETag). Un stat par fichier au
+    chargement, sans relire les contenus.
+    """
+
+    def __init__(self, static_dir: str):
+        self.static_dir = static_dir
+        self.paths = {}  # "css/betty.css" -> "dist/css/betty.<hash>.css"
+        self.sources = {}  # "dist/css/betty.<hash>.css" -> "css/betty.css"
+        self.encodings = {}  # "dist/css/betty.<hash>.css" -> ("br", "gzip")
+        self.fingerprint = ""
+        self.stale = []
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.static_dir, DIST_DIR, MANIFEST_NAME)
+        try:
+            built_at = os.stat(path).st_mtime
+            with open(path, encoding="utf-8") as f:
+                files = json.load(f).get("files") or {}
+        except FileNotFoundError:
+            logger.info("Pas de manifeste d'assets (flask build-assets) : fichiers servis sous leur nom d'origine")
+            built_at, files = 0, {}
+        except (OSError, ValueError):
+            built_at, files = 0, {}
+
+        paths, sources, encodings, stale = {}, {}, {}, []
+        digest = hashlib.blake2b(digest_size=8)
+        for logical, entry in sorted(files.items()):
+            source = os.path.join(self.static_dir, *logical.split("/"))
+            try:
+                st = os.stat(source)
+                fresh = st.st_size == entry["size"] and st.st_mtime <= built_at
+            except OSError:
+                fresh = False
+            if not fresh:
+                stale.append(logical)
+                continue
+            paths[logical] = entry["path"]
+            sources[entry["path"]] = logical
+            encodings[entry["path"]] = tuple(e for e, _ in ENCODINGS if e in entry.get("encodings", ()))
+            digest.update(f"{logical}={entry['path']};".encode("utf-8"))
+
+        if stale:
+            logger.warning("Assets modifiés depuis le build (relancer build-assets) : %s", ", ".join(stale))
+        self.paths, self.sources, self.encodings, self.stale = paths, sources, encodings, stale
+        self.fingerprint = digest.hexdigest() if paths else ""
+
+    def filename(self, logical: str) -> str:
+        """Nom à passer à url_for("static", filename=...)."""
+        return self.paths.get(logical, logical)
+
+    def stats(self) -> dict:
+        return {"files": len(self.paths), "stale": len(self.stale), "brotli": brotli is not None}
+
+
+def _accepted(accept_encoding: str) -> set:
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        token, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if token:
+            accepted.add(token.strip().lower())
+    return accepted
+
+
+def send_precompressed(static_dir: str, filename: str, source: str, encodings, accept_encoding: str):
+    """
+    Fichier empreinté `filename` (original : `source`) : variante .br / .gz
+    acceptée par le client si elle existe, sinon l'original ; cache immuable
+    d'un an (le nom change avec le contenu).
+    """
+    accepted = _accepted(accept_encoding)
+    mimetype = mimetypes.guess_type(source)[0] or "application/octet-stream"
+    path = source
+    chosen = None
+    for encoding, suffix in ENCODINGS:
+        if encoding in encodings and encoding in accepted:
+            chosen = encoding
+            path = filename + suffix
+            break
+
+    response = send_from_directory(static_dir, path, mimetype=mimetype, max_age=31536000)
+    if chosen:
+        response.headers["Content-Encoding"] = chosen
+    if encodings:
+        response.vary.add("Accept-Encoding")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+# --------------------
+# Templates
+# --------------------
+class ShippedBytecodeCache(FileSystemBytecodeCache):
+    """
+    Cache de bytecode Jinja livrable avec le code : clé sur le seul nom du
+    template (pas son chemin absolu, qui change entre la machine de build et
+    le serveur) ; Jinja recompile si la source ne correspond plus. En
+    lecture seule (serverless), les écritures sont ignorées.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()
+
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError as e:
+            logger.debug("Cache de bytecode Jinja non écrit (%s) : %s", bucket.key, e)
+
+
+def bytecode_cache_from_env(default_dir: str):
+    """
+    Variables d'environnement :
+      - JINJA_BYTECODE_CACHE (défaut 1 ; 0 = compilation en mémoire seulement)
+      - JINJA_CACHE_DIR (défaut `default_dir`)
+    """
+    if not env_bool("JINJA_BYTECODE_CACHE", True):
+        return None
+    directory = (os.environ.get("JINJA_CACHE_DIR") or "").strip() or default_dir
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError:
+        if not os.path.isdir(directory):
+            return None
+    return ShippedBytecodeCache(directory)
+
+
+def warm_templates(env, extensions=(".html",)) -> list:
+    """Charge (bytecode ou compilation) les templates de pages avant la première requête."""
+    names = [n for n in env.list_templates() if n.endswith(extensions) and "/" not in n]
+    for name in names:
+        env.get_template(name)
+    return names
@@ -0,0 +1,202 @@
+import os
+import time
+import logging
+import threading
+
+from envconf import env_float
+
+
+logger = logging.getLogger(__name__)
+
+BAN_KINDS = ("email", "domain", "code")
+
+
+def parse_csv_set(raw: str, mode: str = "lower"):
+    items = []
+    for part in (raw or "").replace("\n", ",").split(","):
+        v = (part or "").strip()
+        if not v:
+            continue
+        if mode == "lower":
+            items.append(v.lower())
+        elif mode == "upper":
+            items.append(v.upper())
+        else:
+            items.append(v)
+    return set(items)
+
+
+def normalize(kind: str, value: str) -> str:
+    value = (value or "").strip()
+    if kind == "code":
+        return value.upper()
+    if kind == "domain":
+        return value.lower().lstrip("@").strip(".")
+    return value.lower()
+
+
+class BanSnapshot:
+    """
+    Liste de bannissement figée (jeux de hachage) : jamais modifiée après
+    construction, remplacée en bloc au rechargement. Un domaine banni couvre
+    aussi ses sous-domaines (exemple.com -> mail.exemple.com).
+    """
+
+    __slots__ = ("emails", "domains", "codes", "version")
+
+    def __init__(self, emails=(), domains=(), codes=(), version: int = 0):
+        self.emails = frozenset(emails)
+        self.domains = frozenset(domains)
+        self.codes = frozenset(codes)
+        self.version = version
+
+    def email_banned(self, email: str) -> bool:
+        e = (email or "").strip().lower()
+        if not e:
+            return False
+        if e in self.emails:
+            return True
+        if not self.domains:
+            return False
+        host = e.rpartition("@")[2]
+        while host:
+            if host in self.domains:
+                return True
+            host = host.partition(".")[2]
+        return False
+
+    def code_banned(self, code: str) -> bool:
+        c = (code or "").strip().upper()
+        return bool(c) and c in self.codes
+
+    def __len__(self):
+        return len(self.emails) + len(self.domains) + len(self.codes)
+
+
+class BanList:
+    """
+    Bannissements d'environnement (BANNED_*) + table `bans`.
+
+    Les routes lisent `snapshot` (une référence, échangée atomiquement) :
+    aucune requête SQL sur le chemin des requêtes. Un thread de fond lit
+    ban_version toutes les `poll_interval` secondes et ne recharge la table
+    que si la version a changé. `on_change(snapshot)` est appelé après
+    chaque rechargement effectif.
+    """
+
+    def __init__(self, store, static: BanSnapshot = None, poll_interval: float = 30.0, on_change=None):
+        self.store = store
+        self.static = static or BanSnapshot()
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self.snapshot = self.static
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"polls": 0, "reloads": 0, "errors": 0}
+        self._last_poll = None
+
+    # --------------------
+    # Chargement
+    # --------------------
+    def _build(self, rows, version: int) -> BanSnapshot:
+        found = {kind: set() for kind in BAN_KINDS}
+        for row in rows:
+            if row["kind"] in found:
+                found[row["kind"]].add(normalize(row["kind"], row["value"]))
+        return BanSnapshot(
+            emails=self.static.emails | found["email"],
+            domains=self.static.domains | found["domain"],
+            codes=self.static.codes | found["code"],
+            version=version,
+        )
+
+    def refresh(self, force: bool = False) -> bool:
+        """Une lecture de ban_version ; rechargement seulement si elle a changé."""
+        with self._lock:
+            self._stats["polls"] += 1
+            self._last_poll = time.time()
+        if not force and self.store.ban_version() == self.snapshot.version:
+            return False
+        # Version et lignes lues dans la même transaction
+        version, rows = self.store.load_bans()
+        snapshot = self._build(rows, version)
+
+        self.snapshot = snapshot
+        with self._lock:
+            self._stats["reloads"] += 1
+        if self.on_change:
+            self.on_change(snapshot)
+        return True
+
+    def start(self):
+        """Chargement initial puis polling en thread de fond."""
+        try:
+            self.refresh(force=True)
+        except Exception as e:
+            with self._lock:
+                self._stats["errors"] += 1
+            logger.warning("Chargement des bannissements impossible (%s) : liste d'environnement seule", e)
+
+        if self.poll_interval and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ban-poller", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception:
+                with self._lock:
+                    self._stats["errors"] += 1
+                logger.exception("Polling des bannissements en échec")
+
+    # --------------------
+    # Administration
+    # --------------------
+    def add(self, kind: str, value: str, reason: str = None):
+        if kind not in BAN_KINDS:
+            raise ValueError(f"type de bannissement inconnu : {kind}")
+        value = normalize(kind, value)
+        if not value:
+            raise ValueError("valeur vide")
+        self.store.add_ban(kind, value, reason)
+        self.refresh()
+        return value
+
+    def remove(self, kind: str, value: str) -> bool:
+        value = normalize(kind, value)
+        deleted = self.store.remove_ban(kind, value)
+        self.refresh()
+        return deleted
+
+    def list(self):
+        return self.store.list_bans()
+
+    def stats(self) -> dict:
+        snapshot = self.snapshot
+        with self._lock:
+            data = dict(self._stats)
+            data["last_poll"] = self._last_poll
+        data["version"] = snapshot.version
+        data["emails"] = len(snapshot.emails)
+        data["domains"] = len(snapshot.domains)
+        data["codes"] = len(snapshot.codes)
+        data["poll_interval"] = self.poll_interval
+        return data
+
+
+def ban_list_from_env(store, on_change=None) -> BanList:
+    """
+    Variables d'environnement (toujours fusionnées avec la table `bans`) :
+      - BANNED_EMAILS, BANNED_CODES, BANNED_DOMAINS (listes séparées par des virgules)
+      - BAN_POLL_INTERVAL (s, défaut 30 ; 0 = pas de polling)
+    """
+    static = BanSnapshot(
+        emails=parse_csv_set(os.environ.get("BANNED_EMAILS", ""), mode="lower"),
+        domains={normalize("domain", d) for d in parse_csv_set(os.environ.get("BANNED_DOMAINS", ""))},
+        codes=parse_csv_set(os.environ.get("BANNED_CODES", ""), mode="upper"),
+        version=-1,
+    )
+    return BanList(store, static=static, poll_interval=env_float("BAN_POLL_INTERVAL", 30.0), on_change=on_change)
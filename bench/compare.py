@@ -0,0 +1,67 @@
+"""
+Compare deux résultats de bench/run.py (route x concurrence).
+
+Usage :
+    python bench/compare.py bench/results/AVANT.json bench/results/APRES.json [--threshold 10]
+
+Code de sortie 1 si une mesure régresse de plus de `threshold` %.
+"""
+import sys
+import json
+import argparse
+
+
+# mesure -> True si "plus haut = mieux"
+METRICS = {
+    "requests_per_s": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+    "db_round_trips_per_request": False,
+    "peak_rss_kb": False,
+    "alloc_kb_per_request": False,
+}
+
+
+def _index(report):
+    return {(r["route"], r["concurrency"]): r for r in report["results"]}
+
+
+def compare(before: dict, after: dict, threshold: float):
+    """[(route, concurrence, mesure, avant, après, écart %, régression)]."""
+    rows = []
+    old, new = _index(before), _index(after)
+    for key in sorted(set(old) & set(new)):
+        for metric, higher_is_better in METRICS.items():
+            a, b = old[key].get(metric), new[key].get(metric)
+            if a is None or b is None:
+                continue
+            delta = ((b - a) / a * 100.0) if a else (0.0 if a == b else float("inf"))
+            worse = -delta if higher_is_better else delta
+            rows.append((key[0], key[1], metric, a, b, delta, worse > threshold))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="tolérance en %%")
+    args = parser.parse_args(argv)
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"{before['meta']['commit'][:12]} -> {after['meta']['commit'][:12]}")
+    regressions = 0
+    for route, concurrency, metric, a, b, delta, regressed in compare(before, after, args.threshold):
+        flag = "  REGRESSION" if regressed else ""
+        regressions += regressed
+        print(f"{route:<14} c={concurrency:<4} {metric:<28} {a:>12} -> {b:<12} {delta:+7.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
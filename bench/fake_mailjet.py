@@ -0,0 +1,128 @@
+"""
+Faux Mailjet local (v3.1 /send) pour tester l'outbox et les campagnes sans
+envoyer d'email : répond "success" par message, avec latence et pannes
+optionnelles (messages refusés : 400 avec statut par message, comme
+Mailjet), et compte les messages reçus par destinataire (doublons).
+
+Usage :
+    python bench/fake_mailjet.py --port 8025 --latency 0.2 --fail-every 40
+    MAILJET_API_URL=http://127.0.0.1:8025/v3.1/send \\
+    MAILJET_API_KEY=x MAILJET_API_SECRET=x \\
+        flask --app app drain-outbox
+    MAILJET_API_URL=http://127.0.0.1:8025/v3.1/send \\
+    MAILJET_API_KEY=x MAILJET_API_SECRET=x APP_BASE_URL=http://localhost:5000 \\
+        flask --app app send-campaign releve --var periode="mars 2026"
+
+GET /stats : compteurs (appels, messages, doublons, pic d'appels simultanés).
+"""
+import json
+import time
+import argparse
+import itertools
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMailjet:
+    def __init__(self, latency: float = 0.0, fail_every: int = 0, reject_every: int = 0):
+        self.latency = latency
+        self.fail_every = fail_every  # un appel sur N répond 503 (lot entier refusé)
+        self.reject_every = reject_every  # un message sur N en erreur
+        self.recipients = Counter()
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle(self, body: dict):
+        """(code HTTP, réponse JSON)."""
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if self.fail_every and call % self.fail_every == 0:
+                return 503, {"ErrorMessage": "fake: service indisponible"}
+
+            results, rejected = [], False
+            for message in body.get("Messages") or []:
+                to = (message.get("To") or [{}])[0].get("Email") or ""
+                with self._lock:
+                    n = next(self._ids)
+                    if not (self.reject_every and n % self.reject_every == 0):
+                        self.recipients[to] += 1
+                if self.reject_every and n % self.reject_every == 0:
+                    rejected = True
+                    results.append({"Status": "error", "Errors": [{"ErrorMessage": f"fake: rejet de {to}"}]})
+                else:
+                    results.append({"Status": "success", "To": [{"Email": to, "MessageID": n}]})
+            # Comme Mailjet : 400 dès qu'un message est refusé, détail par message
+            return (400 if rejected else 200), {"Messages": results}
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "messages": sum(self.recipients.values()),
+                "recipients": len(self.recipients),
+                "duplicates": sum(n - 1 for n in self.recipients.values() if n > 1),
+                "max_concurrent_calls": self.max_active,
+            }
+
+
+def make_handler(fake: FakeMailjet):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                return self._reply(400, {"ErrorMessage": "JSON invalide"})
+            self._reply(*fake.handle(body))
+
+        def do_GET(self):
+            self._reply(200, fake.stats())
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0, help="secondes par appel")
+    parser.add_argument("--fail-every", type=int, default=0, help="un appel sur N en 503")
+    parser.add_argument("--reject-every", type=int, default=0, help="un message sur N refusé")
+    args = parser.parse_args()
+
+    fake = FakeMailjet(args.latency, args.fail_every, args.reject_every)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    print(f"Faux Mailjet sur http://{args.host}:{args.port}/v3.1/send (Ctrl-C pour arrêter)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(fake.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+"""
+Benchmark des routes Flask (redirect, dashboard, inscription, recherche admin).
+`redirect` passe par le fast path WSGI de /l/<code> (fastpath.py),
+`redirect-flask` par la route Flask seule, pour comparer les deux.
+
+Appelle directement l'objet WSGI `app` (sans serveur HTTP) contre une base
+dédiée (Postgres ou fichier SQLite), remplie avec `--ambassadors` fiches, à
+plusieurs niveaux de concurrence. Résultats en JSON (un fichier par commit)
+pour comparer avec bench/compare.py.
+
+Usage :
+    BENCH_DATABASE_URL=postgresql://localhost/betty_bench \\
+        python bench/run.py --ambassadors 100000 --concurrency 1,8,32
+    BENCH_SQLITE_PATH=/tmp/betty_bench.sqlite3 \\
+        python bench/run.py --backend sqlite --ambassadors 100000
+
+ATTENTION : la base est migrée et remplie de fiches *@bench.invalid ;
+ne jamais pointer BENCH_DATABASE_URL vers la production.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import threading
+import tracemalloc
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BENCH_DOMAIN = "bench.invalid"
+ROUTES = ("redirect", "redirect-flask", "dashboard", "inscription", "search")
+BENCH_ADMIN_TOKEN = "bench-admin"
+BROWSER_UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+
+# --------------------
+# Comptage des allers-retours DB
+# --------------------
+class RoundTrips:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n: int = 1):
+        with self._lock:
+            self.count += n
+
+    def read(self) -> int:
+        with self._lock:
+            return self.count
+
+
+ROUND_TRIPS = RoundTrips()
+
+
+def counting_factories():
+    import psycopg2.extensions
+    from psycopg2.extras import RealDictCursor
+
+    class CountingCursor(RealDictCursor):
+        def execute(self, query, vars=None):
+            ROUND_TRIPS.add()
+            return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            ROUND_TRIPS.add()
+            return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            ROUND_TRIPS.add()
+            return super().copy_expert(sql, file, size)
+
+    class CountingConnection(psycopg2.extensions.connection):
+        def commit(self):
+            ROUND_TRIPS.add()
+            return super().commit()
+
+        def rollback(self):
+            ROUND_TRIPS.add()
+            return super().rollback()
+
+    return CountingCursor, CountingConnection
+
+
+# --------------------
+# Préparation
+# --------------------
+def prepare_env(backend: str, target: str):
+    """Variables lues à l'import de app : base de bench, pas de limites ni d'envois."""
+    os.environ["STORAGE_BACKEND"] = backend
+    if backend == "sqlite":
+        os.environ["SQLITE_PATH"] = target
+    else:
+        os.environ["DATABASE_URL"] = target
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    # Clients simulés par X-Forwarded-For (make_request)
+    os.environ["TRUSTED_PROXIES"] = "1"
+    os.environ["ADMIN_TOKEN"] = BENCH_ADMIN_TOKEN
+    os.environ.setdefault("BAN_POLL_INTERVAL", "0")
+    os.environ.setdefault("OUTBOX_POLL_INTERVAL", "86400")
+    os.environ.setdefault("MAILJET_API_URL", "http://127.0.0.1:9/send")
+    os.environ.setdefault("DB_POOL_MODE", "standard")
+
+
+def seed(conn, count: int):
+    """Fiches bench1..benchN (idempotent : seules les manquantes sont créées)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO ambassadors (
+                name, email, code, payout_preference, payout_identifier,
+                created_at, updated_at, clicks, signups
+            )
+            SELECT
+                'Bench ' || g,
+                'bench' || g || '@' || %(domain)s,
+                'Z' || lpad(g::text, 7, '0'),
+                'paypal',
+                'bench' || g || '@' || %(domain)s,
+                now() - g * interval '1 minute',
+                now() - g * interval '1 minute',
+                g %% 500,
+                g %% 7
+            FROM generate_series(1, %(count)s) AS g
+            ON CONFLICT DO NOTHING
+            """,
+            {"domain": BENCH_DOMAIN, "count": count},
+        )
+        created = cur.rowcount
+        cur.execute("ANALYZE ambassadors")
+    conn.commit()
+    return created
+
+
+def seed_sqlite(conn, count: int):
+    """Équivalent SQLite de seed() (CTE récursive au lieu de generate_series)."""
+    before = conn.total_changes
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(
+        """
+        WITH RECURSIVE g(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM g WHERE n < ?)
+        INSERT INTO ambassadors (
+            name, email, code, payout_preference, payout_identifier,
+            created_at, updated_at, clicks, signups
+        )
+        SELECT
+            'Bench ' || n,
+            'bench' || n || '@' || ?,
+            'Z' || substr('0000000' || n, -7),
+            'paypal',
+            'bench' || n || '@' || ?,
+            strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-' || n || ' minutes'),
+            strftime('%Y-%m-%dT%H:%M:%SZ', 'now', '-' || n || ' minutes'),
+            n % 500,
+            n % 7
+        FROM g WHERE true
+        ON CONFLICT DO NOTHING
+        """,
+        (count, BENCH_DOMAIN, BENCH_DOMAIN),
+    )
+    conn.execute("COMMIT")
+    created = conn.total_changes - before
+    conn.execute("ANALYZE ambassadors")
+    return created
+
+
+def cleanup(conn, placeholder: str = "%s"):
+    """Supprime les inscriptions créées par le bench (les fiches seedées restent)."""
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM email_outbox WHERE to_email LIKE {placeholder}", (f"%@{BENCH_DOMAIN}",))
+    cur.execute(f"DELETE FROM ambassadors WHERE email LIKE {placeholder}", (f"run-%@{BENCH_DOMAIN}",))
+    cur.close()
+    conn.commit()
+
+
+def code_for(i: int) -> str:
+    return "Z" + str(i).rjust(7, "0")
+
+
+# --------------------
+# Requêtes WSGI
+# --------------------
+def make_request(route: str, ambassadors: int, hot: int, run_id: str, n: int, rng: random.Random):
+    from werkzeug.test import EnvironBuilder
+
+    i = rng.randint(1, min(hot or ambassadors, ambassadors))
+    headers = {
+        "User-Agent": BROWSER_UA,
+        "X-Forwarded-For": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+    }
+    if route in ("redirect", "redirect-flask"):
+        builder = EnvironBuilder(path=f"/l/{code_for(i)}", headers=headers)
+    elif route == "dashboard":
+        builder = EnvironBuilder(path="/dashboard", query_string={"code": code_for(i)}, headers=headers)
+    elif route == "search":
+        # Préfixe de code, email exact, mots du nom (floue sous Postgres)
+        q = rng.choice((code_for(i)[:6], f"bench{i}@{BENCH_DOMAIN}", f"bench {i}"))
+        builder = EnvironBuilder(
+            path="/admin/ambassadors/search.json",
+            query_string={"q": q, "token": BENCH_ADMIN_TOKEN},
+            headers=headers,
+        )
+    else:
+        builder = EnvironBuilder(
+            path="/inscription",
+            method="POST",
+            headers=headers,
+            data={
+                "name": f"Run {n}",
+                "email": f"run-{run_id}-{n}@{BENCH_DOMAIN}",
+                "payout_preference": "paypal",
+                "payout_identifier": f"run-{run_id}-{n}@{BENCH_DOMAIN}",
+                "accept_terms": "1",
+            },
+        )
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def call_wsgi(wsgi_app, environ) -> int:
+    status = []
+
+    def start_response(s, headers, exc_info=None):
+        status.append(s)
+        return lambda data: None
+
+    body = wsgi_app(environ, start_response)
+    try:
+        for _chunk in body:
+            pass
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+    return int(status[0].split(" ", 1)[0])
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def current_rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def allocations(wsgi_app, route, total, args, run_id):
+    """
+    Mémoire allouée par requête (pic tracemalloc, Ko, médiane), en séquentiel :
+    objets temporaires créés par la pile WSGI / Flask et la route.
+    """
+    rng = random.Random(f"{args.seed}-{route}-alloc")
+    environs = [make_request(route, args.ambassadors, args.hot, run_id, f"alloc-{n}", rng) for n in range(total)]
+    bodies = [e["wsgi.input"].read() for e in environs]
+    peaks = []
+    tracemalloc.start()
+    try:
+        for environ, body in zip(environs, bodies):
+            environ = dict(environ)
+            environ["wsgi.input"] = io.BytesIO(body)
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            call_wsgi(wsgi_app, environ)
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    peaks.sort()
+    return round(percentile(peaks, 0.50) / 1024, 2)
+
+
+def run_level(wsgi_app, route, concurrency, total, args, run_id, flush):
+    rng = random.Random(f"{args.seed}-{route}-{concurrency}")
+    environs = [make_request(route, args.ambassadors, args.hot, run_id, f"{concurrency}-{n}", rng) for n in range(total)]
+    # Les corps POST sont des flux : une copie par requête
+    bodies = [e["wsgi.input"].read() for e in environs]
+
+    latencies = [0.0] * total
+    statuses = {}
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(n):
+        environ = dict(environs[n])
+        environ["wsgi.input"] = io.BytesIO(bodies[n])
+        started = time.perf_counter()
+        try:
+            code = call_wsgi(wsgi_app, environ)
+        except Exception:
+            code = "exception"
+        latencies[n] = time.perf_counter() - started
+        with lock:
+            statuses[str(code)] = statuses.get(str(code), 0) + 1
+            if code == "exception" or (isinstance(code, int) and code >= 500):
+                errors[0] += 1
+
+    trips_before = ROUND_TRIPS.read()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    duration = time.perf_counter() - started
+    # Les écritures différées (clics) font partie du coût : vidées avant le décompte
+    flush()
+    trips = ROUND_TRIPS.read() - trips_before
+
+    ordered = sorted(latencies)
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": total,
+        "duration_s": round(duration, 4),
+        "requests_per_s": round(total / duration, 1) if duration else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        "statuses": statuses,
+        "errors": errors[0],
+        "db_round_trips": trips,
+        "db_round_trips_per_request": round(trips / total, 3) if total else 0.0,
+        "rss_kb": current_rss_kb(),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("postgres", "sqlite"), default="postgres")
+    parser.add_argument("--ambassadors", type=int, default=1000, help="fiches seedées (1k à 1M)")
+    parser.add_argument("--hot", type=int, default=0, help="ne tirer les codes que parmi les N premiers (0 = tous)")
+    parser.add_argument("--routes", default=",".join(ROUTES))
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--requests", type=int, default=2000, help="requêtes par route et par niveau")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--allocations", type=int, default=200, help="requêtes mesurées sous tracemalloc (0 = aucune)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-seed", action="store_true", help="base déjà remplie")
+    parser.add_argument("--out", default=None, help="fichier JSON (défaut : bench/results/<commit>.json)")
+    args = parser.parse_args(argv)
+
+    env_name = "BENCH_SQLITE_PATH" if args.backend == "sqlite" else "BENCH_DATABASE_URL"
+    target = (os.environ.get(env_name) or "").strip()
+    if not target:
+        print(f"{env_name} manquante (base dédiée au bench)", file=sys.stderr)
+        return 2
+
+    routes = [r.strip() for r in args.routes.split(",") if r.strip()]
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        print(f"routes inconnues : {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    prepare_env(args.backend, target)
+
+    from contextlib import closing
+
+    if args.backend == "postgres":
+        import psycopg2
+        import migrations
+
+        with closing(psycopg2.connect(target)) as conn:
+            migrations.upgrade(conn)
+            if not args.no_seed:
+                created = seed(conn, args.ambassadors)
+                print(f"seed : {created} fiche(s) créée(s)")
+
+    import app as app_module
+
+    storage = app_module.storage
+    if args.backend == "sqlite":
+        # Schéma appliqué par l'import de app (check_schema)
+        storage.check_schema()
+        if not args.no_seed:
+            created = seed_sqlite(storage._conn(), args.ambassadors)
+            print(f"seed : {created} fiche(s) créée(s)")
+        storage.set_trace(lambda _sql: ROUND_TRIPS.add())
+    else:
+        from db_pool import pool_from_env
+
+        cursor_factory, connection_factory = counting_factories()
+        previous = storage._pool
+        storage._pool = pool_from_env(target, cursor_factory=cursor_factory, connection_factory=connection_factory)
+        if previous is not None:
+            previous.closeall()
+
+    wsgi_app = app_module.app.wsgi_app
+    # Route Flask seule, sans le fast path (ShortLinkDispatcher) devant
+    flask_wsgi = getattr(wsgi_app, "app", wsgi_app)
+    flush = app_module.click_buffer.flush
+    run_id = f"{int(time.time())}-{os.getpid()}"
+
+    results = []
+    try:
+        for route in routes:
+            target_app = flask_wsgi if route == "redirect-flask" else wsgi_app
+            if args.warmup:
+                run_level(target_app, route, 1, args.warmup, args, run_id + "-w", flush)
+            alloc_kb = allocations(target_app, route, args.allocations, args, run_id + "-a") if args.allocations else None
+            flush()
+            for concurrency in levels:
+                row = run_level(target_app, route, concurrency, args.requests, args, run_id, flush)
+                row["alloc_kb_per_request"] = alloc_kb
+                results.append(row)
+                print(
+                    f"{route:<14} c={concurrency:<4} {row['requests_per_s']:>9} req/s  "
+                    f"p50={row['p50_ms']}ms p95={row['p95_ms']}ms p99={row['p99_ms']}ms  "
+                    f"db/req={row['db_round_trips_per_request']}  alloc={alloc_kb}Ko  err={row['errors']}"
+                )
+    finally:
+        if args.backend == "sqlite":
+            cleanup(storage._conn(), placeholder="?")
+        else:
+            with closing(storage.connect()) as conn:
+                cleanup(conn)
+
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "ambassadors": args.ambassadors,
+            "hot": args.hot,
+            "backend": args.backend,
+            "requests_per_level": args.requests,
+            "storage": storage.stats(),
+        },
+        "results": results,
+    }
+
+    out = args.out or os.path.join(ROOT, "bench", "results", f"{commit[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"résultats : {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import io
+import csv
+from itertools import islice
+
+from psycopg2.extras import execute_values
+
+from storage import CODE_ATTEMPTS, random_code
+
+
+PAYOUT_PREFERENCES = ("virement", "paypal", "stripe", "autre")
+ON_EXISTING = ("update", "skip")
+MAX_REPORTED_ERRORS = 1000
+EMAIL_BATCH = 1000
+
+
+class BulkImportError(ValueError):
+    """Fichier inutilisable (en-tête absente ou colonnes obligatoires manquantes)."""
+
+
+class ImportReport:
+    """Compteurs d'un import et erreurs par ligne (les MAX_REPORTED_ERRORS premières)."""
+
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.emails = 0
+        self.error_count = 0
+        self.errors = []
+
+    def reject(self, line: int, email: str, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "email": email, "error": message})
+
+    def as_dict(self) -> dict:
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "rejected": self.error_count,
+            "emails_queued": self.emails,
+            "errors": self.errors,
+            "errors_truncated": self.error_count > len(self.errors),
+        }
+
+
+def validate_rows(text_stream, report: ImportReport, is_banned_email=None):
+    """
+    Lit en flux un CSV avec en-tête (name, email, [payout_preference],
+    [payout_identifier]) et produit les lignes valides
+    (ligne, name, email, payout_preference, payout_identifier).
+    Mêmes règles que /inscription ; un email présent deux fois dans le
+    fichier n'est gardé qu'à sa première occurrence.
+    """
+    reader = csv.DictReader(text_stream)
+    header = [(h or "").strip().lower() for h in reader.fieldnames or ()]
+    missing = [c for c in ("name", "email") if c not in header]
+    if missing:
+        raise BulkImportError(f"colonne(s) manquante(s) : {', '.join(missing)}")
+    reader.fieldnames = header
+
+    seen = set()
+    for record in reader:
+        line = reader.line_num
+        report.rows += 1
+        name = (record.get("name") or "").strip()
+        email = (record.get("email") or "").strip().lower()
+        payout_preference = (record.get("payout_preference") or "").strip().lower() or None
+        payout_identifier = (record.get("payout_identifier") or "").strip() or None
+
+        if not name or not email:
+            report.reject(line, email, "nom et email obligatoires")
+        elif "@" not in email or "." not in email:
+            report.reject(line, email, "email invalide")
+        elif payout_preference and payout_preference not in PAYOUT_PREFERENCES:
+            report.reject(line, email, f"payout_preference inconnue : {payout_preference}")
+        elif email in seen:
+            report.reject(line, email, "email en double dans le fichier")
+        elif is_banned_email and is_banned_email(email):
+            report.reject(line, email, "email banni")
+        else:
+            seen.add(email)
+            yield line, name, email, payout_preference, payout_identifier
+
+
+def import_rows(db, rows, now: str, report: ImportReport, on_existing: str = "update", new_code=random_code, email_for=None):
+    """
+    Fusionne les lignes validées dans ambassadors, dans la transaction de `db`
+    (PostgresImportDB ou SQLiteImportDB) :
+
+    1. chargement en table temporaire, un code candidat par ligne ;
+    2. emails déjà connus : mis à jour (on_existing="update") ou ignorés ;
+    3. nouveaux emails : INSERT ... SELECT ... ON CONFLICT DO NOTHING ; les
+       seules lignes restantes ont un code en collision (avec la base ou le
+       fichier) et reçoivent un nouveau tirage avant l'instruction suivante ;
+    4. emails de bienvenue des nouvelles fiches mis en outbox, par lots.
+
+    Renvoie les nouvelles fiches (id, name, email, code).
+    """
+    if on_existing not in ON_EXISTING:
+        raise ValueError(f"on_existing doit valoir {' ou '.join(ON_EXISTING)}")
+
+    db.stage((*row, new_code()) for row in rows)
+
+    if on_existing == "update":
+        report.updated = db.update_existing(now)
+    else:
+        report.skipped = db.count_existing()
+
+    inserted = []
+    for _ in range(CODE_ATTEMPTS):
+        inserted.extend(db.insert_new(now))
+        collided = db.pending_new()
+        if not collided:
+            break
+        db.recode([(line, new_code()) for line in collided])
+    else:
+        raise RuntimeError("Impossible de générer des codes ambassadeurs uniques.")
+    report.inserted = len(inserted)
+
+    if email_for:
+        for start in range(0, len(inserted), EMAIL_BATCH):
+            messages = [m for m in (email_for(row, True) for row in inserted[start : start + EMAIL_BATCH]) if m]
+            if messages:
+                db.enqueue_emails(messages)
+                report.emails += len(messages)
+
+    return inserted
+
+
+class CsvStream:
+    """
+    Fichier en lecture seule qui sérialise des tuples en CSV à la demande :
+    COPY FROM STDIN consomme le générateur sans tout charger en mémoire.
+    """
+
+    def __init__(self, rows, batch_size: int = 500):
+        self._rows = iter(rows)
+        self._batch_size = batch_size
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._pending) < size:
+            batch = list(islice(self._rows, self._batch_size))
+            if not batch:
+                break
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self._writer.writerows(batch)
+            self._pending += self._buffer.getvalue()
+        if size < 0:
+            out, self._pending = self._pending, ""
+        else:
+            out, self._pending = self._pending[:size], self._pending[size:]
+        return out
+
+
+class PostgresImportDB:
+    """Accès SQL de import_rows, dans la transaction du curseur `cur`."""
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def stage(self, rows):
+        self.cur.execute(
+            """
+            CREATE TEMP TABLE ambassador_import (
+                line INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                payout_preference TEXT,
+                payout_identifier TEXT,
+                code TEXT NOT NULL
+            ) ON COMMIT DROP
+            """
+        )
+        # Champ vide non quoté = NULL (FORMAT csv) : les None du générateur
+        self.cur.copy_expert(
+            "COPY ambassador_import (line, name, email, payout_preference, payout_identifier, code) "
+            "FROM STDIN WITH (FORMAT csv)",
+            CsvStream(rows),
+        )
+        self.cur.execute("CREATE INDEX ON ambassador_import (email); ANALYZE ambassador_import")
+
+    def update_existing(self, now) -> int:
+        self.cur.execute(
+            """
+            UPDATE ambassadors AS a SET
+                name = s.name,
+                payout_preference = COALESCE(s.payout_preference, a.payout_preference),
+                payout_identifier = COALESCE(s.payout_identifier, a.payout_identifier),
+                updated_at = %s
+            FROM ambassador_import AS s
+            WHERE a.email = s.email
+            """,
+            (now,),
+        )
+        return self.cur.rowcount
+
+    def count_existing(self) -> int:
+        self.cur.execute(
+            "SELECT count(*) AS n FROM ambassador_import AS s JOIN ambassadors AS a ON a.email = s.email"
+        )
+        return self.cur.fetchone()["n"]
+
+    def insert_new(self, now):
+        # Sans cible, ON CONFLICT DO NOTHING écarte aussi les codes en collision
+        self.cur.execute(
+            """
+            INSERT INTO ambassadors (
+                name, email, code, payout_preference, payout_identifier, created_at, updated_at
+            )
+            SELECT s.name, s.email, s.code, s.payout_preference, s.payout_identifier, %(now)s, %(now)s
+            FROM ambassador_import AS s
+            WHERE NOT EXISTS (SELECT 1 FROM ambassadors AS a WHERE a.email = s.email)
+            ORDER BY s.line
+            ON CONFLICT DO NOTHING
+            RETURNING id, name, email, code
+            """,
+            {"now": now},
+        )
+        return self.cur.fetchall()
+
+    def pending_new(self):
+        self.cur.execute(
+            """
+            SELECT s.line FROM ambassador_import AS s
+            WHERE NOT EXISTS (SELECT 1 FROM ambassadors AS a WHERE a.email = s.email)
+            ORDER BY s.line
+            """
+        )
+        return [r["line"] for r in self.cur.fetchall()]
+
+    def recode(self, pairs):
+        execute_values(
+            self.cur,
+            """
+            UPDATE ambassador_import AS s SET code = v.code
+            FROM (VALUES %s) AS v(line, code)
+            WHERE s.line = v.line
+            """,
+            pairs,
+        )
+
+    def enqueue_emails(self, messages):
+        from outbox import enqueue_emails
+
+        enqueue_emails(self.cur, messages)
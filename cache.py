@@ -0,0 +1,256 @@
+import time
+import threading
+from collections import OrderedDict
+
+from envconf import env_float, env_int
+
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Cache LRU borné avec expiration par entrée.
+    Thread-safe ; compteurs hits / misses / evictions / expirations.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._stats["misses"] += 1
+                return default
+            expires_at, value = item
+            if expires_at <= now:
+                del self._data[key]
+                self._on_remove(key, value)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._on_remove(key, old[1])
+            self._data[key] = (expires_at, value)
+            self._on_add(key, value)
+            while len(self._data) > self.maxsize:
+                old_key, (_expires, old_value) = self._data.popitem(last=False)
+                self._on_remove(old_key, old_value)
+                self._stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is not None:
+                self._on_remove(key, item[1])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._on_clear()
+
+    # Points d'extension (appelés sous verrou)
+    def _on_add(self, key, value):
+        pass
+
+    def _on_remove(self, key, value):
+        pass
+
+    def _on_clear(self):
+        pass
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["size"] = len(self._data)
+        data["maxsize"] = self.maxsize
+        lookups = data["hits"] + data["misses"]
+        data["hit_ratio"] = (data["hits"] / lookups) if lookups else 0.0
+        return data
+
+
+class AmbassadorCache(TTLCache):
+    """
+    Fiches ambassadeurs indexées par code et par email.
+
+    Chaque entrée est un tuple (row, banned) : le contrôle de bannissement est
+    fait une seule fois au chargement. Les codes inconnus sont mis en cache
+    négatif (None) avec un TTL plus court, les bots martelant /l/XXXXXX.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 30.0, negative_ttl: float = 10.0):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+        self._stats["negative_hits"] = 0
+        self._keys_by_id = {}
+
+    def lookup(self, field: str, value: str):
+        """Renvoie (row, banned), None (inconnu connu) ou MISSING."""
+        entry = self.get((field, value))
+        if entry is None:
+            with self._lock:
+                self._stats["negative_hits"] += 1
+        return entry
+
+    def put(self, row, banned: bool):
+        entry = (row, banned)
+        self.set(("code", row["code"]), entry)
+        self.set(("email", row["email"]), entry)
+
+    def put_missing(self, field: str, value: str):
+        self.set((field, value), None, ttl=self.negative_ttl)
+
+    def invalidate(self, code: str = None, email: str = None):
+        if code:
+            self.delete(("code", code))
+        if email:
+            self.delete(("email", email))
+
+    def invalidate_ids(self, ids):
+        """Oublie les fiches dont les compteurs viennent de changer en base."""
+        with self._lock:
+            keys = [k for i in ids for k in self._keys_by_id.get(i, ())]
+        for key in keys:
+            self.delete(key)
+
+    def _on_add(self, key, value):
+        if value is not None:
+            self._keys_by_id.setdefault(value[0]["id"], set()).add(key)
+
+    def _on_remove(self, key, value):
+        if value is None:
+            return
+        keys = self._keys_by_id.get(value[0]["id"])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_id[value[0]["id"]]
+
+    def _on_clear(self):
+        self._keys_by_id.clear()
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Appels concurrents pour une même clé : le premier thread exécute la
+    fonction, ceux qui arrivent pendant ce temps attendent et reçoivent son
+    résultat (ou son exception) au lieu de relancer la même requête. Rien
+    n'est gardé une fois l'appel terminé : c'est le rôle du cache.
+
+    Un thread qui attend plus de `timeout` secondes exécute la fonction
+    lui-même (appel bloqué en tête).
+    """
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "leaders": 0, "coalesced": 0, "timeouts": 0, "errors": 0, "max_waiters": 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self._stats["calls"] += 1
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self._stats["leaders"] += 1
+                leader = True
+            else:
+                flight.waiters += 1
+                self._stats["coalesced"] += 1
+                self._stats["max_waiters"] = max(self._stats["max_waiters"], flight.waiters)
+                leader = False
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                return fn()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["in_flight"] = len(self._flights)
+        data["coalesce_ratio"] = (data["coalesced"] / data["calls"]) if data["calls"] else 0.0
+        return data
+
+
+def ambassador_cache_from_env() -> AmbassadorCache:
+    """
+    Variables d'environnement :
+      - AMBASSADOR_CACHE_SIZE (défaut 10000 entrées)
+      - AMBASSADOR_CACHE_TTL (s, défaut 30)
+      - AMBASSADOR_CACHE_NEGATIVE_TTL (s, défaut 10)
+    """
+    return AmbassadorCache(
+        maxsize=env_int("AMBASSADOR_CACHE_SIZE", 10_000),
+        ttl=env_float("AMBASSADOR_CACHE_TTL", 30.0),
+        negative_ttl=env_float("AMBASSADOR_CACHE_NEGATIVE_TTL", 10.0),
+    )
+
+
+def single_flight_from_env() -> SingleFlight:
+    """
+    Variables d'environnement :
+      - LOOKUP_COALESCE_TIMEOUT (s, défaut 5 ; attente max du résultat d'un
+        autre thread avant de lancer sa propre requête)
+    """
+    return SingleFlight(timeout=env_float("LOOKUP_COALESCE_TIMEOUT", 5.0))
+
+
+def render_cache_from_env():
+    """
+    Pages de dashboard déjà rendues, indexées par leur ETag (qui couvre
+    toutes les données affichées) : le TTL ne sert qu'à borner la mémoire.
+    Variables d'environnement :
+      - DASHBOARD_RENDER_CACHE_SIZE (défaut 1000 pages ; 0 = désactivé)
+      - DASHBOARD_RENDER_CACHE_TTL (s, défaut 10)
+    Renvoie None si désactivé.
+    """
+    size = env_int("DASHBOARD_RENDER_CACHE_SIZE", 1000)
+    if size <= 0:
+        return None
+    return TTLCache(maxsize=size, ttl=env_float("DASHBOARD_RENDER_CACHE_TTL", 10.0))
@@ -0,0 +1,318 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import closing, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import jinja2
+
+from mailing import MAILJET_BATCH_MAX, build_message, mailjet_session, send_batch
+from ratelimit import MemoryStore, Rule
+from envconf import env_float, env_int
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "emails")
+
+
+class CampaignError(RuntimeError):
+    """Campagne impossible à lancer, ou envoi interrompu (Mailjet indisponible)."""
+
+
+# --------------------
+# Templates
+# --------------------
+def euros(cents) -> str:
+    """1234 -> "12,34 €"."""
+    return f"{(cents or 0) / 100:,.2f} €".replace(",", " ").replace(".", ",")
+
+
+def email_environment(directory: str = TEMPLATES_DIR) -> jinja2.Environment:
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(directory),
+        autoescape=jinja2.select_autoescape(["html"]),
+        keep_trailing_newline=True,
+    )
+    env.filters["euros"] = euros
+    return env
+
+
+def available_templates(directory: str = TEMPLATES_DIR) -> list:
+    """Templates de campagne : ceux qui ont un sujet (<nom>.subject.txt)."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f[: -len(".subject.txt")] for f in os.listdir(directory) if f.endswith(".subject.txt"))
+
+
+class CampaignTemplate:
+    """
+    Email de campagne templates/emails/<nom>.subject.txt, .txt et .html
+    (optionnel), compilés une fois et rendus pour chaque destinataire.
+    """
+
+    def __init__(self, name: str, env: jinja2.Environment = None):
+        env = env or email_environment()
+        self.name = name
+        try:
+            self.subject = env.get_template(f"{name}.subject.txt")
+            self.text = env.get_template(f"{name}.txt")
+        except jinja2.TemplateNotFound:
+            known = ", ".join(available_templates()) or "aucun"
+            raise CampaignError(f"template de campagne inconnu : {name} (disponibles : {known})")
+        try:
+            self.html = env.get_template(f"{name}.html")
+        except jinja2.TemplateNotFound:
+            self.html = None
+
+    def render(self, to_email: str, context: dict) -> dict:
+        """Message Mailjet v3.1 (mailing.build_message)."""
+        return build_message(
+            to_email,
+            " ".join(self.subject.render(context).split()),
+            self.text.render(context),
+            self.html.render(context) if self.html else None,
+        )
+
+
+# --------------------
+# Envoi
+# --------------------
+class CampaignRunner:
+    """
+    Envoie un template à tous les ambassadeurs, par lots Mailjet (un appel
+    /send par lot de `batch_size`), sur `workers` threads, au plus `rate`
+    messages par seconde.
+
+    Reprise : chaque lot terminé est enregistré (envois par ambassadeur +
+    point de reprise) dans une transaction. Le point de reprise ne dépasse
+    jamais un lot encore en vol ; les lots finis au-delà sont écartés par
+    leurs envois enregistrés. Une campagne relancée sous le même id repart
+    donc là où elle s'était arrêtée, sans doublon.
+
+    `context_for(row)` : variables du template propres à l'ambassadeur
+    (liens...) ; `is_excluded(row)` : destinataires à sauter (bannis).
+    """
+
+    def __init__(
+        self,
+        store,
+        campaign_id: str,
+        template: CampaignTemplate,
+        params: dict = None,
+        context_for=None,
+        is_excluded=None,
+        workers: int = 4,
+        batch_size: int = MAILJET_BATCH_MAX,
+        rate: float = 10.0,
+        max_retries: int = 3,
+        stale_after: float = 600.0,
+        session_factory=mailjet_session,
+        metrics=None,
+    ):
+        self.store = store
+        self.campaign_id = campaign_id
+        self.template = template
+        self.params = dict(params or {})
+        self.context_for = context_for
+        self.is_excluded = is_excluded
+        self.workers = max(1, workers)
+        self.batch_size = max(1, min(batch_size, MAILJET_BATCH_MAX))
+        self.max_retries = max(0, max_retries)
+        self.stale_after = stale_after
+        self.session_factory = session_factory
+        self.metrics = metrics
+        # Un seau partagé par les workers (rafale d'un lot)
+        self._rule = Rule(rate, self.batch_size) if rate and rate > 0 else None
+        self._bucket = MemoryStore(max_keys=1)
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    # --------------------
+    # Threads d'envoi
+    # --------------------
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.session_factory()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def _throttle(self, n: int):
+        if self._rule is None:
+            return
+        for _ in range(n):
+            while True:
+                allowed, tokens = self._bucket.take("campaign", self._rule)
+                if allowed:
+                    break
+                time.sleep((1.0 - tokens) / self._rule.rate)
+
+    def _send(self, batch):
+        """[(ambassador_id, status, message_id, error)] du lot, dans l'ordre."""
+        results = {}
+        outgoing = []
+        for row in batch:
+            if self.is_excluded and self.is_excluded(row):
+                results[row["id"]] = ("skipped", None, "exclu")
+                continue
+            context = {**self.params, **row}
+            if self.context_for:
+                context.update(self.context_for(row))
+            try:
+                outgoing.append((row["id"], self.template.render(row["email"], context)))
+            except Exception as e:
+                results[row["id"]] = ("failed", None, f"rendu : {e}")
+
+        if outgoing:
+            self._throttle(len(outgoing))
+            session = self._session()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    with self.metrics.phase("external") if self.metrics else nullcontext():
+                        sent = send_batch([m for _, m in outgoing], session=session)
+                    break
+                except RuntimeError as e:
+                    # Appel entier refusé (5xx, réseau) : rien n'est enregistré,
+                    # le lot repartira à la reprise
+                    if attempt == self.max_retries:
+                        raise CampaignError(f"lot de {len(outgoing)} message(s) en échec : {e}")
+                    delay = min(2 ** attempt, 30)
+                    logger.warning("Campagne %s : lot en échec (%s), nouvel essai dans %ss", self.campaign_id, e, delay)
+                    time.sleep(delay)
+            for (ambassador_id, _), result in zip(outgoing, sent):
+                if result["status"] == "success":
+                    results[ambassador_id] = ("sent", result.get("message_id"), None)
+                else:
+                    results[ambassador_id] = ("failed", None, result["error"])
+
+        return [(row["id"], *results[row["id"]]) for row in batch]
+
+    # --------------------
+    # Boucle principale
+    # --------------------
+    def _batches(self, after_id: int, limit: int = None):
+        batch = []
+        taken = 0
+        with closing(self.store.iter_campaign_recipients(self.campaign_id, after_id)) as rows:
+            for row in rows:
+                if limit is not None and taken >= limit:
+                    break
+                batch.append(row)
+                taken += 1
+                if len(batch) >= self.batch_size:
+                    yield batch
+                    batch = []
+            else:
+                self._exhausted = True
+        if batch:
+            yield batch
+
+    def _collect(self, pending: dict, inflight: OrderedDict, counts: dict):
+        """Attend au moins un lot, enregistre les lots terminés et avance le point de reprise."""
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            seq = pending.pop(future)
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                if self._error is None:
+                    self._error = error
+                logger.error("Campagne %s : %s", self.campaign_id, error)
+                continue
+
+            results = future.result()
+            inflight[seq][1] = True
+            checkpoint = 0
+            while inflight and next(iter(inflight.values()))[1]:
+                _, (checkpoint, _) = inflight.popitem(last=False)
+            self.store.record_campaign_batch(self.campaign_id, results, checkpoint)
+            for _, status, _, _ in results:
+                counts[status] += 1
+
+    def run(self, limit: int = None) -> dict:
+        """
+        Lance ou reprend la campagne ; `limit` : nombre maximal de
+        destinataires pour ce passage. Ctrl-C termine proprement les lots en
+        vol. Renvoie l'état de la campagne et les compteurs du passage.
+        """
+        state = self.store.start_campaign(self.campaign_id, self.template.name, self.params, self.stale_after)
+        if state is None:
+            state = self.store.get_campaign(self.campaign_id)
+            if state and state["status"] == "done":
+                return {"campaign": state, "run": {"sent": 0, "failed": 0, "skipped": 0}}
+            raise CampaignError(
+                f"campagne {self.campaign_id} déjà en cours (ou arrêtée net il y a moins de {self.stale_after:g} s)"
+            )
+        if state["template"] != self.template.name:
+            self.store.finish_campaign(self.campaign_id, "interrupted")
+            raise CampaignError(f"campagne {self.campaign_id} créée avec le template {state['template']}")
+        self.params = {**state["params"], **self.params}
+
+        logger.info("Campagne %s : reprise après l'ambassadeur %s", self.campaign_id, state["last_ambassador_id"])
+        counts = {"sent": 0, "failed": 0, "skipped": 0}
+        pending = {}  # future -> n° de lot
+        inflight = OrderedDict()  # n° de lot -> [dernier id, terminé], ordre d'envoi
+        self._error = None
+        self._exhausted = False
+        interrupted = False
+        status = "interrupted"
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="campaign") as pool:
+                batches = self._batches(state["last_ambassador_id"], limit)
+                try:
+                    for seq, batch in enumerate(batches):
+                        # Lecture bornée : au plus 2 lots en attente par worker
+                        while len(pending) >= 2 * self.workers:
+                            self._collect(pending, inflight, counts)
+                        if self._error is not None:
+                            break
+                        inflight[seq] = [batch[-1]["id"], False]
+                        pending[pool.submit(self._send, batch)] = seq
+                    while pending:
+                        self._collect(pending, inflight, counts)
+                except KeyboardInterrupt:
+                    interrupted = True
+                    logger.warning("Campagne %s interrompue : fin des lots en cours", self.campaign_id)
+                    for future in pending:
+                        future.cancel()
+                    while pending:
+                        self._collect(pending, inflight, counts)
+                finally:
+                    batches.close()
+            if self._exhausted and self._error is None and not interrupted:
+                status = "done"
+        finally:
+            self.store.finish_campaign(self.campaign_id, status)
+            with self._lock:
+                sessions, self._sessions = self._sessions, []
+            for session in sessions:
+                session.close()
+
+        return {"campaign": self.store.get_campaign(self.campaign_id), "run": counts, "error": self._error and str(self._error)}
+
+
+def campaign_runner_from_env(store, campaign_id: str, template: str, **overrides) -> CampaignRunner:
+    """
+    Variables d'environnement (surchargées par `overrides` non None) :
+      - CAMPAIGN_WORKERS (défaut 4 ; appels Mailjet simultanés)
+      - CAMPAIGN_RATE (défaut 10 messages/s ; 0 = pas de limite)
+      - CAMPAIGN_BATCH_SIZE (défaut 50, maximum Mailjet)
+      - CAMPAIGN_MAX_RETRIES (défaut 3 ; essais d'un lot refusé en entier)
+      - CAMPAIGN_STALE_AFTER (défaut 600 s ; campagne "running" sans
+        nouvelles considérée comme abandonnée et reprenable)
+    """
+    kwargs = {
+        "workers": env_int("CAMPAIGN_WORKERS", 4),
+        "rate": env_float("CAMPAIGN_RATE", 10.0),
+        "batch_size": env_int("CAMPAIGN_BATCH_SIZE", MAILJET_BATCH_MAX),
+        "max_retries": env_int("CAMPAIGN_MAX_RETRIES", 3),
+        "stale_after": env_float("CAMPAIGN_STALE_AFTER", 600.0),
+    }
+    kwargs.update({k: v for k, v in overrides.items() if v is not None})
+    return CampaignRunner(store, campaign_id, CampaignTemplate(template), **kwargs)
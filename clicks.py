@@ -0,0 +1,300 @@
+import time
+import atexit
+import hashlib
+import datetime
+import logging
+import threading
+
+from psycopg2.extras import execute_values
+
+from envconf import env_float, env_int
+
+
+logger = logging.getLogger(__name__)
+
+
+class ClickBuffer:
+    """
+    Clics en écriture différée.
+
+    record() garde l'événement en mémoire et rend la main tout de suite.
+    Un thread de fond appelle flush_fn avec tous les événements en attente
+    (un seul INSERT multi-lignes) dès que `max_pending` clics sont en attente
+    ou toutes les `interval` secondes. Fenêtre de perte bornée : au pire
+    `interval` secondes / `max_pending` clics si le process est tué sans atexit.
+    """
+
+    def __init__(self, flush_fn, max_pending: int = 500, interval: float = 2.0, max_retained: int = 100_000):
+        self.flush_fn = flush_fn
+        self.max_pending = max(1, max_pending)
+        self.interval = interval
+        self.max_retained = max_retained
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._events = []
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+        self._stats = {
+            "recorded": 0,
+            "flushed": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "dropped": 0,
+        }
+
+    # --------------------
+    # Enregistrement
+    # --------------------
+    def record(self, key, event=None):
+        """`key` sert au décompte des clics en attente (pending_for)."""
+        with self._lock:
+            self._events.append(key if event is None else event)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            self._stats["recorded"] += 1
+            due = (
+                len(self._events) >= self.max_pending
+                or time.monotonic() - self._last_flush >= self.interval
+            )
+
+        if not self.interval:
+            self.flush()
+            return
+
+        self._ensure_thread()
+        if due:
+            self._wake.set()
+
+    def pending_for(self, key) -> int:
+        with self._lock:
+            return self._pending.get(key, 0)
+
+    # --------------------
+    # Flush
+    # --------------------
+    def flush(self) -> int:
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.monotonic()
+
+            if not events:
+                return 0
+
+            try:
+                self.flush_fn(events)
+            except Exception:
+                logger.exception("Flush des clics impossible (%s événements)", len(events))
+                self._requeue(events, pending)
+                return 0
+
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["flushed"] += len(events)
+            return len(events)
+
+    def _requeue(self, events: list, pending: dict):
+        with self._lock:
+            self._stats["flush_errors"] += 1
+            room = self.max_retained - len(self._events)
+            if room < len(events):
+                self._stats["dropped"] += len(events) - max(room, 0)
+                events = events[: max(room, 0)]
+                pending = {}
+                for event in events:
+                    key = event[0] if isinstance(event, tuple) else event
+                    pending[key] = pending.get(key, 0) + 1
+            self._events[:0] = events
+            for key, n in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + n
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="click-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        """Arrêt propre : vide le buffer avant la sortie du process."""
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["pending"] = len(self._events)
+            data["pending_keys"] = len(self._pending)
+        data["max_pending"] = self.max_pending
+        data["interval"] = self.interval
+        return data
+
+
+def buffer_from_env(flush_fn) -> ClickBuffer:
+    """
+    Variables d'environnement :
+      - CLICK_FLUSH_INTERVAL (s, défaut 2 ; 0 = écriture synchrone)
+      - CLICK_FLUSH_MAX_PENDING (défaut 500)
+    """
+    buf = ClickBuffer(
+        flush_fn,
+        max_pending=env_int("CLICK_FLUSH_MAX_PENDING", 500),
+        interval=env_float("CLICK_FLUSH_INTERVAL", 2.0),
+    )
+    atexit.register(buf.close)
+    return buf
+
+
+# --------------------
+# Journal des clics (append-only) + rollups
+# --------------------
+def client_fingerprint(ip: str, user_agent: str, salt: str) -> str:
+    """Empreinte non réversible du client (IP + User-Agent salés)."""
+    raw = f"{salt}|{ip or ''}|{user_agent or ''}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+def click_event(ambassador_id: int, code: str, fingerprint: str):
+    """Événement tel qu'inséré dans click_events (ambassador_id en tête)."""
+    clicked_at = datetime.datetime.now(datetime.timezone.utc)
+    return (ambassador_id, code, clicked_at.date(), clicked_at, fingerprint)
+
+
+def insert_click_events(cur, events):
+    execute_values(
+        cur,
+        """
+        INSERT INTO click_events (ambassador_id, code, day, clicked_at, fingerprint)
+        VALUES %s
+        """,
+        events,
+        page_size=1000,
+    )
+
+
+def rollup_clicks(conn, updated_now: str, retention_days: int = 0):
+    """
+    Agrège les événements arrivés depuis le dernier passage dans click_daily
+    et dans ambassadors.clicks (total depuis toujours).
+
+    Le point de reprise est le dernier id traité (rollup_state). Le verrou
+    SHARE pris pour lire max(id) attend la fin des INSERT en cours : aucun id
+    inférieur ne peut donc être validé après coup et échapper au rollup.
+    Renvoie les ids d'ambassadeurs mis à jour.
+    """
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE click_events IN SHARE MODE")
+        cur.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM click_events")
+        upto = cur.fetchone()["max_id"]
+    conn.commit()
+
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO rollup_state (name, last_event_id)
+            VALUES ('clicks', 0)
+            ON CONFLICT (name) DO NOTHING
+            """
+        )
+        cur.execute(
+            """
+            SELECT last_event_id FROM rollup_state
+            WHERE name = 'clicks'
+            FOR UPDATE SKIP LOCKED
+            """
+        )
+        state = cur.fetchone()
+        if not state or state["last_event_id"] >= upto:
+            conn.rollback()
+            return []
+
+        cur.execute(
+            """
+            WITH fresh AS (
+                SELECT ambassador_id, day, COUNT(*) AS n
+                FROM click_events
+                WHERE id > %(since)s AND id <= %(upto)s
+                GROUP BY ambassador_id, day
+            ),
+            daily AS (
+                INSERT INTO click_daily (ambassador_id, day, clicks)
+                SELECT ambassador_id, day, n FROM fresh
+                ON CONFLICT (ambassador_id, day)
+                DO UPDATE SET clicks = click_daily.clicks + EXCLUDED.clicks
+            )
+            UPDATE ambassadors AS a
+            SET clicks = a.clicks + t.n, updated_at = %(updated_at)s
+            FROM (
+                SELECT ambassador_id, SUM(n) AS n FROM fresh GROUP BY ambassador_id
+            ) AS t
+            WHERE a.id = t.ambassador_id
+            RETURNING a.id
+            """,
+            {"since": state["last_event_id"], "upto": upto, "updated_at": updated_now},
+        )
+        ids = [r["id"] for r in cur.fetchall()]
+
+        cur.execute(
+            "UPDATE rollup_state SET last_event_id = %s, updated_at = now() WHERE name = 'clicks'",
+            (upto,),
+        )
+
+        if retention_days:
+            cur.execute(
+                "DELETE FROM click_events WHERE day < CURRENT_DATE - %s AND id <= %s",
+                (retention_days, upto),
+            )
+    conn.commit()
+    return ids
+
+
+def click_series(cur, ambassador_id: int, days: int = 30):
+    """Clics par jour sur les `days` derniers jours (jours sans clic = 0)."""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    start = today - datetime.timedelta(days=days - 1)
+    cur.execute(
+        """
+        SELECT day, clicks FROM click_daily
+        WHERE ambassador_id = %s AND day >= %s
+        """,
+        (ambassador_id, start),
+    )
+    by_day = {r["day"]: r["clicks"] for r in cur.fetchall()}
+    return [
+        (start + datetime.timedelta(days=i), by_day.get(start + datetime.timedelta(days=i), 0))
+        for i in range(days)
+    ]
+
+
+def unrolled_clicks(cur, ambassador_id: int) -> dict:
+    """
+    Clics enregistrés mais pas encore agrégés (id au-delà du point de reprise
+    du rollup), par jour. Lecture bornée aux événements depuis le dernier
+    rollup, parcourus par clé primaire.
+    """
+    cur.execute(
+        """
+        SELECT day, COUNT(*) AS n FROM click_events
+        WHERE id > COALESCE((SELECT last_event_id FROM rollup_state WHERE name = 'clicks'), 0)
+          AND ambassador_id = %s
+        GROUP BY day
+        """,
+        (ambassador_id,),
+    )
+    return {r["day"]: r["n"] for r in cur.fetchall()}
+
@@ -0,0 +1,48 @@
+-- Table des ambassadeurs (schéma Postgres historique : code, clicks, signups).
+CREATE TABLE IF NOT EXISTS ambassadors (
+    id SERIAL PRIMARY KEY,
+
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    code TEXT UNIQUE NOT NULL,
+
+    payout_preference TEXT,
+    payout_identifier TEXT,
+
+    created_at TEXT NOT NULL,
+
+    clicks INTEGER NOT NULL DEFAULT 0,
+    signups INTEGER NOT NULL DEFAULT 0
+);
+
+-- Base créée depuis l'ancien database/schema.sql (ère SQLite) :
+-- ref_code / payout_method / payout_details -> code / payout_preference / payout_identifier.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'ambassadors' AND column_name = 'ref_code'
+    ) THEN
+        ALTER TABLE ambassadors RENAME COLUMN ref_code TO code;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'ambassadors' AND column_name = 'payout_method'
+    ) THEN
+        ALTER TABLE ambassadors RENAME COLUMN payout_method TO payout_preference;
+        ALTER TABLE ambassadors ALTER COLUMN payout_preference DROP NOT NULL;
+    END IF;
+
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'ambassadors' AND column_name = 'payout_details'
+    ) THEN
+        ALTER TABLE ambassadors RENAME COLUMN payout_details TO payout_identifier;
+        ALTER TABLE ambassadors ALTER COLUMN payout_identifier DROP NOT NULL;
+    END IF;
+END
+$$;
+
+ALTER TABLE ambassadors ADD COLUMN IF NOT EXISTS clicks INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE ambassadors ADD COLUMN IF NOT EXISTS signups INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+-- Ex-db_migrate() : colonne ajoutée après coup.
+ALTER TABLE ambassadors ADD COLUMN IF NOT EXISTS updated_at TEXT;
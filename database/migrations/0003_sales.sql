@@ -0,0 +1,12 @@
+-- Ventes générées par chaque ambassadeur (reprise de l'ancien database/schema.sql).
+CREATE TABLE IF NOT EXISTS sales (
+    id BIGSERIAL PRIMARY KEY,
+    ambassador_id INTEGER NOT NULL REFERENCES ambassadors (id),
+    customer_email TEXT,
+    amount INTEGER NOT NULL,       -- montant en centimes (ex: 7990 = 79.90€)
+    subscription_id TEXT,          -- id abonnement Stripe, optionnel
+    date TIMESTAMPTZ NOT NULL DEFAULT now(),
+    paid BOOLEAN NOT NULL DEFAULT false  -- commission versée à l'ambassadeur
+);
+
+CREATE INDEX IF NOT EXISTS sales_ambassador_idx ON sales (ambassador_id);
@@ -0,0 +1,26 @@
+-- Journal des clics : append-only, regroupé par jour (colonne day).
+CREATE TABLE IF NOT EXISTS click_events (
+    id BIGSERIAL PRIMARY KEY,
+    ambassador_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    day DATE NOT NULL,
+    clicked_at TIMESTAMPTZ NOT NULL,
+    fingerprint TEXT
+);
+
+CREATE INDEX IF NOT EXISTS click_events_day_idx ON click_events (day);
+
+-- Rollups : clics par ambassadeur et par jour.
+CREATE TABLE IF NOT EXISTS click_daily (
+    ambassador_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ambassador_id, day)
+);
+
+-- Points de reprise des jobs incrémentaux.
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ
+);
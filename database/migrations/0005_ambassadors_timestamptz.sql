@@ -0,0 +1,29 @@
+-- Dates stockées en TEXT (ISO 8601) ou TIMESTAMP -> timestamptz, pour un tri indexable.
+DO $$
+BEGIN
+    IF (
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'ambassadors' AND column_name = 'created_at'
+    ) IN ('text', 'timestamp without time zone') THEN
+        ALTER TABLE ambassadors
+        ALTER COLUMN created_at TYPE TIMESTAMPTZ
+        USING NULLIF(created_at::text, '')::timestamptz;
+    END IF;
+
+    IF (
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'ambassadors' AND column_name = 'updated_at'
+    ) IN ('text', 'timestamp without time zone') THEN
+        ALTER TABLE ambassadors
+        ALTER COLUMN updated_at TYPE TIMESTAMPTZ
+        USING NULLIF(updated_at::text, '')::timestamptz;
+    END IF;
+END
+$$;
+
+-- Liste admin : pagination par clé (colonne, id).
+CREATE INDEX IF NOT EXISTS ambassadors_created_id_idx ON ambassadors (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_clicks_id_idx ON ambassadors (clicks DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_signups_id_idx ON ambassadors (signups DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_payout_created_idx
+    ON ambassadors (payout_preference, created_at DESC, id DESC);
@@ -0,0 +1,38 @@
+-- Ventes Stripe : idempotence sur l'objet Stripe (facture ou session de paiement).
+-- ambassador_id peut rester NULL le temps que l'abonnement soit attribué.
+ALTER TABLE sales ALTER COLUMN ambassador_id DROP NOT NULL;
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS stripe_object_id TEXT;
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS stripe_event_id TEXT;
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS currency TEXT;
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS kind TEXT;             -- first | renewal | one_time
+ALTER TABLE sales ADD COLUMN IF NOT EXISTS commission INTEGER NOT NULL DEFAULT 0;  -- centimes
+
+CREATE UNIQUE INDEX IF NOT EXISTS sales_stripe_object_key ON sales (stripe_object_id);
+CREATE INDEX IF NOT EXISTS sales_subscription_idx ON sales (subscription_id);
+
+-- Événements webhook déjà traités (déduplication sur l'id Stripe).
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    received_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Abonnements Stripe et ambassadeur qui les a apportés.
+CREATE TABLE IF NOT EXISTS stripe_subscriptions (
+    id TEXT PRIMARY KEY,
+    ambassador_id INTEGER REFERENCES ambassadors (id),
+    status TEXT,
+    status_at BIGINT NOT NULL DEFAULT 0,  -- horodatage Stripe du dernier statut appliqué
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Agrégats par ambassadeur, tenus à jour par le webhook : le dashboard lit une ligne.
+CREATE TABLE IF NOT EXISTS ambassador_stats (
+    ambassador_id INTEGER PRIMARY KEY REFERENCES ambassadors (id),
+    revenue_cents BIGINT NOT NULL DEFAULT 0,
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    commission_paid_cents BIGINT NOT NULL DEFAULT 0,
+    commission_unpaid_cents BIGINT NOT NULL DEFAULT 0,
+    active_subscriptions INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
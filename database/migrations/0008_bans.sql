@@ -0,0 +1,30 @@
+-- Bannissements (emails, domaines d'email, codes) modifiables sans redéploiement.
+CREATE TABLE IF NOT EXISTS bans (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL CHECK (kind IN ('email', 'domain', 'code')),
+    value TEXT NOT NULL,
+    reason TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    UNIQUE (kind, value)
+);
+
+-- Version unique, incrémentée à chaque modification de bans : les instances
+-- interrogent cette ligne et ne rechargent la liste que si elle a changé.
+CREATE TABLE IF NOT EXISTS ban_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO ban_version (id, version) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_ban_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE ban_version SET version = version + 1 WHERE id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bans_bump_version ON bans;
+CREATE TRIGGER bans_bump_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON bans
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_ban_version();
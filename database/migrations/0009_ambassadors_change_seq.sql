@@ -0,0 +1,52 @@
+-- Marqueur de modification des fiches ambassadeurs, validateur (ETag) des
+-- exports admin sans relire la table : chaque ligne insérée ou modifiée prend
+-- un numéro de séquence (pas de ligne compteur unique que tous les écrivains
+-- verrouilleraient). La valeur est écrite dans la ligne, donc répliquée avec
+-- elle : une réplique de lecture voit le numéro qui va avec ses données.
+CREATE SEQUENCE IF NOT EXISTS ambassadors_change_seq;
+
+ALTER TABLE ambassadors
+    ADD COLUMN IF NOT EXISTS change_seq BIGINT NOT NULL DEFAULT nextval('ambassadors_change_seq');
+
+CREATE INDEX IF NOT EXISTS ambassadors_change_seq_idx ON ambassadors (change_seq);
+
+CREATE OR REPLACE FUNCTION touch_ambassadors_change_seq() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('ambassadors_change_seq');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ambassadors_change_seq ON ambassadors;
+CREATE TRIGGER ambassadors_change_seq
+    BEFORE UPDATE ON ambassadors
+    FOR EACH ROW EXECUTE FUNCTION touch_ambassadors_change_seq();
+
+-- Une suppression ne laisse pas de ligne : son numéro est gardé à part (les
+-- suppressions sont rares, cette ligne n'est pas un point de contention).
+CREATE TABLE IF NOT EXISTS ambassadors_last_delete (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    change_seq BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION record_ambassadors_delete() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO ambassadors_last_delete (id, change_seq)
+    VALUES (TRUE, nextval('ambassadors_change_seq'))
+    ON CONFLICT (id) DO UPDATE SET change_seq = EXCLUDED.change_seq;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ambassadors_record_delete ON ambassadors;
+CREATE TRIGGER ambassadors_record_delete
+    AFTER DELETE OR TRUNCATE ON ambassadors
+    FOR EACH STATEMENT EXECUTE FUNCTION record_ambassadors_delete();
+
+-- Dernier numéro attribué (max sur l'index : pas de parcours de la table)
+CREATE OR REPLACE VIEW ambassadors_last_change AS
+SELECT GREATEST(
+    (SELECT max(change_seq) FROM ambassadors),
+    (SELECT change_seq FROM ambassadors_last_delete),
+    0
+) AS change_seq;
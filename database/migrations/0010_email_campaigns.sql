@@ -0,0 +1,26 @@
+-- Campagnes d'emails en masse (campaigns.py) : état et point de reprise.
+CREATE TABLE IF NOT EXISTS email_campaigns (
+    id TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'running',  -- running | interrupted | done
+    last_ambassador_id BIGINT NOT NULL DEFAULT 0,  -- ids <= entièrement traités
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+-- Un envoi par (campagne, ambassadeur) : à la reprise, les lots terminés
+-- au-delà du point de reprise ne repartent pas.
+CREATE TABLE IF NOT EXISTS email_campaign_sends (
+    campaign_id TEXT NOT NULL REFERENCES email_campaigns (id) ON DELETE CASCADE,
+    ambassador_id BIGINT NOT NULL,
+    status TEXT NOT NULL,  -- sent | failed | skipped
+    provider_message_id TEXT,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (campaign_id, ambassador_id)
+);
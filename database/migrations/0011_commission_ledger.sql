@@ -0,0 +1,45 @@
+-- Grand livre des commissions (payouts.py) : passages incrémentaux sur sales
+-- et écritures immuables (commissions, versements).
+CREATE TABLE IF NOT EXISTS commission_runs (
+    id BIGSERIAL PRIMARY KEY,
+    rules JSONB NOT NULL,  -- payouts.CommissionRules du passage
+    after_sale_id BIGINT NOT NULL,
+    checkpoint BIGINT NOT NULL,  -- ventes d'id <= traitées ; le passage suivant repart de là
+    entries INTEGER NOT NULL DEFAULT 0,
+    amount_cents BIGINT NOT NULL DEFAULT 0,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS commission_ledger (
+    id BIGSERIAL PRIMARY KEY,
+    ambassador_id BIGINT NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('commission', 'payout')),
+    sale_id BIGINT,  -- commission
+    run_id BIGINT REFERENCES commission_runs (id),  -- commission
+    payout_ref TEXT,  -- versement
+    period DATE NOT NULL,  -- premier jour du mois de la vente
+    amount_cents BIGINT NOT NULL,  -- > 0 commission, < 0 versement
+    available_at TIMESTAMPTZ NOT NULL,  -- commission acquise à partir de cette date
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS commission_ledger_sale_key
+    ON commission_ledger (sale_id) WHERE kind = 'commission';
+CREATE UNIQUE INDEX IF NOT EXISTS commission_ledger_payout_key
+    ON commission_ledger (payout_ref, ambassador_id, period) WHERE kind = 'payout';
+CREATE INDEX IF NOT EXISTS commission_ledger_ambassador_period_idx
+    ON commission_ledger (ambassador_id, period);
+CREATE INDEX IF NOT EXISTS commission_ledger_period_idx
+    ON commission_ledger (period);
+
+-- Écritures jamais modifiées ni supprimées : une correction est une nouvelle écriture
+CREATE OR REPLACE FUNCTION commission_ledger_immutable() RETURNS trigger AS $$
+BEGIN
+    RAISE EXCEPTION 'commission_ledger est en ajout seul (%)', TG_OP;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS commission_ledger_append_only ON commission_ledger;
+CREATE TRIGGER commission_ledger_append_only
+    BEFORE UPDATE OR DELETE OR TRUNCATE ON commission_ledger
+    FOR EACH STATEMENT EXECUTE FUNCTION commission_ledger_immutable();
@@ -0,0 +1,16 @@
+-- Recherche admin (search.py) : préfixes par index d'expression, mots
+-- proches par trigrammes. Les expressions doivent rester identiques à
+-- celles de search.build_search_query.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ambassadors_code_prefix_idx
+    ON ambassadors (code text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ambassadors_email_prefix_idx
+    ON ambassadors (lower(email) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ambassadors_name_prefix_idx
+    ON ambassadors (lower(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS ambassadors_payout_identifier_prefix_idx
+    ON ambassadors (lower(coalesce(payout_identifier, '')) text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS ambassadors_search_trgm_idx
+    ON ambassadors USING gin ((lower(name || ' ' || email || ' ' || code || ' ' || coalesce(payout_identifier, ''))) gin_trgm_ops);
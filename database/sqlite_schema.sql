@@ -0,0 +1,236 @@
+-- Schéma du backend SQLite (sqlite_storage.py), équivalent aux migrations
+-- Postgres 0001..0012. Dates en texte ISO 8601 UTC (tri lexicographique = chronologique).
+-- Script idempotent : rejoué en entier quand sqlite_storage.SCHEMA_VERSION augmente.
+CREATE TABLE IF NOT EXISTS ambassadors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    code TEXT UNIQUE NOT NULL,
+    payout_preference TEXT,
+    payout_identifier TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    signups INTEGER NOT NULL DEFAULT 0,
+    change_seq INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS ambassadors_created_id_idx ON ambassadors (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_clicks_id_idx ON ambassadors (clicks DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_signups_id_idx ON ambassadors (signups DESC, id DESC);
+CREATE INDEX IF NOT EXISTS ambassadors_payout_created_idx
+    ON ambassadors (payout_preference, created_at DESC, id DESC);
+
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY,
+    ambassador_id INTEGER REFERENCES ambassadors (id),
+    customer_email TEXT,
+    amount INTEGER NOT NULL,
+    subscription_id TEXT,
+    date TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    paid INTEGER NOT NULL DEFAULT 0,
+    stripe_object_id TEXT,
+    stripe_event_id TEXT,
+    currency TEXT,
+    kind TEXT,
+    commission INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS sales_ambassador_idx ON sales (ambassador_id);
+CREATE UNIQUE INDEX IF NOT EXISTS sales_stripe_object_key ON sales (stripe_object_id);
+CREATE INDEX IF NOT EXISTS sales_subscription_idx ON sales (subscription_id);
+
+CREATE TABLE IF NOT EXISTS stripe_events (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    received_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS stripe_subscriptions (
+    id TEXT PRIMARY KEY,
+    ambassador_id INTEGER,
+    status TEXT,
+    status_at INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ambassador_stats (
+    ambassador_id INTEGER PRIMARY KEY,
+    revenue_cents INTEGER NOT NULL DEFAULT 0,
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    commission_paid_cents INTEGER NOT NULL DEFAULT 0,
+    commission_unpaid_cents INTEGER NOT NULL DEFAULT 0,
+    active_subscriptions INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS click_events (
+    id INTEGER PRIMARY KEY,
+    ambassador_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    day TEXT NOT NULL,
+    clicked_at TEXT NOT NULL,
+    fingerprint TEXT
+);
+
+CREATE INDEX IF NOT EXISTS click_events_day_idx ON click_events (day);
+
+CREATE TABLE IF NOT EXISTS click_daily (
+    ambassador_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ambassador_id, day)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_state (
+    name TEXT PRIMARY KEY,
+    last_event_id INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS email_outbox (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    to_email TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+    locked_at REAL,
+    last_error TEXT,
+    provider_message_id TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    sent_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS email_outbox_due_idx ON email_outbox (status, next_attempt_at);
+
+CREATE TABLE IF NOT EXISTS bans (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL CHECK (kind IN ('email', 'domain', 'code')),
+    value TEXT NOT NULL,
+    reason TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    UNIQUE (kind, value)
+);
+
+CREATE TABLE IF NOT EXISTS ban_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO ban_version (id, version) VALUES (1, 0);
+
+CREATE TRIGGER IF NOT EXISTS bans_bump_insert AFTER INSERT ON bans
+BEGIN
+    UPDATE ban_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bans_bump_update AFTER UPDATE ON bans
+BEGIN
+    UPDATE ban_version SET version = version + 1 WHERE id = 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bans_bump_delete AFTER DELETE ON bans
+BEGIN
+    UPDATE ban_version SET version = version + 1 WHERE id = 1;
+END;
+
+-- Marqueur de modification des fiches ambassadeurs (ETag des exports admin),
+-- comme la migration Postgres 0009. SQLite n'a pas de séquence : les
+-- écritures étant sérialisées, le numéro suivant est le dernier attribué + 1.
+CREATE INDEX IF NOT EXISTS ambassadors_change_seq_idx ON ambassadors (change_seq);
+
+CREATE TABLE IF NOT EXISTS ambassadors_last_delete (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    change_seq INTEGER NOT NULL
+);
+
+CREATE VIEW IF NOT EXISTS ambassadors_last_change AS
+SELECT max(
+    coalesce((SELECT max(change_seq) FROM ambassadors), 0),
+    coalesce((SELECT change_seq FROM ambassadors_last_delete WHERE id = 1), 0)
+) AS change_seq;
+
+CREATE TRIGGER IF NOT EXISTS ambassadors_change_insert AFTER INSERT ON ambassadors
+BEGIN
+    UPDATE ambassadors SET change_seq = (SELECT change_seq + 1 FROM ambassadors_last_change) WHERE id = NEW.id;
+END;
+
+-- L'UPDATE du trigger ne le redéclenche pas (recursive_triggers désactivé)
+CREATE TRIGGER IF NOT EXISTS ambassadors_change_update AFTER UPDATE ON ambassadors
+BEGIN
+    UPDATE ambassadors SET change_seq = (SELECT change_seq + 1 FROM ambassadors_last_change) WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS ambassadors_change_delete AFTER DELETE ON ambassadors
+BEGIN
+    INSERT OR REPLACE INTO ambassadors_last_delete (id, change_seq)
+    VALUES (1, max(OLD.change_seq, (SELECT change_seq FROM ambassadors_last_change)) + 1);
+END;
+
+CREATE TABLE IF NOT EXISTS email_campaigns (
+    id TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'running',
+    last_ambassador_id INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    started_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    finished_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS email_campaign_sends (
+    campaign_id TEXT NOT NULL REFERENCES email_campaigns (id) ON DELETE CASCADE,
+    ambassador_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    provider_message_id TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    PRIMARY KEY (campaign_id, ambassador_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS commission_runs (
+    id INTEGER PRIMARY KEY,
+    rules TEXT NOT NULL,
+    after_sale_id INTEGER NOT NULL,
+    checkpoint INTEGER NOT NULL,
+    entries INTEGER NOT NULL DEFAULT 0,
+    amount_cents INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS commission_ledger (
+    id INTEGER PRIMARY KEY,
+    ambassador_id INTEGER NOT NULL,
+    kind TEXT NOT NULL CHECK (kind IN ('commission', 'payout')),
+    sale_id INTEGER,
+    run_id INTEGER REFERENCES commission_runs (id),
+    payout_ref TEXT,
+    period TEXT NOT NULL,
+    amount_cents INTEGER NOT NULL,
+    available_at TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS commission_ledger_sale_key
+    ON commission_ledger (sale_id) WHERE kind = 'commission';
+CREATE UNIQUE INDEX IF NOT EXISTS commission_ledger_payout_key
+    ON commission_ledger (payout_ref, ambassador_id, period) WHERE kind = 'payout';
+CREATE INDEX IF NOT EXISTS commission_ledger_ambassador_period_idx ON commission_ledger (ambassador_id, period);
+CREATE INDEX IF NOT EXISTS commission_ledger_period_idx ON commission_ledger (period);
+
+CREATE TRIGGER IF NOT EXISTS commission_ledger_no_update BEFORE UPDATE ON commission_ledger
+BEGIN
+    SELECT RAISE(ABORT, 'commission_ledger est en ajout seul');
+END;
+
+CREATE TRIGGER IF NOT EXISTS commission_ledger_no_delete BEFORE DELETE ON commission_ledger
+BEGIN
+    SELECT RAISE(ABORT, 'commission_ledger est en ajout seul');
+END;
+
+-- 0012 (recherche admin) : pas d'index ici, search.PrefixIndex en mémoire.
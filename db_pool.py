@@ -0,0 +1,287 @@
+import os
+import time
+import threading
+import logging
+
+import psycopg2
+import psycopg2.extensions
+
+from envconf import env_float, env_int
+
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhausted(RuntimeError):
+    """Aucune connexion libérée avant la fin du délai d'attente."""
+
+
+class PooledConnection:
+    """
+    Proxy autour d'une connexion psycopg2 : close() rend la connexion au pool
+    au lieu de la fermer, donc `with closing(pool.getconn())` reste valable partout.
+    """
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.putconn(raw)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise psycopg2.InterfaceError("connection already returned to pool")
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+
+class ConnectionPool:
+    """
+    Pool thread-safe de connexions Postgres.
+
+    - minconn / maxconn : taille du pool
+    - max_age : recyclage des connexions trop vieilles (secondes, 0 = jamais)
+    - ping_after : SELECT 1 au checkout si la connexion dort depuis plus longtemps
+    - keep_idle : nombre max de connexions gardées au repos (1 en serverless)
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        minconn: int = 1,
+        maxconn: int = 10,
+        max_age: float = 1800.0,
+        timeout: float = 5.0,
+        ping_after: float = 30.0,
+        keep_idle: int = None,
+        **connect_kwargs,
+    ):
+        if maxconn < 1:
+            raise ValueError("maxconn doit être >= 1")
+
+        self.dsn = dsn
+        self.minconn = max(0, min(minconn, maxconn))
+        self.maxconn = maxconn
+        self.max_age = max_age
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.keep_idle = maxconn if keep_idle is None else max(0, keep_idle)
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, created_at, last_used)]
+        self._born = {}  # id(conn) -> created_at
+        self._opened = 0  # connexions ouvertes ou en cours d'ouverture
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "exhausted": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "health_failures": 0,
+            "discarded": 0,
+        }
+
+        for _ in range(self.minconn):
+            with self._cond:
+                self._opened += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._opened -= 1
+                raise
+            now = time.monotonic()
+            with self._cond:
+                self._idle.append((conn, self._born[id(conn)], now))
+
+    # --------------------
+    # Interne
+    # --------------------
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        with self._cond:
+            self._born[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def _forget(self, conn, stat: str = "discarded"):
+        """Ferme une connexion et libère sa place (appelé hors verrou)."""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._opened -= 1
+            self._stats[stat] += 1
+            self._cond.notify()
+
+    def _too_old(self, created_at: float, now: float) -> bool:
+        return bool(self.max_age) and (now - created_at) > self.max_age
+
+    def _healthy(self, conn, last_used: float, now: float) -> bool:
+        if conn.closed:
+            return False
+        if self.ping_after and (now - last_used) < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    # --------------------
+    # API
+    # --------------------
+    def getconn(self) -> PooledConnection:
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+
+        while True:
+            candidate = None
+            must_open = False
+
+            with self._cond:
+                while not self._idle and self._opened >= self.maxconn:
+                    if not waited:
+                        waited = True
+                        self._stats["exhausted"] += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        logger.warning(
+                            "Pool Postgres épuisé (%s connexions) après %.2fs d'attente",
+                            self.maxconn,
+                            self.timeout,
+                        )
+                        raise PoolExhausted("Pool de connexions Postgres épuisé")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    candidate = self._idle.pop()
+                else:
+                    self._opened += 1
+                    must_open = True
+
+            if must_open:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._opened -= 1
+                        self._cond.notify()
+                    raise
+                break
+
+            conn, created_at, last_used = candidate
+            now = time.monotonic()
+
+            if self._too_old(created_at, now):
+                self._forget(conn, "recycled")
+                continue
+
+            if not self._healthy(conn, last_used, now):
+                self._forget(conn, "health_failures")
+                continue
+
+            break
+
+        wait = time.monotonic() - started
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_seconds_total"] += wait
+            if wait > self._stats["wait_seconds_max"]:
+                self._stats["wait_seconds_max"] = wait
+
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        if conn.closed:
+            self._forget(conn)
+            return
+
+        try:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            self._forget(conn)
+            return
+
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._born.get(id(conn), now)
+            keep = len(self._idle) < self.keep_idle and not self._too_old(created_at, now)
+            if keep:
+                self._idle.append((conn, created_at, now))
+                self._cond.notify()
+
+        if not keep:
+            self._forget(conn, "recycled")
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _created, _used in idle:
+            self._forget(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            data = dict(self._stats)
+            data["idle"] = len(self._idle)
+            data["in_use"] = self._opened - len(self._idle)
+            data["opened"] = self._opened
+        data["minconn"] = self.minconn
+        data["maxconn"] = self.maxconn
+        checkouts = data["checkouts"] or 1
+        data["wait_seconds_avg"] = data["wait_seconds_total"] / checkouts
+        return data
+
+
+def pool_from_env(dsn: str, **connect_kwargs) -> ConnectionPool:
+    """
+    Construit le pool à partir des variables d'environnement :
+      - DB_POOL_MODE : "serverless" | "standard" (auto : serverless si VERCEL est défini)
+      - DB_POOL_MIN / DB_POOL_MAX
+      - DB_POOL_MAX_AGE (s), DB_POOL_TIMEOUT (s), DB_POOL_PING_AFTER (s)
+    En mode serverless, une seule connexion chaude est gardée par worker
+    entre deux invocations.
+    """
+    mode = (os.environ.get("DB_POOL_MODE") or "").strip().lower()
+    if not mode:
+        mode = "serverless" if os.environ.get("VERCEL") else "standard"
+    serverless = mode == "serverless"
+
+    return ConnectionPool(
+        dsn,
+        minconn=env_int("DB_POOL_MIN", 0 if serverless else 1),
+        maxconn=env_int("DB_POOL_MAX", 2 if serverless else 10),
+        max_age=env_float("DB_POOL_MAX_AGE", 300.0 if serverless else 1800.0),
+        timeout=env_float("DB_POOL_TIMEOUT", 5.0),
+        ping_after=env_float("DB_POOL_PING_AFTER", 30.0),
+        keep_idle=1 if serverless else None,
+        **connect_kwargs,
+    )
@@ -0,0 +1,28 @@
+import os
+
+
+def env_num(name: str, default, cast=float):
+    """Variable d'environnement numérique ; absente, vide ou invalide : `default`."""
+    raw = (os.environ.get(name) or "").strip()
+    try:
+        return cast(raw) if raw else default
+    except ValueError:
+        return default
+
+
+def env_int(name: str, default: int) -> int:
+    return env_num(name, default, int)
+
+
+def env_float(name: str, default: float) -> float:
+    return env_num(name, default, float)
+
+
+def env_bool(name: str, default: bool) -> bool:
+    """Drapeau 1/0 (ou true/false, yes/no, on/off) ; absent, vide ou autre : `default`."""
+    raw = (os.environ.get(name) or "").strip().lower()
+    if raw in ("1", "true", "yes", "on"):
+        return True
+    if raw in ("0", "false", "no", "off"):
+        return False
+    return default
@@ -0,0 +1,162 @@
+import json
+import zlib
+import queue
+import threading
+
+
+EXPORT_COLUMNS = (
+    "id",
+    "name",
+    "email",
+    "code",
+    "payout_preference",
+    "payout_identifier",
+    "created_at",
+    "updated_at",
+    "clicks",
+    "signups",
+)
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def iter_server_side(
+    conn, sql: str, params=None, batch_size: int = 2000, name: str = "export_cursor", withhold: bool = False
+):
+    """
+    Parcourt une requête via un curseur nommé (côté serveur) par lots de
+    `batch_size` lignes : la mémoire reste constante quel que soit le volume.
+
+    withhold=True : curseur WITH HOLD, matérialisé par le commit qui suit
+    l'exécution ; un parcours long (entrecoupé d'envois) ne garde ensuite ni
+    transaction ni instantané ouverts.
+    """
+    with conn.cursor(name=name, withhold=withhold) as cur:
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        if withhold:
+            conn.commit()
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+def csv_escape(v) -> str:
+    v = "" if v is None else str(v)
+    v = v.replace('"', '""')
+    return f'"{v}"'
+
+
+def csv_header(columns=EXPORT_COLUMNS) -> str:
+    return ",".join(columns) + "\n"
+
+
+def csv_line(row, columns=EXPORT_COLUMNS) -> str:
+    return ",".join(csv_escape(row[c]) for c in columns) + "\n"
+
+
+def json_default(v):
+    if hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v)
+
+
+def json_chunks(rows, db: str = "postgres"):
+    """
+    JSON équivalent à {"db": ..., "count": N, "ambassadors": [...]} mais
+    produit au fil de l'eau ; "count" arrive en dernier.
+    """
+    yield '{"db": ' + json.dumps(db) + ', "ambassadors": ['
+    count = 0
+    for row in rows:
+        yield ("," if count else "") + json.dumps(dict(row), default=json_default, ensure_ascii=False)
+        count += 1
+    yield '], "count": ' + str(count) + "}"
+
+
+def buffered(chunks, min_size: int = 64 * 1024):
+    """Regroupe de petits morceaux en blocs d'au moins `min_size` octets."""
+    parts = []
+    size = 0
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzipped(chunks, level: int = 6):
+    """Compression gzip en flux (aucun buffer complet en mémoire)."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def copy_chunks(conn, sql: str, max_chunks: int = 16):
+    """
+    `COPY ... TO STDOUT` en flux : copy_expert tourne dans un thread qui écrit
+    dans une file bornée, le générateur la vide. Si le client abandonne,
+    l'écriture suivante lève une erreur et le COPY est interrompu.
+    """
+    chunks = queue.Queue(maxsize=max_chunks)
+    cancelled = threading.Event()
+    done = object()
+
+    class _Writer:
+        def write(self, data):
+            while True:
+                if cancelled.is_set():
+                    raise _Cancelled()
+                try:
+                    chunks.put(bytes(data), timeout=0.5)
+                    return len(data)
+                except queue.Full:
+                    continue
+
+    def run():
+        try:
+            with conn.cursor() as cur:
+                cur.copy_expert(sql, _Writer())
+        except _Cancelled:
+            pass
+        except Exception as exc:
+            _put(exc)
+        finally:
+            _put(done)
+
+    def _put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    worker = threading.Thread(target=run, name="copy-export", daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancelled.set()
+        worker.join()
@@ -0,0 +1,67 @@
+import re
+
+
+# Codes servis par le fast path : lettres et chiffres (random_code en donne 6,
+# les imports et le bench d'autres longueurs). Tout autre chemin sous /l/
+# (slash final, caractères spéciaux) reste à Flask, qui le traite comme avant.
+SHORT_LINK_CODE = re.compile(r"[A-Za-z0-9]{1,32}")
+
+STATUS_LINES = {
+    302: "302 FOUND",
+    404: "404 NOT FOUND",
+    429: "429 TOO MANY REQUESTS",
+    500: "500 INTERNAL SERVER ERROR",
+}
+_EMPTY = (b"",)
+
+
+class ShortLinkDispatcher:
+    """
+    Middleware WSGI monté devant Flask (app.wsgi_app) : GET / HEAD sur
+    `prefix`<code> passent directement à `handle(code, environ)`, sans
+    contexte de requête, routage, url_for ni objet Response. Tout le reste
+    (et les codes que `handle` refuse en renvoyant None) va à `app`.
+
+    `handle` renvoie (statut, [(en-tête, valeur)], corps en octets) ou None.
+    """
+
+    def __init__(self, app, handle, prefix: str = "/l/"):
+        self.app = app
+        self.handle = handle
+        self.prefix = prefix
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO") or ""
+        if path.startswith(self.prefix) and environ.get("REQUEST_METHOD") in ("GET", "HEAD"):
+            code = path[len(self.prefix):]
+            if SHORT_LINK_CODE.fullmatch(code):
+                result = self.handle(code, environ)
+                if result is not None:
+                    status, headers, body = result
+                    headers.append(("Content-Length", str(len(body))))
+                    start_response(STATUS_LINES.get(status) or str(status), headers)
+                    if environ["REQUEST_METHOD"] == "HEAD" or not body:
+                        return _EMPTY
+                    return (body,)
+        return self.app(environ, start_response)
+
+
+def client_ip(environ, trusted_proxies: int = 0) -> str:
+    """
+    IP du client (clé du rate limit et de l'anti-bot). Sans proxy de
+    confiance : REMOTE_ADDR. Derrière `trusted_proxies` proxies qui ajoutent
+    chacun l'adresse de leur pair à X-Forwarded-For : l'entrée ajoutée par
+    le premier d'entre eux, la n-ième en partant de la fin (comme le x_for
+    de werkzeug ProxyFix). Les entrées plus à gauche viennent du client, qui
+    les choisit : jamais lues. En-tête trop court : REMOTE_ADDR.
+    """
+    if trusted_proxies > 0:
+        forwarded = [ip.strip() for ip in (environ.get("HTTP_X_FORWARDED_FOR") or "").split(",")]
+        if len(forwarded) >= trusted_proxies and forwarded[-trusted_proxies]:
+            return forwarded[-trusted_proxies]
+    return environ.get("REMOTE_ADDR") or ""
+
+
+def is_prefetch(environ) -> bool:
+    purpose = environ.get("HTTP_SEC_PURPOSE") or environ.get("HTTP_PURPOSE") or ""
+    return environ.get("REQUEST_METHOD") == "HEAD" or "prefetch" in purpose.lower()
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import datetime
+
+from flask import Response, request
+
+
+def etag_for(*parts) -> str:
+    """Valeur d'ETag (non quotée) dérivée de tout ce qui détermine la réponse."""
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def files_fingerprint(directory: str) -> str:
+    """Empreinte du contenu d'un dossier (templates) : change à chaque déploiement qui le modifie."""
+    digest = hashlib.blake2b(digest_size=8)
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def to_utc(value):
+    """datetime (Postgres) ou texte ISO (SQLite) -> datetime UTC à la seconde, ou None."""
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    if not isinstance(value, datetime.datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc).replace(microsecond=0)
+
+
+def is_not_modified(etag: str, last_modified=None) -> bool:
+    """
+    Requête conditionnelle satisfaite ? If-None-Match prime sur
+    If-Modified-Since (RFC 9110), comparaison faible des ETags.
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag: str, last_modified=None, cache_control: str = None, vary: str = None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    if cache_control:
+        response.headers["Cache-Control"] = cache_control
+    if vary:
+        response.headers["Vary"] = vary
+    return response
+
+
+def not_modified(etag: str, last_modified=None, cache_control: str = None, vary: str = None):
+    """304 sans corps, avec les mêmes validateurs que la réponse complète."""
+    return with_validators(Response(status=304), etag, last_modified, cache_control, vary)
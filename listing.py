@@ -0,0 +1,155 @@
+import json
+import base64
+import datetime
+
+
+# tri -> (colonne, valeur du curseur castée côté SQL)
+SORTS = {
+    "created": ("created_at", "%s::timestamptz"),
+    "clicks": ("clicks", "%s::integer"),
+    "signups": ("signups", "%s::integer"),
+}
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+LISTING_COLUMNS = """
+    id, name, email, code,
+    payout_preference, payout_identifier,
+    created_at, updated_at,
+    clicks, signups
+"""
+
+
+class ListingError(ValueError):
+    """Paramètre de liste invalide (filtre, tri ou curseur)."""
+
+
+def _int_arg(args, name):
+    raw = (args.get(name) or "").strip()
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise ListingError(f"{name} doit être un entier")
+
+
+def _date_arg(args, name):
+    raw = (args.get(name) or "").strip()
+    if not raw:
+        return None
+    try:
+        return datetime.date.fromisoformat(raw)
+    except ValueError:
+        raise ListingError(f"{name} doit être une date AAAA-MM-JJ")
+
+
+def parse_listing_args(args) -> dict:
+    """Filtres / tri / pagination depuis request.args."""
+    sort = (args.get("sort") or "created").strip().lower()
+    if sort not in SORTS:
+        raise ListingError(f"tri inconnu : {sort}")
+
+    limit = _int_arg(args, "limit")
+    if limit is not None:
+        limit = max(1, min(limit, MAX_LIMIT))
+
+    return {
+        "payout": (args.get("payout") or "").strip() or None,
+        "min_clicks": _int_arg(args, "min_clicks"),
+        "min_signups": _int_arg(args, "min_signups"),
+        "created_from": _date_arg(args, "created_from"),
+        "created_to": _date_arg(args, "created_to"),
+        "sort": sort,
+        "limit": limit,
+        "cursor": (args.get("cursor") or "").strip() or None,
+    }
+
+
+def encode_cursor(row, sort: str) -> str:
+    column, _cast = SORTS[sort]
+    value = row[column]
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, sort: str):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception:
+        raise ListingError("curseur invalide")
+    if cursor_sort != sort:
+        raise ListingError("curseur obtenu avec un autre tri")
+    return value, int(last_id)
+
+
+def build_listing_query(opts: dict, paginate: bool = True, dialect: str = "postgres"):
+    """
+    SELECT filtré, trié sur (colonne, id) DESC. Avec un curseur, la page
+    suivante démarre par une comparaison de tuple qui suit l'index
+    correspondant : coût O(taille de page), quelle que soit la position.
+    Une ligne de plus que `limit` est demandée pour savoir s'il reste une page.
+
+    dialect="sqlite" : paramètres `?`, dates ISO 8601 comparées en texte.
+    """
+    sqlite = dialect == "sqlite"
+    column, cast = SORTS[opts["sort"]]
+    if sqlite:
+        cast = "%s"
+    where = []
+    params = []
+
+    if opts["payout"]:
+        where.append("payout_preference = %s")
+        params.append(opts["payout"])
+    if opts["min_clicks"] is not None:
+        where.append("clicks >= %s")
+        params.append(opts["min_clicks"])
+    if opts["min_signups"] is not None:
+        where.append("signups >= %s")
+        params.append(opts["min_signups"])
+    if opts["created_from"] is not None:
+        if sqlite:
+            where.append("created_at >= %s")
+            params.append(opts["created_from"].isoformat())
+        else:
+            where.append("created_at >= %s::date")
+            params.append(opts["created_from"])
+    if opts["created_to"] is not None:
+        if sqlite:
+            where.append("created_at < %s")
+            params.append((opts["created_to"] + datetime.timedelta(days=1)).isoformat())
+        else:
+            where.append("created_at < %s::date + 1")
+            params.append(opts["created_to"])
+
+    if paginate and opts["cursor"]:
+        value, last_id = decode_cursor(opts["cursor"], opts["sort"])
+        where.append(f"({column}, id) < ({cast}, %s)")
+        params.extend([value, last_id])
+
+    sql = f"SELECT {LISTING_COLUMNS} FROM ambassadors"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += f" ORDER BY {column} DESC, id DESC"
+
+    if paginate:
+        sql += " LIMIT %s"
+        params.append((opts["limit"] or DEFAULT_LIMIT) + 1)
+
+    if sqlite:
+        sql = sql.replace("%s", "?")
+    return sql, params
+
+
+def split_page(rows, opts: dict):
+    """(lignes de la page, curseur suivant ou None)."""
+    limit = opts["limit"] or DEFAULT_LIMIT
+    if len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(page[-1], opts["sort"])
@@ -1,39 +1,134 @@
 import os
-from mailjet_rest import Client
+
+import requests
+
+
+MAILJET_SEND_URL = "https://api.mailjet.com/v3.1/send"
+MAILJET_BATCH_MAX = 50  # limite de messages par appel v3.1 /send
+
+
+class MailjetNotConfigured(RuntimeError):
+    """Identifiants Mailjet absents : rien ne peut partir, inutile de réessayer."""
 
 
 def _get_env(name: str, default: str = "") -> str:
     return (os.environ.get(name) or default).strip()
 
 
-def send_ambassador_welcome_email(
-    to_email: str,
-    firstname: str,
-    code: str,
-    dashboard_url: str,
-    short_link: str,
-    tracking_target: str,  # conservé pour compatibilité (mais NON affiché)
-    is_new: bool = True,
-):
+def mailjet_configured() -> bool:
+    return bool(_get_env("MAILJET_API_KEY") and _get_env("MAILJET_API_SECRET"))
+
+
+def mailjet_session() -> requests.Session:
     """
-    Envoie un email de confirmation (récap liens) à l'ambassadeur.
-    Utilise les variables d'environnement Render:
-      - MAILJET_API_KEY
-      - MAILJET_API_SECRET
-      - MAIL_FROM_EMAIL
-      - MAIL_FROM_NAME
-      - MAIL_REPLY_TO (optionnel)
+    Session HTTP réutilisable (keep-alive) authentifiée pour Mailjet.
+    MAILJET_API_URL permet de viser un faux Mailjet local.
     """
-
     api_key = _get_env("MAILJET_API_KEY")
     api_secret = _get_env("MAILJET_API_SECRET")
 
+    if not api_key or not api_secret:
+        raise MailjetNotConfigured("MAILJET_API_KEY / MAILJET_API_SECRET manquantes")
+
+    session = requests.Session()
+    session.auth = (api_key, api_secret)
+    session.headers["Content-Type"] = "application/json"
+    return session
+
+
+def send_batch(messages: list, session: requests.Session = None, timeout: float = 15.0) -> list:
+    """
+    Envoie jusqu'à 50 messages en un seul appel v3.1 /send.
+
+    Renvoie un résultat par message, dans l'ordre :
+      {"status": "success", "message_id": "..."} ou {"status": "error", "error": "..."}
+    Lève RuntimeError si l'appel entier échoue (auth, 5xx, réseau).
+    """
+    if not messages:
+        return []
+    if len(messages) > MAILJET_BATCH_MAX:
+        raise ValueError(f"{len(messages)} messages : {MAILJET_BATCH_MAX} max par appel")
+
+    own_session = session is None
+    if own_session:
+        session = mailjet_session()
+
+    try:
+        resp = session.post(
+            _get_env("MAILJET_API_URL", MAILJET_SEND_URL),
+            json={"Messages": messages},
+            timeout=timeout,
+        )
+    except requests.RequestException as e:
+        raise RuntimeError(f"Mailjet injoignable : {e}")
+    finally:
+        if own_session:
+            session.close()
+
+    try:
+        body = resp.json()
+    except ValueError:
+        body = {}
+
+    results = body.get("Messages") if isinstance(body, dict) else None
+
+    # 400 avec détail par message : chaque message a son propre statut
+    if not isinstance(results, list) or len(results) != len(messages):
+        if resp.status_code >= 300:
+            raise RuntimeError(f"Mailjet error {resp.status_code}: {body}")
+        raise RuntimeError(f"Réponse Mailjet inattendue : {body}")
+
+    out = []
+    for item in results:
+        if item.get("Status") == "success":
+            to = (item.get("To") or [{}])[0]
+            out.append({"status": "success", "message_id": str(to.get("MessageID") or to.get("MessageUUID") or "")})
+        else:
+            errors = item.get("Errors") or []
+            detail = "; ".join(e.get("ErrorMessage") or str(e) for e in errors) or str(item)
+            out.append({"status": "error", "error": detail})
+    return out
+
+
+def build_message(to_email: str, subject: str, text_part: str, html_part: str = None) -> dict:
+    """
+    Message Mailjet v3.1 à un destinataire. Expéditeur lu dans :
+      - MAIL_FROM_EMAIL
+      - MAIL_FROM_NAME
+      - MAIL_REPLY_TO (optionnel)
+    """
     mail_from_email = _get_env("MAIL_FROM_EMAIL", "no-reply@spectramedia.online")
     mail_from_name = _get_env("MAIL_FROM_NAME", "Betty Bots — Spectra Media")
     mail_reply_to = _get_env("MAIL_REPLY_TO", "no-reply@spectramedia.online")
 
-    if not api_key or not api_secret:
-        raise RuntimeError("MAILJET_API_KEY / MAILJET_API_SECRET manquantes")
+    if not to_email:
+        raise ValueError("to_email est vide")
+
+    message = {
+        "From": {"Email": mail_from_email, "Name": mail_from_name},
+        "ReplyTo": {"Email": mail_reply_to, "Name": mail_from_name},
+        "To": [{"Email": to_email}],
+        "Subject": subject,
+        "TextPart": text_part,
+    }
+    if html_part:
+        message["HTMLPart"] = html_part
+    return message
+
+
+def build_ambassador_welcome_message(
+    to_email: str,
+    firstname: str,
+    code: str,
+    dashboard_url: str,
+    short_link: str,
+    tracking_target: str,  # conservé pour compatibilité (mais NON affiché)
+    is_new: bool = True,
+) -> dict:
+    """
+    Message Mailjet v3.1 de confirmation (récap liens) pour l'ambassadeur
+    (expéditeur : voir build_message).
+    """
 
     if not to_email:
         raise ValueError("to_email est vide")
@@ -88,25 +183,19 @@ def send_ambassador_welcome_email(
     </div>
     """
 
-    mailjet = Client(auth=(api_key, api_secret), version="v3.1")
-
-    data = {
-        "Messages": [
-            {
-                "From": {"Email": mail_from_email, "Name": mail_from_name},
-                "ReplyTo": {"Email": mail_reply_to, "Name": mail_from_name},
-                "To": [{"Email": to_email}],
-                "Subject": subject,
-                "TextPart": text_part,
-                "HTMLPart": html_part,
-            }
-        ]
-    }
+    return build_message(to_email, subject, text_part, html_part)
 
-    result = mailjet.send.create(data=data)
+
+def send_ambassador_welcome_email(**kwargs):
+    """
+    Envoi immédiat (hors outbox) de l'email de confirmation.
+    Mêmes paramètres que build_ambassador_welcome_message.
+    """
+    message = build_ambassador_welcome_message(**kwargs)
+    result = send_batch([message])[0]
 
     # Si Mailjet refuse, on veut une erreur claire (et visible dans les logs Render)
-    if result.status_code >= 300:
-        raise RuntimeError(f"Mailjet error {result.status_code}: {result.json()}")
+    if result["status"] != "success":
+        raise RuntimeError(f"Mailjet error: {result['error']}")
 
-    return result.json()
+    return result
@@ -0,0 +1,291 @@
+import re
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from functools import lru_cache
+from contextlib import contextmanager, nullcontext
+
+from envconf import env_bool, env_float
+
+
+logger = logging.getLogger(__name__)
+
+PHASES = ("connect", "query", "render", "external")
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_QUERY_LABELS = 200  # au-delà, les requêtes sont regroupées sous "other"
+MAX_QUERY_TEXT = 200
+# Textes plus longs (execute_values mogrifié : des milliers de lignes)
+# normalisés à chaque fois, jamais gardés dans le cache
+MAX_CACHED_SQL = 4096
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%\(\w+\)s|%s|\?|\$\d+")
+_ROWS = re.compile(r"\([^()]*\)(?:\s*,\s*\([^()]*\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def _normalize(sql: str) -> str:
+    sql = _SPACES.sub(" ", sql).strip()
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    # VALUES (...), (...), ... (execute_values) : une seule ligne
+    sql = _ROWS.sub(lambda m: m.group(0)[: m.group(0).index(")") + 1] + ", ...", sql)
+    if len(sql) > MAX_QUERY_TEXT:
+        sql = sql[: MAX_QUERY_TEXT - 3] + "..."
+    return sql
+
+
+_normalize_cached = lru_cache(maxsize=1024)(_normalize)
+
+
+def normalize_sql(sql) -> str:
+    """
+    Texte stable d'une requête : espaces réduits, littéraux et paramètres
+    remplacés par `?`, listes de lignes VALUES repliées, tronqué.
+    """
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)  # psycopg2.sql.Composed, etc.
+    if len(sql) > MAX_CACHED_SQL:
+        return _normalize(sql)
+    return _normalize_cached(sql)
+
+
+class Histogram:
+    """Histogramme à seaux fixes, par combinaison de labels (thread-safe)."""
+
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [compte par seau..., compte +Inf, somme]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def series_count(self) -> int:
+        with self._lock:
+            return len(self._series)
+
+    def render(self):
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(snapshot.items()):
+            base = list(zip(self.label_names, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_labels(base + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(base)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(base)} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class RequestTimer:
+    """Temps par phase d'une requête HTTP (un objet par requête)."""
+
+    __slots__ = ("started", "durations", "counts")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = dict.fromkeys(PHASES, 0.0)
+        self.counts = dict.fromkeys(PHASES, 0)
+
+    def add(self, phase: str, seconds: float):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        """Valeur de l'en-tête Server-Timing (ms), phases vides omises."""
+        parts = []
+        for phase, seconds in self.durations.items():
+            n = self.counts[phase]
+            if n:
+                parts.append(f'{phase};dur={seconds * 1000:.2f};desc="{n}x"')
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+_current = contextvars.ContextVar("betty_request_timer", default=None)
+
+
+class Metrics:
+    """
+    Instrumentation des requêtes : temps par phase (connexion, SQL, rendu,
+    appels externes) pour l'en-tête Server-Timing, et histogrammes agrégés
+    exposés au format Prometheus. Hors requête HTTP (threads de fond), seuls
+    les histogrammes sont alimentés.
+    """
+
+    def __init__(self, enabled: bool = True, slow_query_ms: float = 500.0, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.requests = Histogram(
+            "betty_request_duration_seconds", "Durée des requêtes HTTP.", ("endpoint", "status"), buckets
+        )
+        self.phases = Histogram("betty_phase_duration_seconds", "Durée par phase.", ("phase",), buckets)
+        self.queries = Histogram("betty_query_duration_seconds", "Durée par requête SQL normalisée.", ("query",), buckets)
+        self._lock = threading.Lock()
+        self._query_labels = set()
+        self.slow_queries = 0
+        self.query_errors = 0
+
+    # --------------------
+    # Requêtes HTTP
+    # --------------------
+    def start_request(self):
+        if self.enabled:
+            _current.set(RequestTimer())
+
+    def finish_request(self, endpoint: str, status: int):
+        """Clôt la requête en cours ; renvoie son RequestTimer (ou None)."""
+        timer = _current.get()
+        if timer is None:
+            return None
+        _current.set(None)
+        self.requests.observe(timer.elapsed(), (endpoint or "unknown", f"{status // 100}xx"))
+        return timer
+
+    # --------------------
+    # Phases
+    # --------------------
+    def observe_phase(self, phase: str, seconds: float):
+        if not self.enabled:
+            return
+        self.phases.observe(seconds, (phase,))
+        timer = _current.get()
+        if timer is not None:
+            timer.add(phase, seconds)
+
+    def phase(self, phase: str):
+        """Context manager : chronomètre un bloc dans la phase donnée."""
+        if not self.enabled:
+            return nullcontext()
+        return self._phase(phase)
+
+    @contextmanager
+    def _phase(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, time.perf_counter() - started)
+
+    # --------------------
+    # SQL
+    # --------------------
+    def query(self, sql):
+        """Context manager autour d'une instruction SQL (phase "query")."""
+        if not self.enabled:
+            return nullcontext()
+        return self._query(sql)
+
+    @contextmanager
+    def _query(self, sql):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.query_errors += 1
+            raise
+        finally:
+            self.observe_query(sql, time.perf_counter() - started)
+
+    def observe_query(self, sql, seconds: float):
+        self.observe_phase("query", seconds)
+        text = normalize_sql(sql)
+        with self._lock:
+            if text not in self._query_labels:
+                if len(self._query_labels) >= MAX_QUERY_LABELS:
+                    text = "other"
+                else:
+                    self._query_labels.add(text)
+        self.queries.observe(seconds, (text,))
+        if self.slow_query_ms and seconds * 1000 >= self.slow_query_ms:
+            with self._lock:
+                self.slow_queries += 1
+            logger.warning("Requête lente (%.1f ms) : %s", seconds * 1000, text)
+
+    # --------------------
+    # Export
+    # --------------------
+    def render(self, gauges: dict = None) -> str:
+        """
+        Texte d'exposition Prometheus. `gauges` : dict (éventuellement
+        imbriqué) de compteurs applicatifs, aplati en betty_<clé>_<sous-clé>.
+        """
+        lines = []
+        for histogram in (self.requests, self.phases, self.queries):
+            lines.extend(histogram.render())
+        with self._lock:
+            counters = {"betty_slow_queries_total": self.slow_queries, "betty_query_errors_total": self.query_errors}
+        for name, value in counters.items():
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        for name, value in sorted(_flatten("betty", gauges or {})):
+            lines += [f"# TYPE {name} untyped", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "slow_query_ms": self.slow_query_ms,
+                "slow_queries": self.slow_queries,
+                "query_errors": self.query_errors,
+                "query_labels": len(self._query_labels),
+            }
+
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]+")
+
+
+def _flatten(prefix: str, value):
+    """(nom, valeur) numériques d'un dict imbriqué ; le reste est ignoré."""
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            yield from _flatten(f"{prefix}_{_METRIC_NAME.sub('_', str(key)).strip('_')}", sub)
+    elif isinstance(value, bool):
+        yield prefix, int(value)
+    elif isinstance(value, (int, float)):
+        yield prefix, value
+
+
+def metrics_from_env() -> Metrics:
+    """
+    Variables d'environnement :
+      - METRICS_ENABLED (défaut 1 ; 0 = aucune mesure, /metrics en 404)
+      - SLOW_QUERY_MS (défaut 500 ; 0 = pas de log des requêtes lentes)
+    """
+    return Metrics(
+        enabled=env_bool("METRICS_ENABLED", True),
+        slow_query_ms=env_float("SLOW_QUERY_MS", 500.0),
+    )
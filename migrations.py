@@ -0,0 +1,179 @@
+"""
+Migrations versionnées du schéma Postgres.
+
+Chaque fichier database/migrations/NNNN_nom.sql est appliqué une seule fois,
+dans l'ordre, et enregistré dans la table schema_migrations.
+
+Usage :
+    python migrations.py upgrade   # applique les migrations en attente
+    python migrations.py status    # version actuelle / migrations en attente
+"""
+import os
+import re
+import sys
+import logging
+from contextlib import closing
+
+import psycopg2
+import psycopg2.errors
+from psycopg2.extras import RealDictCursor
+
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "migrations")
+MIGRATION_LOCK_ID = 727_001  # pg_advisory_lock : un seul runner à la fois
+
+_FILENAME_RE = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+
+
+class SchemaOutdated(RuntimeError):
+    """La base est en retard sur les migrations livrées avec le code."""
+
+
+def available_migrations(directory: str = MIGRATIONS_DIR):
+    """[(version, nom, chemin)] triées par version."""
+    found = []
+    for filename in os.listdir(directory):
+        m = _FILENAME_RE.match(filename)
+        if m:
+            found.append((int(m.group(1)), m.group(2), os.path.join(directory, filename)))
+    found.sort()
+
+    versions = [v for v, _name, _path in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("Deux migrations portent le même numéro de version")
+    return found
+
+
+def latest_version(directory: str = MIGRATIONS_DIR) -> int:
+    migrations = available_migrations(directory)
+    return migrations[-1][0] if migrations else 0
+
+
+def current_version(conn) -> int:
+    """Version appliquée (0 si schema_migrations n'existe pas encore)."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL AS present")
+        row = cur.fetchone()
+        present = row["present"] if isinstance(row, dict) else row[0]
+        if not present:
+            conn.rollback()
+            return 0
+        cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+        row = cur.fetchone()
+    conn.rollback()
+    return row["version"] if isinstance(row, dict) else row[0]
+
+
+def check_schema(conn, directory: str = MIGRATIONS_DIR) -> int:
+    """
+    Contrôle de démarrage : une seule requête, aucune écriture.
+    Lève SchemaOutdated si des migrations restent à appliquer.
+    """
+    expected = latest_version(directory)
+    with conn.cursor() as cur:
+        try:
+            cur.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+            row = cur.fetchone()
+            version = row["version"] if isinstance(row, dict) else row[0]
+        except psycopg2.errors.UndefinedTable:
+            version = 0
+    conn.rollback()
+
+    if version < expected:
+        raise SchemaOutdated(
+            f"Schéma en version {version}, {expected} attendue : lancer `python migrations.py upgrade`"
+        )
+    return version
+
+
+def upgrade(conn, directory: str = MIGRATIONS_DIR, target: int = None) -> list:
+    """Applique les migrations en attente (une transaction par migration)."""
+    applied = []
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+    conn.commit()
+
+    try:
+        done = current_version(conn)
+        for version, name, path in available_migrations(directory):
+            if version <= done or (target is not None and version > target):
+                continue
+
+            with open(path, encoding="utf-8") as f:
+                sql = f.read()
+
+            logger.info("Migration %04d_%s", version, name)
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name),
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append((version, name))
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+    return applied
+
+
+def _connect():
+    database_url = (os.environ.get("DATABASE_URL") or "").strip()
+    if not database_url:
+        raise RuntimeError("DATABASE_URL manquante")
+    return psycopg2.connect(database_url, cursor_factory=RealDictCursor)
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv else "status"
+
+    try:
+        from dotenv import load_dotenv  # type: ignore
+        load_dotenv()
+    except Exception:
+        pass
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with closing(_connect()) as conn:
+        if command == "upgrade":
+            target = int(argv[1]) if len(argv) > 1 else None
+            applied = upgrade(conn, target=target)
+            for version, name in applied:
+                print(f"appliquée : {version:04d}_{name}")
+            print(f"schéma en version {current_version(conn)}")
+            return 0
+
+        if command == "status":
+            version = current_version(conn)
+            print(f"version actuelle : {version}")
+            for v, name, _path in available_migrations():
+                if v > version:
+                    print(f"en attente : {v:04d}_{name}")
+            return 0
+
+    print(f"commande inconnue : {command} (upgrade | status)", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
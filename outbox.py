@@ -0,0 +1,208 @@
+import logging
+import threading
+from contextlib import nullcontext
+
+from psycopg2.extras import Json, execute_values
+
+from mailing import MAILJET_BATCH_MAX, MailjetNotConfigured, mailjet_session, send_batch
+from envconf import env_float, env_int
+
+
+logger = logging.getLogger(__name__)
+
+
+OUTBOX_MAX_ATTEMPTS = env_int("OUTBOX_MAX_ATTEMPTS", 6)
+OUTBOX_BACKOFF_BASE = env_float("OUTBOX_BACKOFF_BASE", 30.0)  # secondes
+OUTBOX_BACKOFF_MAX = env_float("OUTBOX_BACKOFF_MAX", 3600.0)
+OUTBOX_STALE_AFTER = env_float("OUTBOX_STALE_AFTER", 600.0)  # envoi interrompu
+
+
+def recipient(message: dict) -> str:
+    """Premier destinataire d'un message Mailjet (colonne to_email)."""
+    return (message.get("To") or [{}])[0].get("Email") or ""
+
+
+def enqueue_email(cur, kind: str, message: dict):
+    """
+    Ajoute un message Mailjet v3.1 à l'outbox. À appeler dans la même
+    transaction que l'écriture métier : l'email part si et seulement si
+    la transaction est validée.
+    """
+    cur.execute(
+        """
+        INSERT INTO email_outbox (kind, to_email, payload)
+        VALUES (%s, %s, %s)
+        """,
+        (kind, recipient(message), Json(message)),
+    )
+
+
+def enqueue_emails(cur, messages):
+    """enqueue_email pour une liste de (kind, message), en un INSERT multi-lignes."""
+    execute_values(
+        cur,
+        "INSERT INTO email_outbox (kind, to_email, payload) VALUES %s",
+        [(kind, recipient(message), Json(message)) for kind, message in messages],
+        page_size=1000,
+    )
+
+
+def claim_batch(conn, batch_size: int):
+    """Réserve un lot de messages dus (SKIP LOCKED : plusieurs workers possibles)."""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1, locked_at = now()
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE (status = 'pending' AND next_attempt_at <= now())
+                   OR (status = 'sending' AND locked_at < now() - make_interval(secs => %s))
+                ORDER BY id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, payload, attempts
+            """,
+            (OUTBOX_STALE_AFTER, batch_size),
+        )
+        rows = sorted(cur.fetchall(), key=lambda r: r["id"])
+    conn.commit()
+    return rows
+
+
+def _backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)), OUTBOX_BACKOFF_MAX)
+
+
+def plan_updates(rows, results):
+    """
+    Statut par message : sent, ou retour en file avec backoff, ou failed.
+    [(id, status, message_id, error, délai en secondes)].
+    """
+    updates = []
+    for row, result in zip(rows, results):
+        if result["status"] == "success":
+            updates.append((row["id"], "sent", result.get("message_id"), None, 0.0))
+        elif row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+            updates.append((row["id"], "failed", None, result["error"], 0.0))
+        else:
+            updates.append((row["id"], "pending", None, result["error"], _backoff(row["attempts"])))
+    return updates
+
+
+def record_updates(conn, updates):
+    with conn.cursor() as cur:
+        execute_values(
+            cur,
+            """
+            UPDATE email_outbox AS o
+            SET status = v.status,
+                provider_message_id = COALESCE(v.message_id, o.provider_message_id),
+                last_error = v.error,
+                next_attempt_at = now() + make_interval(secs => v.delay),
+                sent_at = CASE WHEN v.status = 'sent' THEN now() ELSE o.sent_at END,
+                locked_at = NULL
+            FROM (VALUES %s) AS v(id, status, message_id, error, delay)
+            WHERE o.id = v.id
+            """,
+            updates,
+            template="(%s, %s, %s, %s, %s::float8)",
+        )
+    conn.commit()
+
+
+def drain_outbox(
+    store, session=None, batch_size: int = MAILJET_BATCH_MAX, max_batches: int = None, metrics=None
+) -> dict:
+    """
+    Vide l'outbox par lots de `batch_size` messages (un appel /send par lot)
+    en réutilisant une seule session HTTP. `store` : backend de stockage
+    (claim_outbox / record_outbox) ; `metrics` : chronomètre les appels
+    Mailjet (phase "external"). Renvoie les compteurs du passage.
+    """
+    batch_size = max(1, min(batch_size, MAILJET_BATCH_MAX))
+    counts = {"batches": 0, "sent": 0, "retried": 0, "failed": 0}
+
+    own_session = session is None
+    if own_session:
+        session = mailjet_session()
+
+    try:
+        while max_batches is None or counts["batches"] < max_batches:
+            rows = store.claim_outbox(batch_size)
+            if not rows:
+                break
+
+            try:
+                with metrics.phase("external") if metrics else nullcontext():
+                    results = send_batch([r["payload"] for r in rows], session=session)
+            except Exception as e:
+                logger.warning("Lot outbox en échec (%s messages) : %s", len(rows), e)
+                results = [{"status": "error", "error": str(e)}] * len(rows)
+
+            store.record_outbox(plan_updates(rows, results))
+
+            counts["batches"] += 1
+            for row, result in zip(rows, results):
+                if result["status"] == "success":
+                    counts["sent"] += 1
+                elif row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                    counts["failed"] += 1
+                else:
+                    counts["retried"] += 1
+
+            if not any(r["status"] == "success" for r in results):
+                # Mailjet refuse tout : inutile d'enchaîner les lots maintenant
+                break
+    finally:
+        if own_session:
+            session.close()
+
+    return counts
+
+
+class OutboxWorker:
+    """
+    Thread de fond qui vide l'outbox : réveillé par kick() après une
+    inscription, et toutes les `interval` secondes pour les reprises.
+    Sans identifiants Mailjet, le thread s'arrête (un seul avertissement) :
+    les messages restent en file pour drain-outbox ou /admin/outbox/drain.
+    """
+
+    def __init__(self, store, interval: float = 30.0, metrics=None):
+        self.store = store
+        self.metrics = metrics
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = None
+        self._disabled = False
+        self.last_counts = None
+
+    def kick(self):
+        with self._lock:
+            if self._disabled:
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="outbox-worker", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if self._session is None:
+                    self._session = mailjet_session()
+            except MailjetNotConfigured as e:
+                logger.warning("Worker outbox arrêté : %s (messages gardés en file)", e)
+                with self._lock:
+                    self._disabled = True
+                return
+            try:
+                self.last_counts = drain_outbox(self.store, session=self._session, metrics=self.metrics)
+            except Exception:
+                logger.exception("Worker outbox : passage en échec")
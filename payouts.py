@@ -0,0 +1,370 @@
+import re
+import json
+import logging
+import datetime
+
+from stripe_sales import COMMISSION_RECURRING_CENTS, COMMISSION_UPFRONT_RATE
+from envconf import env_float, env_int
+
+
+logger = logging.getLogger(__name__)
+
+# Vente sans ambassadeur plus ancienne : achat direct, le point de reprise la dépasse
+ORPHAN_GRACE_DAYS = 7
+
+STATEMENT_COLUMNS = (
+    "period",
+    "ambassador_id",
+    "name",
+    "email",
+    "code",
+    "payout_preference",
+    "payout_identifier",
+    "sales",
+    "commission_cents",
+    "pending_cents",
+    "earned_cents",
+    "paid_cents",
+    "payable_cents",
+)
+
+
+class PayoutError(ValueError):
+    """Période ou référence de versement invalide."""
+
+
+def parse_period(raw: str):
+    """"2026-03" (ou "2026-03-15") -> "2026-03-01" ; vide -> None."""
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    m = re.fullmatch(r"(\d{4})-(\d{2})(?:-\d{2})?", raw)
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        raise PayoutError(f"période invalide : {raw} (attendu AAAA-MM)")
+    return f"{m.group(1)}-{m.group(2)}-01"
+
+
+class CommissionRules:
+    """
+    Règles appliquées aux ventes au moment où elles entrent dans le grand
+    livre (centimes) :
+      - upfront_rate : part du premier paiement (ou d'un achat unique)
+      - recurring_cents : montant fixe par mensualité suivante (au plus la mensualité)
+      - recurring_months : mensualités commissionnées par abonnement (0 = toutes)
+      - sale_cap_cents : plafond par vente (0 = aucun)
+      - period_cap_cents : plafond par ambassadeur et par mois (0 = aucun)
+      - hold_days : délai avant qu'une commission soit acquise (remboursements)
+    """
+
+    def __init__(
+        self,
+        upfront_rate: float = COMMISSION_UPFRONT_RATE,
+        recurring_cents: int = COMMISSION_RECURRING_CENTS,
+        recurring_months: int = 0,
+        sale_cap_cents: int = 0,
+        period_cap_cents: int = 0,
+        hold_days: int = 30,
+    ):
+        self.upfront_rate = max(0.0, float(upfront_rate))
+        self.recurring_cents = max(0, int(recurring_cents))
+        self.recurring_months = max(0, int(recurring_months))
+        self.sale_cap_cents = max(0, int(sale_cap_cents))
+        self.period_cap_cents = max(0, int(period_cap_cents))
+        self.hold_days = max(0, int(hold_days))
+
+    def as_dict(self) -> dict:
+        return {
+            "upfront_rate": self.upfront_rate,
+            "recurring_cents": self.recurring_cents,
+            "recurring_months": self.recurring_months,
+            "sale_cap_cents": self.sale_cap_cents,
+            "period_cap_cents": self.period_cap_cents,
+            "hold_days": self.hold_days,
+        }
+
+
+def commission_rules_from_env() -> CommissionRules:
+    """
+    Variables d'environnement :
+      - COMMISSION_UPFRONT_RATE (défaut 0.30)
+      - COMMISSION_RECURRING_CENTS (défaut 1000)
+      - COMMISSION_RECURRING_MONTHS (défaut 0 = sans limite)
+      - COMMISSION_SALE_CAP_CENTS (défaut 0 = sans plafond)
+      - COMMISSION_PERIOD_CAP_CENTS (défaut 0 = sans plafond mensuel)
+      - COMMISSION_HOLD_DAYS (défaut 30)
+    """
+    return CommissionRules(
+        upfront_rate=env_float("COMMISSION_UPFRONT_RATE", COMMISSION_UPFRONT_RATE),
+        recurring_cents=env_int("COMMISSION_RECURRING_CENTS", COMMISSION_RECURRING_CENTS),
+        recurring_months=env_int("COMMISSION_RECURRING_MONTHS", 0),
+        sale_cap_cents=env_int("COMMISSION_SALE_CAP_CENTS", 0),
+        period_cap_cents=env_int("COMMISSION_PERIOD_CAP_CENTS", 0),
+        hold_days=env_int("COMMISSION_HOLD_DAYS", 30),
+    )
+
+
+# --------------------
+# Accès SQL
+# --------------------
+class PostgresLedgerDB:
+    """
+    Accès SQL de update_ledger et des relevés, dans la transaction du curseur
+    `cur`. Le backend SQLite fournit les mêmes méthodes (sqlite_storage.py).
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def lock(self, sales: bool = True):
+        # Un seul passage (ou versement) à la fois ; SHARE sur sales attend les
+        # webhooks en cours : aucun id inférieur à max(id) ne peut encore apparaître
+        self.cur.execute("LOCK TABLE commission_runs IN EXCLUSIVE MODE")
+        if sales:
+            self.cur.execute("LOCK TABLE sales IN SHARE MODE")
+
+    def checkpoint(self) -> int:
+        self.cur.execute("SELECT COALESCE(MAX(checkpoint), 0) AS checkpoint FROM commission_runs")
+        return self.cur.fetchone()["checkpoint"]
+
+    def max_sale_id(self) -> int:
+        self.cur.execute("SELECT COALESCE(MAX(id), 0) AS id FROM sales")
+        return self.cur.fetchone()["id"]
+
+    def first_orphan(self, after: int, upto: int, since: str):
+        """Première vente récente sans ambassadeur (rattachable plus tard) dans (after, upto]."""
+        self.cur.execute(
+            """
+            SELECT MIN(id) AS id FROM sales
+            WHERE id > %s AND id <= %s AND ambassador_id IS NULL AND date > %s
+            """,
+            (after, upto, since),
+        )
+        return self.cur.fetchone()["id"]
+
+    def open_run(self, rules: dict, after: int, checkpoint: int) -> int:
+        self.cur.execute(
+            "INSERT INTO commission_runs (rules, after_sale_id, checkpoint) VALUES (%s, %s, %s) RETURNING id",
+            (json.dumps(rules), after, checkpoint),
+        )
+        return self.cur.fetchone()["id"]
+
+    def insert_commissions(self, run_id: int, after: int, upto: int, rules: dict) -> dict:
+        """
+        Une requête : commissions de toutes les ventes attribuées de (after,
+        upto] pas encore au grand livre, règles et plafonds appliqués. L'écart
+        avec l'estimation du webhook (sales.commission : plafond mensuel,
+        mensualités au-delà de recurring_months) est reporté dans
+        ambassador_stats, que le dashboard affiche.
+        """
+        self.cur.execute(
+            """
+            WITH batch AS (
+                SELECT s.id, s.ambassador_id, s.amount, s.kind, s.subscription_id, s.date,
+                       date_trunc('month', s.date AT TIME ZONE 'UTC')::date AS period
+                FROM sales s
+                WHERE s.id > %(after)s AND s.id <= %(upto)s
+                  AND s.ambassador_id IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM commission_ledger l WHERE l.kind = 'commission' AND l.sale_id = s.id
+                  )
+            ),
+            renewals AS (
+                SELECT r.id, row_number() OVER (PARTITION BY r.subscription_id ORDER BY r.date, r.id) AS n
+                FROM sales r
+                WHERE r.kind = 'renewal'
+                  AND r.subscription_id IN (SELECT subscription_id FROM batch WHERE kind = 'renewal')
+            ),
+            due AS (
+                SELECT b.*,
+                       LEAST(
+                           CASE
+                               WHEN b.kind = 'renewal' AND (%(recurring_months)s = 0 OR r.n <= %(recurring_months)s)
+                                   THEN LEAST(%(recurring_cents)s, b.amount)
+                               WHEN b.kind = 'renewal' THEN 0
+                               ELSE round(b.amount * %(upfront_rate)s::float8)::bigint
+                           END,
+                           CASE WHEN %(sale_cap_cents)s > 0 THEN %(sale_cap_cents)s END
+                       ) AS cents
+                FROM batch b
+                LEFT JOIN renewals r ON r.id = b.id
+            ),
+            running AS (
+                SELECT d.*,
+                       SUM(d.cents) OVER (PARTITION BY d.ambassador_id, d.period ORDER BY d.date, d.id) - d.cents AS earlier,
+                       (
+                           SELECT COALESCE(SUM(l.amount_cents), 0) FROM commission_ledger l
+                           WHERE l.kind = 'commission' AND l.ambassador_id = d.ambassador_id AND l.period = d.period
+                       ) AS booked
+                FROM due d
+            ),
+            inserted AS (
+                INSERT INTO commission_ledger (ambassador_id, kind, sale_id, run_id, period, amount_cents, available_at)
+                SELECT ambassador_id, 'commission', id, %(run_id)s, period,
+                       CASE
+                           WHEN %(period_cap_cents)s > 0
+                               THEN GREATEST(LEAST(cents, %(period_cap_cents)s - booked - earlier), 0)
+                           ELSE cents
+                       END,
+                       date + make_interval(days => %(hold_days)s)
+                FROM running
+                ON CONFLICT (sale_id) WHERE kind = 'commission' DO NOTHING
+                RETURNING ambassador_id, sale_id, amount_cents
+            ),
+            adjust AS (
+                SELECT i.ambassador_id, SUM(i.amount_cents - s.commission)::bigint AS cents
+                FROM inserted i
+                JOIN sales s ON s.id = i.sale_id
+                GROUP BY i.ambassador_id
+                HAVING SUM(i.amount_cents - s.commission) <> 0
+            ),
+            stats AS (
+                UPDATE ambassador_stats st SET
+                    commission_unpaid_cents = GREATEST(st.commission_unpaid_cents + a.cents, 0),
+                    updated_at = now()
+                FROM adjust a
+                WHERE st.ambassador_id = a.ambassador_id
+            ),
+            touched AS (
+                UPDATE ambassadors am SET updated_at = now()
+                FROM adjust a
+                WHERE am.id = a.ambassador_id
+            )
+            SELECT COUNT(*) AS entries, COALESCE(SUM(amount_cents), 0)::bigint AS amount_cents FROM inserted
+            """,
+            {**rules, "run_id": run_id, "after": after, "upto": upto},
+        )
+        return self.cur.fetchone()
+
+    def close_run(self, run_id: int, entries: int, amount_cents: int):
+        self.cur.execute(
+            "UPDATE commission_runs SET entries = %s, amount_cents = %s WHERE id = %s",
+            (entries, amount_cents, run_id),
+        )
+
+    def discard_run(self, run_id: int):
+        self.cur.execute("DELETE FROM commission_runs WHERE id = %s", (run_id,))
+
+    def statement(self, now, period=None, ambassador_id=None):
+        """Relevé par (période, ambassadeur) : une agrégation sur le grand livre."""
+        self.cur.execute(
+            """
+            SELECT t.period, a.id AS ambassador_id, a.name, a.email, a.code,
+                   a.payout_preference, a.payout_identifier,
+                   t.sales, t.commission_cents, t.pending_cents, t.earned_cents, t.paid_cents,
+                   t.earned_cents - t.paid_cents AS payable_cents
+            FROM (
+                SELECT l.ambassador_id, l.period,
+                       COUNT(*) FILTER (WHERE l.kind = 'commission') AS sales,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission'), 0)::bigint AS commission_cents,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission' AND l.available_at > %(now)s), 0)::bigint AS pending_cents,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission' AND l.available_at <= %(now)s), 0)::bigint AS earned_cents,
+                       COALESCE(-SUM(l.amount_cents) FILTER (WHERE l.kind = 'payout'), 0)::bigint AS paid_cents
+                FROM commission_ledger l
+                WHERE (%(period)s::date IS NULL OR l.period = %(period)s::date)
+                  AND (%(ambassador_id)s::bigint IS NULL OR l.ambassador_id = %(ambassador_id)s::bigint)
+                GROUP BY l.ambassador_id, l.period
+            ) t
+            JOIN ambassadors a ON a.id = t.ambassador_id
+            ORDER BY t.period, a.id
+            """,
+            {"now": now, "period": period, "ambassador_id": ambassador_id},
+        )
+        return self.cur.fetchall()
+
+    def pay(self, reference: str, now, through=None):
+        """
+        Versement de tout le solde acquis (jusqu'au mois `through` inclus) :
+        une écriture négative par (ambassadeur, période), report dans
+        ambassador_stats et updated_at des fiches (ETag du dashboard).
+        Renvoie [{"ambassador_id", "cents"}].
+        """
+        self.cur.execute(
+            """
+            WITH due AS (
+                SELECT l.ambassador_id, l.period,
+                       SUM(l.amount_cents) FILTER (
+                           WHERE l.kind = 'payout' OR l.available_at <= %(now)s
+                       )::bigint AS cents
+                FROM commission_ledger l
+                WHERE %(through)s::date IS NULL OR l.period <= %(through)s::date
+                GROUP BY l.ambassador_id, l.period
+            ),
+            paid AS (
+                INSERT INTO commission_ledger (ambassador_id, kind, payout_ref, period, amount_cents, available_at)
+                SELECT ambassador_id, 'payout', %(reference)s, period, -cents, %(now)s
+                FROM due
+                WHERE cents > 0
+                ON CONFLICT (payout_ref, ambassador_id, period) WHERE kind = 'payout' DO NOTHING
+                RETURNING ambassador_id, -amount_cents AS cents
+            ),
+            totals AS (
+                SELECT ambassador_id, SUM(cents)::bigint AS cents FROM paid GROUP BY ambassador_id
+            ),
+            stats AS (
+                UPDATE ambassador_stats s SET
+                    commission_paid_cents = s.commission_paid_cents + t.cents,
+                    commission_unpaid_cents = GREATEST(s.commission_unpaid_cents - t.cents, 0),
+                    updated_at = now()
+                FROM totals t
+                WHERE s.ambassador_id = t.ambassador_id
+            ),
+            touched AS (
+                UPDATE ambassadors a SET updated_at = now()
+                FROM totals t
+                WHERE a.id = t.ambassador_id
+            )
+            SELECT ambassador_id, cents FROM totals ORDER BY ambassador_id
+            """,
+            {"reference": reference, "now": now, "through": through},
+        )
+        return self.cur.fetchall()
+
+
+# --------------------
+# Passage incrémental
+# --------------------
+def orphan_cutoff(days: int = ORPHAN_GRACE_DAYS) -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+
+
+def update_ledger(db, rules: CommissionRules, orphan_since, full: bool = False) -> dict:
+    """
+    Porte au grand livre les ventes arrivées depuis le dernier passage, dans
+    la transaction de `db` (déjà verrouillée par db.lock()).
+
+    Le point de reprise avance jusqu'à la dernière vente, sauf s'il reste une
+    vente sans ambassadeur datée d'après `orphan_since` : le webhook peut
+    encore la rattacher, le point s'arrête juste avant. full=True repart de
+    la première vente (ventes rattachées tardivement) ; les ventes déjà au
+    grand livre sont ignorées dans tous les cas.
+    """
+    previous = db.checkpoint()
+    after = 0 if full else previous
+    upto = db.max_sale_id()
+    if upto <= after:
+        return {"run_id": None, "after": after, "checkpoint": after, "entries": 0, "amount_cents": 0}
+
+    orphan = db.first_orphan(after, upto, orphan_since)
+    checkpoint = upto if orphan is None else orphan - 1
+    if full:
+        checkpoint = max(checkpoint, previous)
+
+    run_id = db.open_run(rules.as_dict(), after, checkpoint)
+    result = db.insert_commissions(run_id, after, upto, rules.as_dict())
+    if not result["entries"] and checkpoint == previous:
+        # Rien de nouveau (cron) : pas de passage vide dans l'historique
+        db.discard_run(run_id)
+        run_id = None
+    else:
+        db.close_run(run_id, result["entries"], result["amount_cents"])
+    logger.info(
+        "Grand livre : %s commission(s), %s centimes (ventes %s..%s, reprise après %s)",
+        result["entries"], result["amount_cents"], after + 1, upto, checkpoint,
+    )
+    return {
+        "run_id": run_id,
+        "after": after,
+        "checkpoint": checkpoint,
+        "entries": result["entries"],
+        "amount_cents": result["amount_cents"],
+    }
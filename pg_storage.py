@@ -0,0 +1,584 @@
+import logging
+import threading
+from contextlib import closing, contextmanager
+
+import psycopg2
+import psycopg2.errors
+from psycopg2.extensions import connection as PgConnection, encodings
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from storage import CODE_ATTEMPTS, Storage, random_code
+from db_pool import PoolExhausted, pool_from_env
+from migrations import SchemaOutdated, check_schema
+from clicks import click_series, insert_click_events, rollup_clicks, unrolled_clicks
+from listing import build_listing_query
+from search import build_search_query
+from exports import copy_chunks, iter_server_side
+from stripe_sales import PostgresStripeDB, process_events
+from bulk_import import PostgresImportDB, import_rows
+from payouts import PostgresLedgerDB, orphan_cutoff, update_ledger
+from replica import LAG_SQL, replica_monitor_from_env
+
+
+logger = logging.getLogger(__name__)
+
+
+def upsert_ambassador(cur, name, email, payout_preference, payout_identifier, now, new_code=random_code):
+    """
+    Inscription ou mise à jour en un seul aller-retour :
+    INSERT ... ON CONFLICT (email) DO UPDATE ... RETURNING.
+
+    Le code candidat n'est pas vérifié au préalable : en cas de collision
+    (violation UNIQUE sur code), on revient au savepoint et on retente avec
+    un autre code. Le savepoint part dans le même execute que l'INSERT.
+    Renvoie la ligne complète + `inserted` (True si nouvel ambassadeur).
+    """
+    for _ in range(CODE_ATTEMPTS):
+        try:
+            cur.execute(
+                """
+                SAVEPOINT upsert_ambassador;
+                INSERT INTO ambassadors (
+                    name, email, code,
+                    payout_preference, payout_identifier,
+                    created_at, updated_at
+                )
+                VALUES (%(name)s, %(email)s, %(code)s, %(pp)s, %(pi)s, %(now)s, %(now)s)
+                ON CONFLICT (email) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    payout_preference = COALESCE(EXCLUDED.payout_preference, ambassadors.payout_preference),
+                    payout_identifier = COALESCE(EXCLUDED.payout_identifier, ambassadors.payout_identifier),
+                    updated_at = EXCLUDED.updated_at
+                RETURNING *, (xmax = 0) AS inserted
+                """,
+                {
+                    "name": name,
+                    "email": email,
+                    "code": new_code(),
+                    "pp": payout_preference,
+                    "pi": payout_identifier,
+                    "now": now,
+                },
+            )
+        except psycopg2.errors.UniqueViolation:
+            # Seule autre contrainte unique que l'email : le code
+            cur.execute("ROLLBACK TO SAVEPOINT upsert_ambassador")
+            continue
+        return cur.fetchone()
+
+    raise RuntimeError("Impossible de générer un code ambassadeur unique.")
+
+
+def timed_factories(metrics, cursor_base=RealDictCursor, connection_base=PgConnection):
+    """Curseur et connexion psycopg2 qui chronomètrent chaque instruction (et commit/rollback)."""
+
+    class TimedCursor(cursor_base):
+        def execute(self, query, vars=None):
+            with metrics.query(query):
+                return super().execute(query, vars)
+
+        def executemany(self, query, vars_list):
+            with metrics.query(query):
+                return super().executemany(query, vars_list)
+
+        def copy_expert(self, sql, file, size=8192):
+            with metrics.query(sql):
+                return super().copy_expert(sql, file, size)
+
+    class TimedConnection(connection_base):
+        def commit(self):
+            with metrics.query("COMMIT"):
+                return super().commit()
+
+        def rollback(self):
+            with metrics.query("ROLLBACK"):
+                return super().rollback()
+
+    return TimedCursor, TimedConnection
+
+
+class PostgresStorage(Storage):
+    """
+    Backend Postgres : pool partagé (créé au premier appel), SQL de production.
+    `read_dsn` : réplique de lecture optionnelle, servie dans replica_reads()
+    tant que son retard reste sous DATABASE_READ_MAX_LAG (primaire sinon).
+    """
+
+    name = "postgres"
+
+    # Secondes : une réplique injoignable doit échouer vite (repli sur le primaire)
+    read_connect_timeout = 3
+
+    def __init__(self, dsn: str, read_dsn: str = None, **connect_kwargs):
+        self.dsn = dsn
+        self.read_dsn = read_dsn or None
+        self.connect_kwargs = {"cursor_factory": RealDictCursor, **connect_kwargs}
+        self._pool = None
+        self._read_pool = None
+        self._pool_lock = threading.Lock()
+        self._local = threading.local()
+        self.replica = replica_monitor_from_env() if self.read_dsn else None
+
+    def _new_pool(self, dsn: str, **extra):
+        kwargs = {**self.connect_kwargs, **extra}
+        if self.metrics is not None:
+            kwargs["cursor_factory"], kwargs["connection_factory"] = timed_factories(
+                self.metrics, kwargs["cursor_factory"], kwargs.get("connection_factory", PgConnection)
+            )
+        return pool_from_env(dsn, **kwargs)
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = self._new_pool(self.dsn)
+        return self._pool
+
+    @property
+    def read_pool(self):
+        if self._read_pool is None:
+            with self._pool_lock:
+                if self._read_pool is None:
+                    self._read_pool = self._new_pool(self.read_dsn, connect_timeout=self.read_connect_timeout)
+        return self._read_pool
+
+    def connect(self):
+        """Connexion empruntée au pool : close() la rend au pool."""
+        if self.metrics is None:
+            return self.pool.getconn()
+        with self.metrics.phase("connect"):
+            return self.pool.getconn()
+
+    # --------------------
+    # Réplique de lecture
+    # --------------------
+    @contextmanager
+    def replica_reads(self):
+        previous = getattr(self._local, "replica", False)
+        self._local.replica = self.replica is not None
+        try:
+            yield
+        finally:
+            self._local.replica = previous
+
+    def reads_replica(self) -> bool:
+        """Route des lectures, à fixer à l'appel (les générateurs se connectent plus tard)."""
+        return getattr(self._local, "replica", False)
+
+    def connect_read(self, replica: bool = None):
+        """
+        Connexion pour une lecture : réplique dans replica_reads() si elle est
+        joignable et à jour (retard remesuré au plus toutes les
+        DATABASE_READ_CHECK_INTERVAL secondes), primaire sinon.
+        """
+        if replica is None:
+            replica = self.reads_replica()
+        if not replica or self.replica is None:
+            return self.connect()
+
+        monitor = self.replica
+        checking = monitor.claim_check()
+        if checking or monitor.usable():
+            conn = None
+            try:
+                try:
+                    if self.metrics is None:
+                        conn = self.read_pool.getconn()
+                    else:
+                        with self.metrics.phase("connect"):
+                            conn = self.read_pool.getconn()
+                except psycopg2.Error as e:
+                    checking = False
+                    monitor.record_error(e)
+                except PoolExhausted:
+                    # Réplique saturée : cette lecture passe sur le primaire
+                    pass
+                if conn is not None and checking:
+                    try:
+                        with conn.cursor() as cur:
+                            cur.execute(LAG_SQL)
+                            lag = cur.fetchone()["lag"]
+                        conn.rollback()
+                    except psycopg2.Error as e:
+                        checking = False
+                        monitor.record_error(e)
+                        conn.close()
+                        conn = None
+                    else:
+                        checking = False
+                        monitor.record_lag(lag)
+            except BaseException:
+                if conn is not None:
+                    conn.close()
+                raise
+            finally:
+                # Mesure abandonnée sans verdict (pool saturé, erreur inattendue) :
+                # un autre thread la refera
+                if checking:
+                    monitor.release_check()
+            if conn is not None and monitor.usable():
+                monitor.count(True)
+                return conn
+            if conn is not None:
+                conn.close()
+        monitor.count(False)
+        return self.connect()
+
+    # --------------------
+    # Cycle de vie
+    # --------------------
+    def check_schema(self):
+        """Une seule requête sur schema_migrations (aucun DDL)."""
+        with closing(self.connect()) as conn:
+            try:
+                check_schema(conn)
+            except SchemaOutdated as e:
+                logger.error(str(e))
+
+    def stats(self) -> dict:
+        stats = {"backend": self.name, "pool": self.pool.stats()}
+        if self.replica is not None:
+            stats["replica"] = self.replica.stats()
+            if self._read_pool is not None:
+                stats["replica"]["pool"] = self._read_pool.stats()
+        return stats
+
+    def close(self):
+        for pool in (self._pool, self._read_pool):
+            if pool is not None:
+                pool.closeall()
+
+    # --------------------
+    # Ambassadeurs
+    # --------------------
+    def find_ambassador(self, field: str, value: str):
+        if field not in ("code", "email"):
+            raise ValueError(f"Champ de recherche invalide : {field}")
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT * FROM ambassadors WHERE {field} = %s", (value,))
+                row = cur.fetchone()
+        return dict(row) if row else None
+
+    def signup(self, name, email, payout_preference, payout_identifier, now, accept=None, email_for=None):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                row = dict(
+                    upsert_ambassador(
+                        cur,
+                        name,
+                        email,
+                        payout_preference,
+                        payout_identifier,
+                        now,
+                        new_code=lambda: random_code(self.code_banned),
+                    )
+                )
+                is_new = row.pop("inserted")
+
+                if accept and not accept(row):
+                    conn.rollback()
+                    return None
+
+                outgoing = email_for(row, is_new) if email_for else None
+                if outgoing:
+                    from outbox import enqueue_email  # mailing optionnel
+
+                    enqueue_email(cur, *outgoing)
+
+            conn.commit()
+        return row, is_new
+
+    def dashboard_data(self, ambassador_id: int, days: int = 30):
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                series = click_series(cur, ambassador_id, days=days)
+                # Agrégats tenus à jour par le webhook Stripe : une seule ligne
+                cur.execute("SELECT * FROM ambassador_stats WHERE ambassador_id = %s", (ambassador_id,))
+                sales_stats = cur.fetchone() or {}
+        return series, sales_stats
+
+    def import_ambassadors(self, rows, now, report, on_existing="update", email_for=None):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                inserted = import_rows(
+                    PostgresImportDB(cur),
+                    rows,
+                    now,
+                    report,
+                    on_existing=on_existing,
+                    new_code=lambda: random_code(self.code_banned),
+                    email_for=email_for,
+                )
+            conn.commit()
+        return inserted
+
+    # --------------------
+    # Clics
+    # --------------------
+    def insert_click_events(self, events):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                insert_click_events(cur, events)
+            conn.commit()
+
+    def rollup_clicks(self, updated_now: str, retention_days: int = 0):
+        with closing(self.connect()) as conn:
+            return rollup_clicks(conn, updated_now, retention_days=retention_days)
+
+    def unrolled_clicks(self, ambassador_id: int) -> dict:
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                return unrolled_clicks(cur, ambassador_id)
+
+    # --------------------
+    # Stripe
+    # --------------------
+    def apply_stripe_events(self, events, rules=None) -> set:
+        # Erreur : la transaction (déduplication comprise) est annulée
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                touched = process_events(PostgresStripeDB(cur), events, rules)
+            conn.commit()
+        return touched
+
+    # --------------------
+    # Admin
+    # --------------------
+    def listing_page(self, opts: dict):
+        sql, params = build_listing_query(opts)
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+
+    def iter_listing(self, opts: dict, batch_size: int = 2000):
+        sql, params = build_listing_query(opts, paginate=False)
+        return self._iter_listing(sql, params, batch_size, self.reads_replica())
+
+    def _iter_listing(self, sql, params, batch_size, replica):
+        with closing(self.connect_read(replica)) as conn:
+            yield from iter_server_side(conn, sql, params, batch_size=batch_size)
+
+    def listing_csv(self, opts: dict):
+        """Fast path : Postgres produit le CSV lui-même (COPY TO STDOUT)."""
+        sql, params = build_listing_query(opts, paginate=False)
+        return self._listing_csv(sql, params, self.reads_replica())
+
+    def _listing_csv(self, sql, params, replica):
+        with closing(self.connect_read(replica)) as conn:
+            with conn.cursor() as cur:
+                query = cur.mogrify(sql, params).decode(encodings[conn.encoding])
+            yield from copy_chunks(
+                conn,
+                f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, FORCE_QUOTE *)",
+            )
+
+    def listing_version(self) -> int:
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT change_seq FROM ambassadors_last_change")
+                row = cur.fetchone()
+            conn.rollback()
+        return row["change_seq"]
+
+    def search_ambassadors(self, opts: dict):
+        sql, params = build_search_query(opts, self.search_fuzzy_threshold)
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return cur.fetchall()
+
+    # --------------------
+    # Outbox
+    # --------------------
+    def claim_outbox(self, batch_size: int):
+        from outbox import claim_batch
+
+        with closing(self.connect()) as conn:
+            return claim_batch(conn, batch_size)
+
+    def record_outbox(self, updates):
+        from outbox import record_updates
+
+        with closing(self.connect()) as conn:
+            record_updates(conn, updates)
+
+    # --------------------
+    # Campagnes
+    # --------------------
+    def start_campaign(self, campaign_id: str, template: str, params: dict, stale_after: float = 600.0):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO email_campaigns (id, template, params) VALUES (%s, %s, %s)
+                    ON CONFLICT (id) DO UPDATE SET status = 'running', updated_at = now(), finished_at = NULL
+                    WHERE email_campaigns.status = 'interrupted'
+                       OR (email_campaigns.status = 'running'
+                           AND email_campaigns.updated_at < now() - make_interval(secs => %s))
+                    RETURNING *
+                    """,
+                    (campaign_id, template, Json(params or {}), stale_after),
+                )
+                row = cur.fetchone()
+            conn.commit()
+        return dict(row) if row else None
+
+    def get_campaign(self, campaign_id: str):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM email_campaigns WHERE id = %s", (campaign_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        return dict(row) if row else None
+
+    def iter_campaign_recipients(self, campaign_id: str, after_id: int, batch_size: int = 1000):
+        sql = """
+            SELECT a.id, a.name, a.email, a.code, a.clicks, a.signups,
+                   COALESCE(s.revenue_cents, 0) AS revenue_cents,
+                   COALESCE(s.sales_count, 0) AS sales_count,
+                   COALESCE(s.commission_paid_cents, 0) AS commission_paid_cents,
+                   COALESCE(s.commission_unpaid_cents, 0) AS commission_unpaid_cents,
+                   COALESCE(s.active_subscriptions, 0) AS active_subscriptions
+            FROM ambassadors AS a
+            LEFT JOIN ambassador_stats AS s ON s.ambassador_id = a.id
+            WHERE a.id > %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM email_campaign_sends AS c
+                  WHERE c.campaign_id = %s AND c.ambassador_id = a.id
+              )
+            ORDER BY a.id
+        """
+        # WITH HOLD : la campagne dure des heures, sans transaction ouverte
+        with closing(self.connect()) as conn:
+            yield from iter_server_side(
+                conn, sql, (after_id, campaign_id), batch_size=batch_size, name="campaign_cursor", withhold=True
+            )
+
+    def record_campaign_batch(self, campaign_id: str, results, checkpoint: int):
+        counts = {"sent": 0, "failed": 0, "skipped": 0}
+        for _, status, _, _ in results:
+            counts[status] += 1
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                if results:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO email_campaign_sends
+                            (campaign_id, ambassador_id, status, provider_message_id, error)
+                        VALUES %s
+                        ON CONFLICT DO NOTHING
+                        """,
+                        [(campaign_id, *result) for result in results],
+                    )
+                cur.execute(
+                    """
+                    UPDATE email_campaigns SET
+                        sent = sent + %(sent)s,
+                        failed = failed + %(failed)s,
+                        skipped = skipped + %(skipped)s,
+                        last_ambassador_id = GREATEST(last_ambassador_id, %(checkpoint)s),
+                        updated_at = now()
+                    WHERE id = %(id)s
+                    """,
+                    {**counts, "checkpoint": checkpoint, "id": campaign_id},
+                )
+            conn.commit()
+
+    def finish_campaign(self, campaign_id: str, status: str):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE email_campaigns SET status = %s, updated_at = now(),
+                        finished_at = CASE WHEN %s = 'done' THEN now() END
+                    WHERE id = %s
+                    """,
+                    (status, status, campaign_id),
+                )
+            conn.commit()
+
+    # --------------------
+    # Commissions
+    # --------------------
+    def update_commission_ledger(self, rules, full: bool = False) -> dict:
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                db = PostgresLedgerDB(cur)
+                db.lock()
+                result = update_ledger(db, rules, orphan_cutoff(), full=full)
+            conn.commit()
+        return result
+
+    def commission_statement(self, now: str, period: str = None, ambassador_id: int = None):
+        with closing(self.connect_read()) as conn:
+            with conn.cursor() as cur:
+                rows = PostgresLedgerDB(cur).statement(now, period, ambassador_id)
+            conn.rollback()
+        return rows
+
+    def pay_commissions(self, reference: str, now: str, through: str = None):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                db = PostgresLedgerDB(cur)
+                db.lock(sales=False)
+                rows = db.pay(reference, now, through)
+            conn.commit()
+        return rows
+
+    # --------------------
+    # Bannissements
+    # --------------------
+    def ban_version(self) -> int:
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT version FROM ban_version")
+                row = cur.fetchone()
+            conn.rollback()
+        return row["version"] if row else 0
+
+    def load_bans(self):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                # Une seule requête : version et lignes du même instantané
+                cur.execute(
+                    """
+                    SELECT v.version, b.kind, b.value
+                    FROM ban_version AS v LEFT JOIN bans AS b ON true
+                    """
+                )
+                rows = cur.fetchall()
+            conn.rollback()
+        version = rows[0]["version"] if rows else 0
+        return version, [r for r in rows if r["kind"] is not None]
+
+    def add_ban(self, kind: str, value: str, reason: str = None):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO bans (kind, value, reason) VALUES (%s, %s, %s)
+                    ON CONFLICT (kind, value) DO UPDATE SET reason = COALESCE(EXCLUDED.reason, bans.reason)
+                    """,
+                    (kind, value, reason),
+                )
+            conn.commit()
+
+    def remove_ban(self, kind: str, value: str) -> bool:
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bans WHERE kind = %s AND value = %s", (kind, value))
+                deleted = cur.rowcount > 0
+            conn.commit()
+        return deleted
+
+    def list_bans(self):
+        with closing(self.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT kind, value, reason, created_at FROM bans ORDER BY kind, value")
+                rows = cur.fetchall()
+            conn.rollback()
+        return rows
@@ -0,0 +1,192 @@
+import os
+import time
+import math
+import logging
+import threading
+from collections import OrderedDict
+
+from envconf import env_bool, env_int
+
+
+logger = logging.getLogger(__name__)
+
+
+class Rule:
+    """`rate` jetons par seconde, seau de `burst` jetons au maximum."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 1e-9)
+        self.burst = max(1, int(burst))
+
+    @classmethod
+    def parse(cls, spec: str):
+        """"N/S" : N requêtes par tranche de S secondes (rafale de N). Vide ou 0 : pas de limite."""
+        spec = (spec or "").strip()
+        if not spec:
+            return None
+        count, _, period = spec.partition("/")
+        count = int(count)
+        period = float(period.rstrip("s") or 1)
+        if count <= 0 or period <= 0:
+            return None
+        return cls(count / period, count)
+
+    def __repr__(self):
+        return f"{self.burst}/{self.burst / self.rate:g}s"
+
+
+class MemoryStore:
+    """Seaux en mémoire du process (LRU borné : les IPs inactives sortent en premier)."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max(1, max_keys)
+        self._buckets = OrderedDict()  # key -> [jetons, dernier remplissage]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, rule: Rule):
+        """(autorisé, jetons restants)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [float(rule.burst), now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+                return True, bucket[0]
+            return False, bucket[0]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+# Remplissage + prélèvement atomiques côté Redis (horloge du serveur Redis,
+# commune à toutes les instances)
+_REDIS_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisStore:
+    """
+    Seaux partagés entre instances. `client` : tout objet exposant
+    eval(script, numkeys, *keys_and_args) comme redis-py (un faux client
+    local suffit pour les tests).
+    """
+
+    def __init__(self, client, prefix: str = "rl:"):
+        self.client = client
+        self.prefix = prefix
+
+    def take(self, key: str, rule: Rule):
+        allowed, tokens = self.client.eval(_REDIS_TAKE, 1, self.prefix + key, rule.rate, rule.burst)
+        if isinstance(tokens, bytes):
+            tokens = tokens.decode("ascii")
+        return bool(int(allowed)), float(tokens)
+
+
+class RateLimiter:
+    """
+    Un seau par (règle, client). check() ne touche jamais Postgres : à
+    appeler avant tout accès au stockage. Si le store partagé est injoignable, la
+    requête passe (fail-open) et l'erreur est comptée.
+    """
+
+    def __init__(self, store, rules: dict):
+        self.store = store
+        self.rules = {name: rule for name, rule in rules.items() if rule is not None}
+        self._lock = threading.Lock()
+        self._stats = {"allowed": 0, "limited": 0, "store_errors": 0}
+        self._limited_by_rule = {name: 0 for name in self.rules}
+
+    def check(self, rule_name: str, client: str):
+        """(autorisé, Retry-After en secondes)."""
+        rule = self.rules.get(rule_name)
+        if rule is None:
+            return True, 0
+
+        try:
+            allowed, tokens = self.store.take(f"{rule_name}:{client}", rule)
+        except Exception as e:
+            logger.warning("Rate limit indisponible (%s) : requête acceptée", e)
+            with self._lock:
+                self._stats["store_errors"] += 1
+            return True, 0
+
+        with self._lock:
+            if allowed:
+                self._stats["allowed"] += 1
+            else:
+                self._stats["limited"] += 1
+                self._limited_by_rule[rule_name] += 1
+
+        if allowed:
+            return True, 0
+        return False, max(1, math.ceil((1.0 - tokens) / rule.rate))
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self._stats)
+            data["limited_by_rule"] = dict(self._limited_by_rule)
+        data["rules"] = {name: repr(rule) for name, rule in self.rules.items()}
+        data["store"] = type(self.store).__name__
+        if isinstance(self.store, MemoryStore):
+            data["buckets"] = len(self.store)
+        return data
+
+
+def rate_limiter_from_env(defaults: dict) -> RateLimiter:
+    """
+    `defaults` : {nom de règle: "N/S"}. Variables d'environnement :
+      - RATE_LIMIT_<NOM> (ex. RATE_LIMIT_INSCRIPTION=5/60 ; vide ou 0 = pas de limite)
+      - RATE_LIMIT_ENABLED (défaut 1)
+      - RATE_LIMIT_REDIS_URL (seaux partagés entre instances ; sinon en mémoire)
+      - RATE_LIMIT_MAX_KEYS (défaut 100000, store mémoire)
+    """
+    enabled = env_bool("RATE_LIMIT_ENABLED", True)
+
+    rules = {}
+    if enabled:
+        for name, default in defaults.items():
+            spec = os.environ.get(f"RATE_LIMIT_{name.upper()}", default)
+            try:
+                rules[name] = Rule.parse(spec)
+            except ValueError:
+                logger.warning("RATE_LIMIT_%s invalide (%r) : valeur par défaut", name.upper(), spec)
+                rules[name] = Rule.parse(default)
+
+    store = None
+    redis_url = (os.environ.get("RATE_LIMIT_REDIS_URL") or "").strip()
+    if enabled and redis_url:
+        try:
+            import redis  # type: ignore
+            store = RedisStore(redis.Redis.from_url(redis_url, socket_timeout=0.05))
+        except Exception as e:
+            logger.warning("Redis indisponible pour le rate limit (%s) : store en mémoire", e)
+
+    if store is None:
+        store = MemoryStore(max_keys=env_int("RATE_LIMIT_MAX_KEYS", 100_000))
+
+    return RateLimiter(store, rules)
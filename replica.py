@@ -0,0 +1,135 @@
+import time
+import logging
+import threading
+
+from envconf import env_float
+
+
+logger = logging.getLogger(__name__)
+
+# Retard de la réplique en secondes. Rejeu à jour (tout ce qui est reçu est
+# rejoué) : 0, même si le primaire n'a rien écrit depuis longtemps (l'âge de
+# la dernière transaction rejouée n'est pas un retard). Serveur qui n'est pas
+# en réplication (base de remplacement en local) : 0.
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END::float8 AS lag
+"""
+
+
+class ReplicaMonitor:
+    """
+    État de la réplique de lecture, partagé par les threads : retard mesuré
+    au plus toutes les `check_interval` secondes (une seule mesure à la
+    fois, les autres threads gardent le dernier verdict). Au-delà de
+    `max_lag` secondes de retard, ou après une erreur de connexion, les
+    lectures repartent sur le primaire jusqu'à la mesure suivante
+    (`retry_after` secondes après une erreur).
+    """
+
+    def __init__(self, max_lag: float = 5.0, check_interval: float = 2.0, retry_after: float = 10.0):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._checking = False
+        self._state = "unknown"  # ok | lagging | down
+        self._lag = None
+        self._checked_at = None
+        self._stats = {"replica_reads": 0, "primary_fallbacks": 0, "checks": 0, "errors": 0}
+
+    def claim_check(self) -> bool:
+        """True si l'appelant doit mesurer le retard maintenant (puis record_lag / record_error)."""
+        with self._lock:
+            if self._checking or time.monotonic() < self._next_check:
+                return False
+            self._checking = True
+            return True
+
+    def release_check(self):
+        """Mesure abandonnée sans verdict : un autre thread la refera."""
+        with self._lock:
+            self._checking = False
+
+    def usable(self) -> bool:
+        with self._lock:
+            return self._state == "ok"
+
+    def record_lag(self, lag: float):
+        lagging = lag > self.max_lag
+        with self._lock:
+            if lagging and self._state != "lagging":
+                logger.warning("Réplique en retard de %.1f s : lectures sur le primaire", lag)
+            elif not lagging and self._state != "ok":
+                logger.info("Réplique disponible (retard %.1f s)", lag)
+            self._state = "lagging" if lagging else "ok"
+            self._lag = lag
+            self._checked_at = time.monotonic()
+            self._next_check = self._checked_at + self.check_interval
+            self._checking = False
+            self._stats["checks"] += 1
+
+    def record_error(self, error: Exception):
+        with self._lock:
+            if self._state != "down":
+                logger.warning("Réplique indisponible (%s) : lectures sur le primaire", error)
+            self._state = "down"
+            self._lag = None
+            self._checked_at = time.monotonic()
+            self._next_check = self._checked_at + self.retry_after
+            self._checking = False
+            self._stats["errors"] += 1
+
+    def count(self, replica: bool):
+        with self._lock:
+            self._stats["replica_reads" if replica else "primary_fallbacks"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "state": self._state,
+                "available": self._state == "ok",
+                "lag_seconds": self._lag,
+                "checked_seconds_ago": None if self._checked_at is None else round(time.monotonic() - self._checked_at, 3),
+                "max_lag": self.max_lag,
+            }
+
+
+def replica_monitor_from_env() -> ReplicaMonitor:
+    """
+    Variables d'environnement :
+      - DATABASE_READ_MAX_LAG (défaut 5 s ; au-delà, lectures sur le primaire)
+      - DATABASE_READ_CHECK_INTERVAL (défaut 2 s ; mesure du retard)
+      - DATABASE_READ_RETRY_AFTER (défaut 10 s ; après une erreur de connexion)
+    """
+    return ReplicaMonitor(
+        max_lag=env_float("DATABASE_READ_MAX_LAG", 5.0),
+        check_interval=env_float("DATABASE_READ_CHECK_INTERVAL", 2.0),
+        retry_after=env_float("DATABASE_READ_RETRY_AFTER", 10.0),
+    )
+
+
+# --------------------
+# Lecture de ses propres écritures
+# --------------------
+def primary_until(seconds: float) -> str:
+    """Valeur du cookie : lectures sur le primaire jusqu'à cette date (epoch)."""
+    return str(int(time.time() + seconds) + 1)
+
+
+def sticky_to_primary(raw: str, seconds: float) -> bool:
+    """
+    Cookie encore valable ? Une date au-delà de la fenêtre (cookie forgé)
+    est ignorée : au pire un client s'impose à lui-même le primaire.
+    """
+    try:
+        until = int(raw or 0)
+    except ValueError:
+        return False
+    now = time.time()
+    return now < until <= now + seconds + 1
@@ -0,0 +1,210 @@
+import re
+import time
+import bisect
+import threading
+
+from listing import LISTING_COLUMNS
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_OFFSET = 1000
+MAX_QUERY_LENGTH = 100
+FUZZY_MIN_LENGTH = 3  # en dessous, préfixes seulement (trigrammes peu sélectifs)
+
+# Document de la recherche floue : même expression que l'index GIN de la
+# migration 0012 (sinon l'index n'est pas utilisé)
+SEARCH_DOCUMENT = "lower(name || ' ' || email || ' ' || code || ' ' || coalesce(payout_identifier, ''))"
+
+# Champs de l'index mémoire, par ordre de pertinence
+FIELDS = (("c", "code"), ("e", "email"), ("n", "name"), ("p", "payout_identifier"))
+FIELD_RANK = {tag: i for i, (tag, _) in enumerate(FIELDS)}
+_WORD_SPLIT = re.compile(r"[\s\-']+")
+
+
+class SearchError(ValueError):
+    """Paramètre de recherche invalide."""
+
+
+def normalize_query(raw: str) -> str:
+    return " ".join((raw or "").lower().split())[:MAX_QUERY_LENGTH]
+
+
+def _int_arg(args, name, default, low, high):
+    raw = (args.get(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return max(low, min(int(raw), high))
+    except ValueError:
+        raise SearchError(f"{name} doit être un entier")
+
+
+def parse_search_args(args) -> dict:
+    """q / limit / offset depuis request.args."""
+    q = normalize_query(args.get("q"))
+    if not q:
+        raise SearchError("q est obligatoire")
+    return {
+        "q": q,
+        "limit": _int_arg(args, "limit", DEFAULT_LIMIT, 1, MAX_LIMIT),
+        "offset": _int_arg(args, "offset", 0, 0, MAX_OFFSET),
+    }
+
+
+def _like_prefix(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def build_search_query(opts: dict, fuzzy_threshold: float = 0.6):
+    """
+    Recherche classée, une requête : correspondance exacte (code, email),
+    puis préfixe du code ou de l'email, puis préfixe du nom ou de
+    l'identifiant de paiement (index d'expression text_pattern_ops), puis
+    mots proches (pg_trgm, index GIN sur SEARCH_DOCUMENT) à partir de
+    FUZZY_MIN_LENGTH caractères. Une ligne de plus que `limit` est demandée
+    pour savoir s'il reste une page.
+    """
+    q = opts["q"]
+    params = {
+        "q": q,
+        "code": q.upper(),
+        "prefix": _like_prefix(q),
+        "code_prefix": _like_prefix(q.upper()),
+        "limit": opts["limit"] + 1,
+        "offset": opts["offset"],
+        "threshold": fuzzy_threshold,
+    }
+    fuzzy = len(q) >= FUZZY_MIN_LENGTH and fuzzy_threshold > 0
+
+    where = [
+        "code LIKE %(code_prefix)s",
+        "lower(email) LIKE %(prefix)s",
+        "lower(name) LIKE %(prefix)s",
+        "lower(coalesce(payout_identifier, '')) LIKE %(prefix)s",
+    ]
+    score = "0.0"
+    if fuzzy:
+        where.append(f"%(q)s <%% {SEARCH_DOCUMENT}")
+        score = f"word_similarity(%(q)s, {SEARCH_DOCUMENT})"
+
+    sql = f"""
+        SELECT {LISTING_COLUMNS},
+            CASE
+                WHEN code = %(code)s OR lower(email) = %(q)s THEN 0
+                WHEN code LIKE %(code_prefix)s OR lower(email) LIKE %(prefix)s THEN 1
+                WHEN lower(name) LIKE %(prefix)s OR lower(coalesce(payout_identifier, '')) LIKE %(prefix)s THEN 2
+                ELSE 3
+            END AS rank,
+            {score} AS score
+        FROM ambassadors
+        WHERE {" OR ".join(where)}
+        ORDER BY rank, score DESC, id
+        LIMIT %(limit)s OFFSET %(offset)s
+    """
+    if fuzzy:
+        # Seuil de `<%` pour cette transaction seulement, dans le même aller-retour
+        sql = "SELECT set_config('pg_trgm.word_similarity_threshold', %(threshold)s::text, true);" + sql
+    return sql, params
+
+
+def split_results(rows, opts: dict):
+    """(lignes de la page, offset de la page suivante ou None)."""
+    if len(rows) <= opts["limit"]:
+        return rows, None
+    return rows[: opts["limit"]], opts["offset"] + opts["limit"]
+
+
+# --------------------
+# Index mémoire (backend SQLite)
+# --------------------
+def _keys(row):
+    """[(champ, clé)] d'une fiche : code, email, nom et chacun de ses mots, identifiant."""
+    keys = []
+    for tag, column in FIELDS:
+        value = (row.get(column) or "").lower()
+        if not value:
+            continue
+        if tag == "n":
+            # Nom complet (préfixe du premier mot compris) puis chacun des mots suivants
+            words = [w for w in _WORD_SPLIT.split(value) if w]
+            keys.append((tag, " ".join(value.split())))
+            keys.extend((tag, word) for word in set(words[1:]) if word != words[0])
+        elif not (tag == "p" and ("e", value) in keys):
+            keys.append((tag, value))
+    return keys
+
+
+def matches(row, q: str) -> bool:
+    return any(key.startswith(q) for _, key in _keys(row))
+
+
+class PrefixIndex:
+    """
+    Index de préfixes en mémoire : liste triée de "clé\\0<champ><id>"
+    (environ 4 entrées par fiche), parcourue par bisect (O(log n) + taille
+    de la plage, bornée à `max_candidates`). Sert de candidats : les fiches
+    de la page sont relues et revérifiées en base (matches), un index en
+    retard ne renvoie donc jamais de fiche qui ne correspond plus.
+    """
+
+    def __init__(self, rows=(), version=None, max_candidates: int = 2000):
+        self.version = version
+        self.stale = False  # modifiées ou supprimées depuis : à reconstruire
+        self.built_at = time.monotonic()
+        self.max_candidates = max_candidates
+        self.max_id = 0
+        self._lock = threading.Lock()
+        entries = []
+        for row in rows:
+            entries.extend(self._entries(row))
+            self.max_id = max(self.max_id, row["id"])
+        entries.sort()
+        self.entries = entries
+
+    @staticmethod
+    def _entries(row):
+        # id sur 10 chiffres : à clé égale, l'ordre du texte est celui des id
+        return [f"{key}\0{tag}{row['id']:010d}" for tag, key in _keys(row)]
+
+    def add(self, rows, version=None):
+        """
+        Fiches créées depuis la construction, par id croissant (id > max_id ;
+        celles qu'un autre thread a déjà ajoutées sont ignorées). `version` :
+        version de la table lue avant `rows`, que l'index rattrape ; les
+        modifications et suppressions attendent la reconstruction (stale).
+        """
+        with self._lock:
+            for row in rows:
+                if row["id"] <= self.max_id:
+                    continue
+                for entry in self._entries(row):
+                    bisect.insort(self.entries, entry)
+                self.max_id = row["id"]
+            if version is not None and version != self.version:
+                self.version = version
+                self.stale = True
+
+    def search(self, q: str, limit: int, offset: int = 0):
+        """[id] de la page (limit + 1 au plus), par pertinence décroissante."""
+        best = {}
+        with self._lock:
+            entries = self.entries
+            i = bisect.bisect_left(entries, q)
+            scanned = 0
+            while i < len(entries) and scanned < self.max_candidates:
+                entry = entries[i]
+                if not entry.startswith(q):
+                    break
+                key, _, rest = entry.partition("\0")
+                ambassador_id = int(rest[1:])
+                rank = (0 if key == q and rest[0] in "ce" else 1, FIELD_RANK[rest[0]], len(key), ambassador_id)
+                if rank < best.get(ambassador_id, (9,)):
+                    best[ambassador_id] = rank
+                i += 1
+                scanned += 1
+        ranked = sorted(best, key=best.get)
+        return ranked[offset : offset + limit + 1]
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "max_id": self.max_id, "version": self.version, "stale": self.stale}
@@ -0,0 +1,1018 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+
+from storage import CODE_ATTEMPTS, Storage, random_code
+from listing import LISTING_COLUMNS, build_listing_query
+from search import PrefixIndex, matches
+from stripe_sales import process_events
+from bulk_import import import_rows
+from payouts import orphan_cutoff, update_ledger
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "database", "sqlite_schema.sql")
+SCHEMA_VERSION = 4  # PRAGMA user_version ; à incrémenter à chaque ajout au schéma
+
+# Colonnes ajoutées à une table existante : le script (CREATE TABLE IF NOT
+# EXISTS) ne les crée pas sur une base plus ancienne
+ADDED_COLUMNS = [
+    ("ambassadors", "change_seq", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+
+class _Rejected(Exception):
+    """accept() a refusé la ligne : la transaction est annulée."""
+
+
+def _dict_row(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+def _iso(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+def _enqueue_emails(conn, messages):
+    """Équivalent SQLite de outbox.enqueue_emails (payload en texte JSON)."""
+    from outbox import recipient
+
+    conn.executemany(
+        "INSERT INTO email_outbox (kind, to_email, payload) VALUES (?, ?, ?)",
+        [(kind, recipient(message), json.dumps(message)) for kind, message in messages],
+    )
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Connexion dont execute / executemany passent par metrics.query()."""
+
+    metrics = None
+
+    def execute(self, sql, parameters=()):
+        if self.metrics is None:
+            return super().execute(sql, parameters)
+        with self.metrics.query(sql):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.metrics is None:
+            return super().executemany(sql, seq_of_parameters)
+        with self.metrics.query(sql):
+            return super().executemany(sql, seq_of_parameters)
+
+
+class SQLiteStorage(Storage):
+    """
+    Backend embarqué : un fichier SQLite en WAL, une connexion par thread.
+    Lectures sans réseau ni verrou (lecteurs concurrents en WAL) ; écritures
+    sérialisées par BEGIN IMMEDIATE. Les requêtes sont paramétrées et gardées
+    compilées par le cache de statements de chaque connexion.
+    Pour un déploiement mono-serveur : pas de répliques ni de workers répartis.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, busy_timeout: float = 5.0, cached_statements: int = 256):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._trace = None
+        self._search = None
+        self._search_lock = threading.Lock()
+        self._search_refreshing = False
+
+    # --------------------
+    # Connexions
+    # --------------------
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            started = time.perf_counter()
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,  # transactions explicites
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+                factory=_TimedConnection,
+            )
+            conn.metrics = self.metrics
+            conn.row_factory = _dict_row
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            if self._trace:
+                conn.set_trace_callback(self._trace)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+            if self.metrics is not None:
+                self.metrics.observe_phase("connect", time.perf_counter() - started)
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def set_trace(self, callback):
+        """callback(sql) à chaque instruction exécutée (bench : allers-retours)."""
+        self._trace = callback
+        with self._lock:
+            for conn in self._connections:
+                conn.set_trace_callback(callback)
+
+    # --------------------
+    # Cycle de vie
+    # --------------------
+    def check_schema(self):
+        """Schéma embarqué : appliqué directement s'il est en retard."""
+        conn = self._conn()
+        version = conn.execute("PRAGMA user_version").fetchone()["user_version"]
+        if version >= SCHEMA_VERSION:
+            return
+        for table, column, decl in ADDED_COLUMNS:
+            existing = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if existing and column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        with open(SCHEMA_PATH, encoding="utf-8") as f:
+            conn.executescript(f.read())
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logger.info("Schéma SQLite %s en version %s", self.path, SCHEMA_VERSION)
+
+    def stats(self) -> dict:
+        with self._lock:
+            connections = len(self._connections)
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "connections": connections,
+            "journal_mode": self._conn().execute("PRAGMA journal_mode").fetchone()["journal_mode"],
+        }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+    # --------------------
+    # Ambassadeurs
+    # --------------------
+    def find_ambassador(self, field: str, value: str):
+        if field not in ("code", "email"):
+            raise ValueError(f"Champ de recherche invalide : {field}")
+        return self._conn().execute(f"SELECT * FROM ambassadors WHERE {field} = ?", (value,)).fetchone()
+
+    def _insert_ambassador(self, conn, name, email, payout_preference, payout_identifier, now):
+        for _ in range(CODE_ATTEMPTS):
+            try:
+                return conn.execute(
+                    """
+                    INSERT INTO ambassadors (
+                        name, email, code, payout_preference, payout_identifier, created_at, updated_at
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    RETURNING *
+                    """,
+                    (name, email, random_code(self.code_banned), payout_preference, payout_identifier, now, now),
+                ).fetchall()[0]
+            except sqlite3.IntegrityError:
+                # L'email est vérifié sous le verrou d'écriture : collision de code
+                continue
+        raise RuntimeError("Impossible de générer un code ambassadeur unique.")
+
+    def signup(self, name, email, payout_preference, payout_identifier, now, accept=None, email_for=None):
+        try:
+            with self._write() as conn:
+                existing = conn.execute("SELECT id FROM ambassadors WHERE email = ?", (email,)).fetchone()
+                if existing:
+                    row = conn.execute(
+                        """
+                        UPDATE ambassadors SET
+                            name = ?,
+                            payout_preference = COALESCE(?, payout_preference),
+                            payout_identifier = COALESCE(?, payout_identifier),
+                            updated_at = ?
+                        WHERE id = ?
+                        RETURNING *
+                        """,
+                        (name, payout_preference, payout_identifier, now, existing["id"]),
+                    ).fetchall()[0]
+                    is_new = False
+                else:
+                    row = self._insert_ambassador(conn, name, email, payout_preference, payout_identifier, now)
+                    is_new = True
+
+                if accept and not accept(row):
+                    raise _Rejected()
+
+                outgoing = email_for(row, is_new) if email_for else None
+                if outgoing:
+                    _enqueue_emails(conn, [outgoing])
+        except _Rejected:
+            return None
+        return row, is_new
+
+    def dashboard_data(self, ambassador_id: int, days: int = 30):
+        conn = self._conn()
+        today = datetime.datetime.now(datetime.timezone.utc).date()
+        start = today - datetime.timedelta(days=days - 1)
+        by_day = {
+            datetime.date.fromisoformat(r["day"]): r["clicks"]
+            for r in conn.execute(
+                "SELECT day, clicks FROM click_daily WHERE ambassador_id = ? AND day >= ?",
+                (ambassador_id, start.isoformat()),
+            )
+        }
+        series = [
+            (start + datetime.timedelta(days=i), by_day.get(start + datetime.timedelta(days=i), 0))
+            for i in range(days)
+        ]
+        sales_stats = conn.execute(
+            "SELECT * FROM ambassador_stats WHERE ambassador_id = ?", (ambassador_id,)
+        ).fetchone() or {}
+        return series, sales_stats
+
+    def import_ambassadors(self, rows, now, report, on_existing="update", email_for=None):
+        with self._write() as conn:
+            return import_rows(
+                SQLiteImportDB(conn),
+                rows,
+                now,
+                report,
+                on_existing=on_existing,
+                new_code=lambda: random_code(self.code_banned),
+                email_for=email_for,
+            )
+
+    # --------------------
+    # Clics
+    # --------------------
+    def insert_click_events(self, events):
+        with self._write() as conn:
+            conn.executemany(
+                """
+                INSERT INTO click_events (ambassador_id, code, day, clicked_at, fingerprint)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                [tuple(_iso(v) for v in event) for event in events],
+            )
+
+    def rollup_clicks(self, updated_now: str, retention_days: int = 0):
+        """
+        Même contrat que clicks.rollup_clicks. Un seul écrivain à la fois :
+        max(id) lu sous BEGIN IMMEDIATE ne peut plus être dépassé par un
+        INSERT plus ancien encore en cours.
+        """
+        with self._write() as conn:
+            upto = conn.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM click_events").fetchone()["max_id"]
+            conn.execute("INSERT OR IGNORE INTO rollup_state (name, last_event_id) VALUES ('clicks', 0)")
+            since = conn.execute(
+                "SELECT last_event_id FROM rollup_state WHERE name = 'clicks'"
+            ).fetchone()["last_event_id"]
+            if since >= upto:
+                return []
+
+            conn.execute(
+                """
+                INSERT INTO click_daily (ambassador_id, day, clicks)
+                SELECT ambassador_id, day, COUNT(*) FROM click_events
+                WHERE id > ? AND id <= ?
+                GROUP BY ambassador_id, day
+                ON CONFLICT (ambassador_id, day) DO UPDATE SET clicks = clicks + excluded.clicks
+                """,
+                (since, upto),
+            )
+            ids = [
+                r["id"]
+                for r in conn.execute(
+                    """
+                    UPDATE ambassadors SET clicks = clicks + t.n, updated_at = ?
+                    FROM (
+                        SELECT ambassador_id, COUNT(*) AS n FROM click_events
+                        WHERE id > ? AND id <= ?
+                        GROUP BY ambassador_id
+                    ) AS t
+                    WHERE ambassadors.id = t.ambassador_id
+                    RETURNING ambassadors.id AS id
+                    """,
+                    (updated_now, since, upto),
+                ).fetchall()
+            ]
+            conn.execute(
+                "UPDATE rollup_state SET last_event_id = ?, updated_at = ? WHERE name = 'clicks'",
+                (upto, _now_iso()),
+            )
+            if retention_days:
+                conn.execute(
+                    "DELETE FROM click_events WHERE day < date('now', ?) AND id <= ?",
+                    (f"-{int(retention_days)} days", upto),
+                )
+        return ids
+
+    def unrolled_clicks(self, ambassador_id: int) -> dict:
+        rows = self._conn().execute(
+            """
+            SELECT day, COUNT(*) AS n FROM click_events
+            WHERE id > COALESCE((SELECT last_event_id FROM rollup_state WHERE name = 'clicks'), 0)
+              AND ambassador_id = ?
+            GROUP BY day
+            """,
+            (ambassador_id,),
+        ).fetchall()
+        return {datetime.date.fromisoformat(r["day"]): r["n"] for r in rows}
+
+    # --------------------
+    # Stripe
+    # --------------------
+    def apply_stripe_events(self, events, rules=None) -> set:
+        with self._write() as conn:
+            return process_events(SQLiteStripeDB(conn), events, rules)
+
+    # --------------------
+    # Admin
+    # --------------------
+    def listing_page(self, opts: dict):
+        sql, params = build_listing_query(opts, dialect="sqlite")
+        return self._conn().execute(sql, params).fetchall()
+
+    def iter_listing(self, opts: dict, batch_size: int = 2000):
+        sql, params = build_listing_query(opts, paginate=False, dialect="sqlite")
+        cur = self._conn().execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cur.close()
+
+    def listing_version(self) -> int:
+        return self._conn().execute("SELECT change_seq FROM ambassadors_last_change").fetchone()["change_seq"]
+
+    def search_ambassadors(self, opts: dict):
+        ids = self._search_index().search(opts["q"], opts["limit"], opts["offset"])
+        if not ids:
+            return []
+        rows = self._conn().execute(
+            f"SELECT {LISTING_COLUMNS} FROM ambassadors WHERE id IN ({', '.join('?' * len(ids))})", ids
+        ).fetchall()
+        by_id = {row["id"]: row for row in rows}
+        # Index en retard : fiche supprimée ou modifiée depuis, écartée
+        return [by_id[i] for i in ids if i in by_id and matches(by_id[i], opts["q"])]
+
+    def _load_search_index(self) -> PrefixIndex:
+        conn = self._conn()
+        version = self.listing_version()
+        cur = conn.execute("SELECT id, name, email, code, payout_identifier FROM ambassadors")
+        index = PrefixIndex(iter(cur.fetchone, None), version)
+        logger.info("Index de recherche : %s entrée(s)", len(index.entries))
+        return index
+
+    def _search_index(self) -> PrefixIndex:
+        """
+        Index mémoire des préfixes (search.PrefixIndex), construit au premier
+        appel. Les fiches créées depuis y entrent tout de suite (id > max_id) ;
+        les autres changements attendent la reconstruction, faite en tâche de
+        fond au plus toutes les `search_index_refresh` secondes.
+        """
+        index = self._search
+        if index is None:
+            with self._search_lock:
+                if self._search is None:
+                    self._search = self._load_search_index()
+                return self._search
+
+        version = self.listing_version()
+        if version != index.version:
+            rows = self._conn().execute(
+                "SELECT id, name, email, code, payout_identifier FROM ambassadors WHERE id > ? ORDER BY id",
+                (index.max_id,),
+            ).fetchall()
+            # Version rattrapée : pas de nouvelle requête tant que rien ne change
+            index.add(rows, version)
+        if index.stale and time.monotonic() - index.built_at >= self.search_index_refresh:
+            self._refresh_search_index()
+        return index
+
+    def _refresh_search_index(self):
+        with self._search_lock:
+            if self._search_refreshing:
+                return
+            self._search_refreshing = True
+
+        def run():
+            index = None
+            try:
+                index = self._load_search_index()
+            except Exception:
+                logger.exception("Reconstruction de l'index de recherche impossible")
+            finally:
+                with self._search_lock:
+                    if index is not None:
+                        self._search = index
+                    self._search_refreshing = False
+
+        threading.Thread(target=run, name="search-index", daemon=True).start()
+
+    # --------------------
+    # Outbox
+    # --------------------
+    def claim_outbox(self, batch_size: int):
+        from outbox import OUTBOX_STALE_AFTER
+
+        now = time.time()
+        with self._write() as conn:
+            rows = conn.execute(
+                """
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, locked_at = ?
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE (status = 'pending' AND next_attempt_at <= ?)
+                       OR (status = 'sending' AND locked_at < ?)
+                    ORDER BY id
+                    LIMIT ?
+                )
+                RETURNING id, payload, attempts
+                """,
+                (now, now, now - OUTBOX_STALE_AFTER, batch_size),
+            ).fetchall()
+        for row in rows:
+            row["payload"] = json.loads(row["payload"])
+        return sorted(rows, key=lambda r: r["id"])
+
+    def record_outbox(self, updates):
+        now = time.time()
+        sent_at = _now_iso()
+        with self._write() as conn:
+            conn.executemany(
+                """
+                UPDATE email_outbox
+                SET status = ?,
+                    provider_message_id = COALESCE(?, provider_message_id),
+                    last_error = ?,
+                    next_attempt_at = ? + ?,
+                    sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END,
+                    locked_at = NULL
+                WHERE id = ?
+                """,
+                [
+                    (status, message_id, error, now, delay, status, sent_at, outbox_id)
+                    for outbox_id, status, message_id, error, delay in updates
+                ],
+            )
+
+    # --------------------
+    # Campagnes
+    # --------------------
+    def start_campaign(self, campaign_id: str, template: str, params: dict, stale_after: float = 600.0):
+        stale = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=stale_after)
+        stale = stale.isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        with self._write() as conn:
+            row = conn.execute(
+                """
+                INSERT INTO email_campaigns (id, template, params) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET status = 'running', updated_at = ?, finished_at = NULL
+                WHERE email_campaigns.status = 'interrupted'
+                   OR (email_campaigns.status = 'running' AND email_campaigns.updated_at < ?)
+                RETURNING *
+                """,
+                (campaign_id, template, json.dumps(params or {}), _now_iso(), stale),
+            ).fetchone()
+        if row:
+            row["params"] = json.loads(row["params"])
+        return row
+
+    def get_campaign(self, campaign_id: str):
+        row = self._conn().execute("SELECT * FROM email_campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        if row:
+            row["params"] = json.loads(row["params"])
+        return row
+
+    def iter_campaign_recipients(self, campaign_id: str, after_id: int, batch_size: int = 1000):
+        # Pages par clé (id) plutôt qu'un curseur ouvert : aucune lecture n'est
+        # maintenue entre deux lots, le WAL peut être recyclé pendant l'envoi
+        conn = self._conn()
+        while True:
+            rows = conn.execute(
+                """
+                SELECT a.id, a.name, a.email, a.code, a.clicks, a.signups,
+                       COALESCE(s.revenue_cents, 0) AS revenue_cents,
+                       COALESCE(s.sales_count, 0) AS sales_count,
+                       COALESCE(s.commission_paid_cents, 0) AS commission_paid_cents,
+                       COALESCE(s.commission_unpaid_cents, 0) AS commission_unpaid_cents,
+                       COALESCE(s.active_subscriptions, 0) AS active_subscriptions
+                FROM ambassadors AS a
+                LEFT JOIN ambassador_stats AS s ON s.ambassador_id = a.id
+                WHERE a.id > ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM email_campaign_sends AS c
+                      WHERE c.campaign_id = ? AND c.ambassador_id = a.id
+                  )
+                ORDER BY a.id
+                LIMIT ?
+                """,
+                (after_id, campaign_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            after_id = rows[-1]["id"]
+
+    def record_campaign_batch(self, campaign_id: str, results, checkpoint: int):
+        counts = {"sent": 0, "failed": 0, "skipped": 0}
+        for _, status, _, _ in results:
+            counts[status] += 1
+        with self._write() as conn:
+            conn.executemany(
+                """
+                INSERT INTO email_campaign_sends (campaign_id, ambassador_id, status, provider_message_id, error)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+                """,
+                [(campaign_id, *result) for result in results],
+            )
+            conn.execute(
+                """
+                UPDATE email_campaigns SET
+                    sent = sent + :sent,
+                    failed = failed + :failed,
+                    skipped = skipped + :skipped,
+                    last_ambassador_id = MAX(last_ambassador_id, :checkpoint),
+                    updated_at = :now
+                WHERE id = :id
+                """,
+                {**counts, "checkpoint": checkpoint, "now": _now_iso(), "id": campaign_id},
+            )
+
+    def finish_campaign(self, campaign_id: str, status: str):
+        now = _now_iso()
+        with self._write() as conn:
+            conn.execute(
+                """
+                UPDATE email_campaigns SET status = ?, updated_at = ?,
+                    finished_at = CASE WHEN ? = 'done' THEN ? END
+                WHERE id = ?
+                """,
+                (status, now, status, now, campaign_id),
+            )
+
+    # --------------------
+    # Commissions
+    # --------------------
+    def update_commission_ledger(self, rules, full: bool = False) -> dict:
+        since = orphan_cutoff().isoformat(timespec="milliseconds").replace("+00:00", "Z")
+        with self._write() as conn:
+            return update_ledger(SQLiteLedgerDB(conn), rules, since, full=full)
+
+    def commission_statement(self, now: str, period: str = None, ambassador_id: int = None):
+        return SQLiteLedgerDB(self._conn()).statement(now, period, ambassador_id)
+
+    def pay_commissions(self, reference: str, now: str, through: str = None):
+        with self._write() as conn:
+            return SQLiteLedgerDB(conn).pay(reference, now, through)
+
+    # --------------------
+    # Bannissements
+    # --------------------
+    def ban_version(self) -> int:
+        row = self._conn().execute("SELECT version FROM ban_version").fetchone()
+        return row["version"] if row else 0
+
+    def load_bans(self):
+        rows = self._conn().execute(
+            "SELECT v.version, b.kind, b.value FROM ban_version AS v LEFT JOIN bans AS b ON 1"
+        ).fetchall()
+        version = rows[0]["version"] if rows else 0
+        return version, [r for r in rows if r["kind"] is not None]
+
+    def add_ban(self, kind: str, value: str, reason: str = None):
+        with self._write() as conn:
+            conn.execute(
+                """
+                INSERT INTO bans (kind, value, reason) VALUES (?, ?, ?)
+                ON CONFLICT (kind, value) DO UPDATE SET reason = COALESCE(excluded.reason, bans.reason)
+                """,
+                (kind, value, reason),
+            )
+
+    def remove_ban(self, kind: str, value: str) -> bool:
+        with self._write() as conn:
+            cur = conn.execute("DELETE FROM bans WHERE kind = ? AND value = ?", (kind, value))
+            return cur.rowcount > 0
+
+    def list_bans(self):
+        return self._conn().execute(
+            "SELECT kind, value, reason, created_at FROM bans ORDER BY kind, value"
+        ).fetchall()
+
+
+class SQLiteStripeDB:
+    """Équivalent SQLite de stripe_sales.PostgresStripeDB (sous BEGIN IMMEDIATE)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def claim_events(self, pairs) -> set:
+        fresh = set()
+        for event_id, event_type in pairs:
+            rows = self.conn.execute(
+                "INSERT INTO stripe_events (id, type) VALUES (?, ?) ON CONFLICT (id) DO NOTHING RETURNING id",
+                (event_id, event_type),
+            ).fetchall()
+            fresh.update(r["id"] for r in rows)
+        return fresh
+
+    def resolve_codes(self, codes) -> dict:
+        placeholders = ", ".join("?" for _ in codes)
+        rows = self.conn.execute(
+            f"SELECT id, code FROM ambassadors WHERE code IN ({placeholders})", list(codes)
+        ).fetchall()
+        return {r["code"]: r["id"] for r in rows}
+
+    def lock_subscription(self, sub_id):
+        # Le verrou d'écriture de la transaction suffit
+        return self.conn.execute(
+            "SELECT ambassador_id, status, status_at FROM stripe_subscriptions WHERE id = ?", (sub_id,)
+        ).fetchone()
+
+    def save_subscription(self, sub_id, ambassador_id, status, status_at):
+        self.conn.execute(
+            """
+            INSERT INTO stripe_subscriptions (id, ambassador_id, status, status_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                ambassador_id = COALESCE(stripe_subscriptions.ambassador_id, excluded.ambassador_id),
+                status = excluded.status,
+                status_at = excluded.status_at,
+                updated_at = excluded.updated_at
+            """,
+            (sub_id, ambassador_id, status, status_at, _now_iso()),
+        )
+
+    def attach_orphan_sales(self, ambassador_id, sub_id):
+        return self.conn.execute(
+            """
+            UPDATE sales SET ambassador_id = ?
+            WHERE subscription_id = ? AND ambassador_id IS NULL
+            RETURNING amount, commission
+            """,
+            (ambassador_id, sub_id),
+        ).fetchall()
+
+    def subscription_owner(self, sub_id):
+        row = self.conn.execute("SELECT ambassador_id FROM stripe_subscriptions WHERE id = ?", (sub_id,)).fetchone()
+        return row["ambassador_id"] if row else None
+
+    def insert_sales(self, sales):
+        inserted = []
+        for sale in sales:
+            inserted.extend(
+                self.conn.execute(
+                    """
+                    INSERT INTO sales (
+                        ambassador_id, customer_email, amount, subscription_id, date,
+                        stripe_object_id, stripe_event_id, currency, kind, commission
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (stripe_object_id) DO NOTHING
+                    RETURNING ambassador_id, amount, commission
+                    """,
+                    tuple(_iso(v) for v in sale),
+                ).fetchall()
+            )
+        return inserted
+
+    def write_deltas(self, stats, signups):
+        now = _now_iso()
+        if stats:
+            self.conn.executemany(
+                """
+                INSERT INTO ambassador_stats (
+                    ambassador_id, revenue_cents, sales_count,
+                    commission_unpaid_cents, active_subscriptions, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (ambassador_id) DO UPDATE SET
+                    revenue_cents = revenue_cents + excluded.revenue_cents,
+                    sales_count = sales_count + excluded.sales_count,
+                    commission_unpaid_cents = commission_unpaid_cents + excluded.commission_unpaid_cents,
+                    active_subscriptions = MAX(active_subscriptions + excluded.active_subscriptions, 0),
+                    updated_at = excluded.updated_at
+                """,
+                [(*row, now) for row in stats],
+            )
+        if signups:
+            self.conn.executemany(
+                "UPDATE ambassadors SET signups = signups + ?, updated_at = ? WHERE id = ?",
+                [(n, now, ambassador_id) for ambassador_id, n in signups],
+            )
+
+
+class SQLiteLedgerDB:
+    """Équivalent SQLite de payouts.PostgresLedgerDB (sous BEGIN IMMEDIATE)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def lock(self, sales: bool = True):
+        pass
+
+    def checkpoint(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(checkpoint), 0) AS checkpoint FROM commission_runs").fetchone()["checkpoint"]
+
+    def max_sale_id(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) AS id FROM sales").fetchone()["id"]
+
+    def first_orphan(self, after: int, upto: int, since: str):
+        return self.conn.execute(
+            """
+            SELECT MIN(id) AS id FROM sales
+            WHERE id > ? AND id <= ? AND ambassador_id IS NULL
+              AND strftime('%Y-%m-%dT%H:%M:%fZ', date) > ?
+            """,
+            (after, upto, since),
+        ).fetchone()["id"]
+
+    def open_run(self, rules: dict, after: int, checkpoint: int) -> int:
+        return self.conn.execute(
+            "INSERT INTO commission_runs (rules, after_sale_id, checkpoint) VALUES (?, ?, ?) RETURNING id",
+            (json.dumps(rules), after, checkpoint),
+        ).fetchone()["id"]
+
+    def insert_commissions(self, run_id: int, after: int, upto: int, rules: dict) -> dict:
+        rows = self.conn.execute(
+            """
+            WITH batch AS (
+                SELECT s.id, s.ambassador_id, s.amount, s.kind, s.subscription_id, s.date,
+                       strftime('%Y-%m-01', s.date) AS period
+                FROM sales s
+                WHERE s.id > :after AND s.id <= :upto
+                  AND s.ambassador_id IS NOT NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM commission_ledger l WHERE l.kind = 'commission' AND l.sale_id = s.id
+                  )
+            ),
+            renewals AS (
+                SELECT r.id, row_number() OVER (PARTITION BY r.subscription_id ORDER BY r.date, r.id) AS n
+                FROM sales r
+                WHERE r.kind = 'renewal'
+                  AND r.subscription_id IN (SELECT subscription_id FROM batch WHERE kind = 'renewal')
+            ),
+            raw AS (
+                SELECT b.*,
+                       CASE
+                           WHEN b.kind = 'renewal' AND (:recurring_months = 0 OR r.n <= :recurring_months)
+                               THEN min(:recurring_cents, b.amount)
+                           WHEN b.kind = 'renewal' THEN 0
+                           ELSE CAST(round(b.amount * :upfront_rate) AS INTEGER)
+                       END AS raw_cents
+                FROM batch b
+                LEFT JOIN renewals r ON r.id = b.id
+            ),
+            due AS (
+                SELECT raw.*,
+                       CASE WHEN :sale_cap_cents > 0 THEN min(raw_cents, :sale_cap_cents) ELSE raw_cents END AS cents
+                FROM raw
+            ),
+            running AS (
+                SELECT d.*,
+                       SUM(d.cents) OVER (PARTITION BY d.ambassador_id, d.period ORDER BY d.date, d.id) - d.cents AS earlier,
+                       (
+                           SELECT COALESCE(SUM(l.amount_cents), 0) FROM commission_ledger l
+                           WHERE l.kind = 'commission' AND l.ambassador_id = d.ambassador_id AND l.period = d.period
+                       ) AS booked
+                FROM due d
+            )
+            INSERT INTO commission_ledger (ambassador_id, kind, sale_id, run_id, period, amount_cents, available_at)
+            SELECT ambassador_id, 'commission', id, :run_id, period,
+                   CASE
+                       WHEN :period_cap_cents > 0 THEN max(min(cents, :period_cap_cents - booked - earlier), 0)
+                       ELSE cents
+                   END,
+                   strftime('%Y-%m-%dT%H:%M:%fZ', date, '+' || :hold_days || ' days')
+            FROM running
+            WHERE true
+            ON CONFLICT (sale_id) WHERE kind = 'commission' DO NOTHING
+            RETURNING amount_cents
+            """,
+            {**rules, "run_id": run_id, "after": after, "upto": upto},
+        ).fetchall()
+        # Écart avec l'estimation du webhook (sales.commission), reporté
+        # dans ambassador_stats comme côté Postgres
+        adjusted = self.conn.execute(
+            """
+            SELECT l.ambassador_id, SUM(l.amount_cents - s.commission) AS cents
+            FROM commission_ledger l
+            JOIN sales s ON s.id = l.sale_id
+            WHERE l.run_id = ? AND l.kind = 'commission'
+            GROUP BY l.ambassador_id
+            HAVING SUM(l.amount_cents - s.commission) <> 0
+            """,
+            (run_id,),
+        ).fetchall()
+        if adjusted:
+            now = _now_iso()
+            self.conn.executemany(
+                """
+                UPDATE ambassador_stats SET
+                    commission_unpaid_cents = MAX(commission_unpaid_cents + ?, 0),
+                    updated_at = ?
+                WHERE ambassador_id = ?
+                """,
+                [(r["cents"], now, r["ambassador_id"]) for r in adjusted],
+            )
+            self.conn.executemany(
+                "UPDATE ambassadors SET updated_at = ? WHERE id = ?",
+                [(now, r["ambassador_id"]) for r in adjusted],
+            )
+        return {"entries": len(rows), "amount_cents": sum(r["amount_cents"] for r in rows)}
+
+    def close_run(self, run_id: int, entries: int, amount_cents: int):
+        self.conn.execute(
+            "UPDATE commission_runs SET entries = ?, amount_cents = ? WHERE id = ?",
+            (entries, amount_cents, run_id),
+        )
+
+    def discard_run(self, run_id: int):
+        self.conn.execute("DELETE FROM commission_runs WHERE id = ?", (run_id,))
+
+    def statement(self, now, period=None, ambassador_id=None):
+        return self.conn.execute(
+            """
+            SELECT t.period, a.id AS ambassador_id, a.name, a.email, a.code,
+                   a.payout_preference, a.payout_identifier,
+                   t.sales, t.commission_cents, t.pending_cents, t.earned_cents, t.paid_cents,
+                   t.earned_cents - t.paid_cents AS payable_cents
+            FROM (
+                SELECT l.ambassador_id, l.period,
+                       COUNT(*) FILTER (WHERE l.kind = 'commission') AS sales,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission'), 0) AS commission_cents,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission' AND l.available_at > n.now), 0) AS pending_cents,
+                       COALESCE(SUM(l.amount_cents) FILTER (WHERE l.kind = 'commission' AND l.available_at <= n.now), 0) AS earned_cents,
+                       COALESCE(-SUM(l.amount_cents) FILTER (WHERE l.kind = 'payout'), 0) AS paid_cents
+                FROM commission_ledger l, (SELECT strftime('%Y-%m-%dT%H:%M:%fZ', :now) AS now) n
+                WHERE (:period IS NULL OR l.period = :period)
+                  AND (:ambassador_id IS NULL OR l.ambassador_id = :ambassador_id)
+                GROUP BY l.ambassador_id, l.period
+            ) t
+            JOIN ambassadors a ON a.id = t.ambassador_id
+            ORDER BY t.period, a.id
+            """,
+            {"now": now, "period": period, "ambassador_id": ambassador_id},
+        ).fetchall()
+
+    def pay(self, reference: str, now, through=None):
+        paid = self.conn.execute(
+            """
+            WITH n AS (SELECT strftime('%Y-%m-%dT%H:%M:%fZ', :now) AS now),
+            due AS (
+                SELECT l.ambassador_id, l.period,
+                       SUM(l.amount_cents) FILTER (WHERE l.kind = 'payout' OR l.available_at <= n.now) AS cents
+                FROM commission_ledger l, n
+                WHERE :through IS NULL OR l.period <= :through
+                GROUP BY l.ambassador_id, l.period
+            )
+            INSERT INTO commission_ledger (ambassador_id, kind, payout_ref, period, amount_cents, available_at)
+            SELECT ambassador_id, 'payout', :reference, period, -cents, (SELECT now FROM n)
+            FROM due
+            WHERE cents > 0
+            ON CONFLICT (payout_ref, ambassador_id, period) WHERE kind = 'payout' DO NOTHING
+            RETURNING ambassador_id, -amount_cents AS cents
+            """,
+            {"reference": reference, "now": now, "through": through},
+        ).fetchall()
+
+        totals = {}
+        for row in paid:
+            totals[row["ambassador_id"]] = totals.get(row["ambassador_id"], 0) + row["cents"]
+        self.conn.executemany(
+            """
+            UPDATE ambassador_stats SET
+                commission_paid_cents = commission_paid_cents + ?,
+                commission_unpaid_cents = MAX(commission_unpaid_cents - ?, 0),
+                updated_at = ?
+            WHERE ambassador_id = ?
+            """,
+            [(cents, cents, _now_iso(), ambassador_id) for ambassador_id, cents in totals.items()],
+        )
+        self.conn.executemany(
+            "UPDATE ambassadors SET updated_at = ? WHERE id = ?",
+            [(_now_iso(), ambassador_id) for ambassador_id in totals],
+        )
+        return [{"ambassador_id": k, "cents": v} for k, v in sorted(totals.items())]
+
+
+class SQLiteImportDB:
+    """Équivalent SQLite de bulk_import.PostgresImportDB (sous BEGIN IMMEDIATE)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def stage(self, rows):
+        self.conn.execute("DROP TABLE IF EXISTS temp.ambassador_import")
+        self.conn.execute(
+            """
+            CREATE TEMP TABLE ambassador_import (
+                line INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL,
+                payout_preference TEXT,
+                payout_identifier TEXT,
+                code TEXT NOT NULL
+            )
+            """
+        )
+        # executemany consomme le générateur au fil de l'eau
+        self.conn.executemany(
+            """
+            INSERT INTO ambassador_import (line, name, email, payout_preference, payout_identifier, code)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        self.conn.execute("CREATE INDEX temp.ambassador_import_email_idx ON ambassador_import (email)")
+
+    def update_existing(self, now) -> int:
+        cur = self.conn.execute(
+            """
+            UPDATE ambassadors SET
+                name = s.name,
+                payout_preference = COALESCE(s.payout_preference, ambassadors.payout_preference),
+                payout_identifier = COALESCE(s.payout_identifier, ambassadors.payout_identifier),
+                updated_at = ?
+            FROM ambassador_import AS s
+            WHERE ambassadors.email = s.email
+            """,
+            (now,),
+        )
+        return cur.rowcount
+
+    def count_existing(self) -> int:
+        return self.conn.execute(
+            "SELECT count(*) AS n FROM ambassador_import AS s JOIN ambassadors AS a ON a.email = s.email"
+        ).fetchone()["n"]
+
+    def insert_new(self, now):
+        return self.conn.execute(
+            """
+            INSERT INTO ambassadors (
+                name, email, code, payout_preference, payout_identifier, created_at, updated_at
+            )
+            SELECT s.name, s.email, s.code, s.payout_preference, s.payout_identifier, ?, ?
+            FROM ambassador_import AS s
+            WHERE NOT EXISTS (SELECT 1 FROM ambassadors AS a WHERE a.email = s.email)
+            ORDER BY s.line
+            ON CONFLICT DO NOTHING
+            RETURNING id, name, email, code
+            """,
+            (now, now),
+        ).fetchall()
+
+    def pending_new(self):
+        rows = self.conn.execute(
+            """
+            SELECT s.line FROM ambassador_import AS s
+            WHERE NOT EXISTS (SELECT 1 FROM ambassadors AS a WHERE a.email = s.email)
+            ORDER BY s.line
+            """
+        ).fetchall()
+        return [r["line"] for r in rows]
+
+    def recode(self, pairs):
+        self.conn.executemany(
+            "UPDATE ambassador_import SET code = ? WHERE line = ?",
+            [(code, line) for line, code in pairs],
+        )
+
+    def enqueue_emails(self, messages):
+        _enqueue_emails(self.conn, messages)
@@ -0,0 +1,258 @@
+"""
+Accès aux données des routes : une interface, deux backends.
+
+- PostgresStorage (pg_storage.py) : pool de connexions, migrations versionnées.
+- SQLiteStorage (sqlite_storage.py) : fichier local en WAL, pour un
+  déploiement mono-serveur ou un bench sans serveur de base de données.
+
+Les routes de app.py n'appellent que les méthodes ci-dessous ; aucune
+requête SQL n'y est écrite en dur.
+"""
+import os
+import secrets
+from contextlib import nullcontext
+
+from envconf import env_float
+
+
+CODE_ATTEMPTS = 20
+
+
+def random_code(is_banned=None) -> str:
+    """Code lisible 6 chars (l'unicité est garantie par la contrainte UNIQUE)."""
+    while True:
+        candidate = secrets.token_urlsafe(4)[:6]
+        candidate = candidate.replace("-", "A").replace("_", "B").upper()
+        if not is_banned or not is_banned(candidate):
+            return candidate
+
+
+class Storage:
+    """Contrat commun aux backends (lignes renvoyées sous forme de dict)."""
+
+    name = "abstract"
+
+    # Prédicat optionnel (code -> bool) : codes à ne jamais attribuer
+    code_banned = None
+
+    # metrics.Metrics optionnel : temps de connexion et de chaque requête SQL
+    metrics = None
+
+    # Recherche admin : seuil pg_trgm (Postgres), reconstruction de l'index
+    # mémoire au plus toutes les N secondes (SQLite)
+    search_fuzzy_threshold = 0.6
+    search_index_refresh = 30.0
+
+    # --------------------
+    # Cycle de vie
+    # --------------------
+    def check_schema(self):
+        """Contrôle (ou mise à niveau, selon le backend) du schéma au démarrage."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def replica_reads(self):
+        """
+        Contexte : les lectures du thread courant peuvent aller sur la
+        réplique de lecture (Postgres avec DATABASE_READ_URL). Sans réplique,
+        sans effet ; les écritures restent toujours sur le primaire.
+        """
+        return nullcontext()
+
+    def reads_replica(self) -> bool:
+        """Les lectures du thread courant vont-elles sur la réplique ?"""
+        return False
+
+    # --------------------
+    # Ambassadeurs
+    # --------------------
+    def find_ambassador(self, field: str, value: str):
+        """Fiche par `code` ou `email`, ou None."""
+        raise NotImplementedError
+
+    def signup(self, name, email, payout_preference, payout_identifier, now, accept=None, email_for=None):
+        """
+        Inscription ou mise à jour (par email) dans une seule transaction.
+        `accept(row)` peut refuser la ligne (transaction annulée, renvoie
+        None) ; `email_for(row, is_new)` renvoie (kind, message) à mettre en
+        outbox dans la même transaction, ou None. Renvoie (row, is_new).
+        """
+        raise NotImplementedError
+
+    def dashboard_data(self, ambassador_id: int, days: int = 30):
+        """(série de clics [(date, n)] sur `days` jours, ligne ambassador_stats ou {})."""
+        raise NotImplementedError
+
+    def import_ambassadors(self, rows, now, report, on_existing="update", email_for=None):
+        """
+        bulk_import.import_rows dans une seule transaction (tout ou rien).
+        `rows` : lignes validées (bulk_import.validate_rows), consommées en flux.
+        """
+        raise NotImplementedError
+
+    # --------------------
+    # Clics
+    # --------------------
+    def insert_click_events(self, events):
+        raise NotImplementedError
+
+    def rollup_clicks(self, updated_now: str, retention_days: int = 0):
+        """Rollup incrémental ; renvoie les ids d'ambassadeurs mis à jour."""
+        raise NotImplementedError
+
+    def unrolled_clicks(self, ambassador_id: int) -> dict:
+        """Clics en base pas encore agrégés par le rollup : {date: n}."""
+        raise NotImplementedError
+
+    # --------------------
+    # Stripe
+    # --------------------
+    def apply_stripe_events(self, events, rules=None) -> set:
+        """stripe_sales.process_events dans une transaction ; ids touchés."""
+        raise NotImplementedError
+
+    # --------------------
+    # Admin
+    # --------------------
+    def listing_page(self, opts: dict):
+        """Lignes de la page (limit + 1, voir listing.split_page)."""
+        raise NotImplementedError
+
+    def iter_listing(self, opts: dict, batch_size: int = 2000):
+        """Toutes les lignes filtrées, en flux à mémoire constante."""
+        raise NotImplementedError
+
+    def listing_csv(self, opts: dict):
+        """CSV produit par la base elle-même (itérable d'octets), ou None si non géré."""
+        return None
+
+    def listing_version(self) -> int:
+        """Dernier numéro de modification de la table ambassadors (ETag des exports)."""
+        raise NotImplementedError
+
+    def search_ambassadors(self, opts: dict):
+        """Fiches classées par pertinence (search.parse_search_args), limit + 1 au plus."""
+        raise NotImplementedError
+
+    # --------------------
+    # Outbox
+    # --------------------
+    def claim_outbox(self, batch_size: int):
+        """Réserve un lot de messages dus : [{"id", "payload", "attempts"}]."""
+        raise NotImplementedError
+
+    def record_outbox(self, updates):
+        """Applique outbox.plan_updates()."""
+        raise NotImplementedError
+
+    # --------------------
+    # Campagnes
+    # --------------------
+    def start_campaign(self, campaign_id: str, template: str, params: dict, stale_after: float = 600.0):
+        """
+        Crée la campagne ou reprend une campagne interrompue (statut remis à
+        running). Renvoie sa ligne, ou None si elle est terminée ou déjà en
+        cours ailleurs (mise à jour il y a moins de `stale_after` secondes).
+        """
+        raise NotImplementedError
+
+    def get_campaign(self, campaign_id: str):
+        raise NotImplementedError
+
+    def iter_campaign_recipients(self, campaign_id: str, after_id: int, batch_size: int = 1000):
+        """
+        Ambassadeurs d'id > after_id sans envoi enregistré pour la campagne,
+        par id croissant, avec leurs agrégats de ventes ; en flux.
+        """
+        raise NotImplementedError
+
+    def record_campaign_batch(self, campaign_id: str, results, checkpoint: int):
+        """
+        Une transaction : envois du lot [(ambassador_id, status, message_id,
+        error)], compteurs, et point de reprise avancé à `checkpoint`.
+        """
+        raise NotImplementedError
+
+    def finish_campaign(self, campaign_id: str, status: str):
+        raise NotImplementedError
+
+    # --------------------
+    # Commissions
+    # --------------------
+    def update_commission_ledger(self, rules, full: bool = False) -> dict:
+        """
+        payouts.update_ledger dans une transaction : commissions des ventes
+        arrivées depuis le dernier passage (toutes si `full`).
+        """
+        raise NotImplementedError
+
+    def commission_statement(self, now: str, period: str = None, ambassador_id: int = None):
+        """Relevé (payouts.STATEMENT_COLUMNS) par période et ambassadeur, lu en une requête."""
+        raise NotImplementedError
+
+    def pay_commissions(self, reference: str, now: str, through: str = None):
+        """Versement des soldes acquis (périodes <= `through`) : [{"ambassador_id", "cents"}]."""
+        raise NotImplementedError
+
+    # --------------------
+    # Bannissements
+    # --------------------
+    def ban_version(self) -> int:
+        raise NotImplementedError
+
+    def load_bans(self):
+        """(version, [{"kind", "value"}]) lus ensemble."""
+        raise NotImplementedError
+
+    def add_ban(self, kind: str, value: str, reason: str = None):
+        raise NotImplementedError
+
+    def remove_ban(self, kind: str, value: str) -> bool:
+        raise NotImplementedError
+
+    def list_bans(self):
+        raise NotImplementedError
+
+
+def storage_from_env() -> Storage:
+    """
+    Variables d'environnement :
+      - STORAGE_BACKEND : "postgres" | "sqlite" (auto : sqlite si seul
+        SQLITE_PATH est défini, postgres sinon)
+      - DATABASE_URL (postgres)
+      - DATABASE_READ_URL (postgres, optionnelle : réplique de lecture)
+      - SQLITE_PATH (sqlite, défaut betty.sqlite3 à la racine du projet)
+      - SEARCH_FUZZY_THRESHOLD (postgres, défaut 0.6 ; 0 = préfixes seulement)
+      - SEARCH_INDEX_REFRESH (sqlite, défaut 30 s)
+    """
+    storage = _backend_from_env()
+    storage.search_fuzzy_threshold = env_float("SEARCH_FUZZY_THRESHOLD", storage.search_fuzzy_threshold)
+    storage.search_index_refresh = env_float("SEARCH_INDEX_REFRESH", storage.search_index_refresh)
+    return storage
+
+
+def _backend_from_env() -> Storage:
+    backend = (os.environ.get("STORAGE_BACKEND") or "").strip().lower()
+    database_url = (os.environ.get("DATABASE_URL") or "").strip()
+    if not backend:
+        backend = "sqlite" if os.environ.get("SQLITE_PATH") and not database_url else "postgres"
+
+    if backend == "postgres":
+        from pg_storage import PostgresStorage
+
+        if not database_url:
+            raise RuntimeError("DATABASE_URL manquante")
+        return PostgresStorage(database_url, read_dsn=(os.environ.get("DATABASE_READ_URL") or "").strip())
+
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "betty.sqlite3")
+        return SQLiteStorage((os.environ.get("SQLITE_PATH") or "").strip() or default)
+
+    raise RuntimeError(f"STORAGE_BACKEND inconnu : {backend}")
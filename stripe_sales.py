@@ -0,0 +1,379 @@
+import json
+import logging
+import datetime
+
+import stripe
+from psycopg2.extras import execute_values
+
+
+logger = logging.getLogger(__name__)
+
+# Règles de commission (centimes)
+COMMISSION_UPFRONT_RATE = 0.30  # 30 % du premier paiement
+COMMISSION_RECURRING_CENTS = 1000  # 10 € par mensualité suivante
+
+ACTIVE_STATUSES = {"active", "trialing", "past_due"}
+
+
+class InvalidWebhook(ValueError):
+    """Signature absente / invalide ou corps illisible."""
+
+
+def verify_and_parse(payload: bytes, sig_header: str, secret: str, tolerance: int = 300) -> dict:
+    """Vérifie la signature Stripe (hors réseau) puis décode l'événement."""
+    try:
+        stripe.WebhookSignature.verify_header(payload, sig_header, secret, tolerance)
+    except stripe.SignatureVerificationError as e:
+        raise InvalidWebhook(str(e))
+    try:
+        event = json.loads(payload)
+    except ValueError as e:
+        raise InvalidWebhook(f"JSON invalide : {e}")
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise InvalidWebhook("Événement Stripe sans id / type")
+    return event
+
+
+def commission_for(amount: int, kind: str, rules=None) -> int:
+    """
+    Commission estimée à l'arrivée de la vente, avec les règles du grand
+    livre (payouts.CommissionRules ; défaut : constantes ci-dessus). Les
+    plafonds mensuels et la limite de mensualités ne se connaissent qu'au
+    passage du grand livre, qui corrige alors l'écart dans ambassador_stats.
+    """
+    rate = COMMISSION_UPFRONT_RATE if rules is None else rules.upfront_rate
+    recurring = COMMISSION_RECURRING_CENTS if rules is None else rules.recurring_cents
+    if kind == "renewal":
+        cents = min(recurring, amount)
+    else:
+        cents = int(round(amount * rate))
+    if rules is not None and rules.sale_cap_cents:
+        cents = min(cents, rules.sale_cap_cents)
+    return cents
+
+
+# --------------------
+# Lecture des objets Stripe
+# --------------------
+def _ref_of(obj: dict) -> str:
+    ref = obj.get("client_reference_id") or (obj.get("metadata") or {}).get("ref")
+    if not ref:
+        details = obj.get("subscription_details") or (
+            (obj.get("parent") or {}).get("subscription_details") or {}
+        )
+        ref = (details.get("metadata") or {}).get("ref")
+    return (ref or "").strip().upper()
+
+
+def _subscription_of(obj: dict):
+    sub = obj.get("subscription")
+    if not sub:
+        sub = ((obj.get("parent") or {}).get("subscription_details") or {}).get("subscription")
+    if isinstance(sub, dict):
+        sub = sub.get("id")
+    return sub or None
+
+
+def _ts(epoch) -> datetime.datetime:
+    return datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc)
+
+
+def _invoice_sale(event: dict, obj: dict):
+    amount = int(obj.get("amount_paid") or 0)
+    if amount <= 0:
+        return None
+    kind = "first" if obj.get("billing_reason") == "subscription_create" else "renewal"
+    paid_at = (obj.get("status_transitions") or {}).get("paid_at") or event.get("created")
+    return {
+        "stripe_object_id": obj["id"],
+        "stripe_event_id": event["id"],
+        "ref": _ref_of(obj),
+        "subscription_id": _subscription_of(obj),
+        "customer_email": obj.get("customer_email"),
+        "amount": amount,
+        "currency": obj.get("currency"),
+        "kind": kind,
+        "date": _ts(paid_at),
+    }
+
+
+def _checkout_sale(event: dict, obj: dict):
+    """Paiement unique : l'abonnement, lui, est compté via invoice.paid."""
+    if obj.get("mode") != "payment" or obj.get("payment_status") != "paid":
+        return None
+    amount = int(obj.get("amount_total") or 0)
+    if amount <= 0:
+        return None
+    return {
+        "stripe_object_id": obj["id"],
+        "stripe_event_id": event["id"],
+        "ref": _ref_of(obj),
+        "subscription_id": None,
+        "customer_email": (obj.get("customer_details") or {}).get("email"),
+        "amount": amount,
+        "currency": obj.get("currency"),
+        "kind": "one_time",
+        "date": _ts(event.get("created")),
+    }
+
+
+# --------------------
+# Traitement par lot
+# --------------------
+class _Deltas:
+    """Variations d'agrégats par ambassadeur, écrites en une seule requête."""
+
+    def __init__(self):
+        self.stats = {}
+        self.signups = {}
+
+    def add(self, ambassador_id, revenue=0, sales=0, unpaid=0, active=0):
+        d = self.stats.setdefault(ambassador_id, [0, 0, 0, 0])
+        d[0] += revenue
+        d[1] += sales
+        d[2] += unpaid
+        d[3] += active
+
+    def signup(self, ambassador_id):
+        self.signups[ambassador_id] = self.signups.get(ambassador_id, 0) + 1
+
+    def touched(self):
+        return set(self.stats) | set(self.signups)
+
+
+class PostgresStripeDB:
+    """
+    Accès SQL de process_events, dans la transaction du curseur `cur`.
+    Le backend SQLite fournit les mêmes méthodes (sqlite_storage.py).
+    """
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def claim_events(self, pairs) -> set:
+        """INSERT des (id, type) ; renvoie les ids jamais vus."""
+        rows = execute_values(
+            self.cur,
+            "INSERT INTO stripe_events (id, type) VALUES %s ON CONFLICT (id) DO NOTHING RETURNING id",
+            pairs,
+            fetch=True,
+        )
+        return {r["id"] for r in rows}
+
+    def resolve_codes(self, codes) -> dict:
+        self.cur.execute("SELECT id, code FROM ambassadors WHERE code = ANY(%s)", (codes,))
+        return {r["code"]: r["id"] for r in self.cur.fetchall()}
+
+    def lock_subscription(self, sub_id):
+        # Ligne créée au besoin : sans elle, FOR UPDATE ne verrouille rien et
+        # deux événements simultanés (checkout.session.completed et
+        # customer.subscription.created) croient tous deux l'abonnement neuf
+        self.cur.execute(
+            "INSERT INTO stripe_subscriptions (id) VALUES (%s) ON CONFLICT (id) DO NOTHING",
+            (sub_id,),
+        )
+        self.cur.execute(
+            "SELECT ambassador_id, status, status_at FROM stripe_subscriptions WHERE id = %s FOR UPDATE",
+            (sub_id,),
+        )
+        return self.cur.fetchone()
+
+    def save_subscription(self, sub_id, ambassador_id, status, status_at):
+        self.cur.execute(
+            """
+            INSERT INTO stripe_subscriptions (id, ambassador_id, status, status_at, updated_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (id) DO UPDATE SET
+                ambassador_id = COALESCE(stripe_subscriptions.ambassador_id, EXCLUDED.ambassador_id),
+                status = EXCLUDED.status,
+                status_at = EXCLUDED.status_at,
+                updated_at = now()
+            """,
+            (sub_id, ambassador_id, status, status_at),
+        )
+
+    def attach_orphan_sales(self, ambassador_id, sub_id):
+        """Factures arrivées avant l'attribution : rattachées maintenant."""
+        self.cur.execute(
+            """
+            UPDATE sales SET ambassador_id = %s
+            WHERE subscription_id = %s AND ambassador_id IS NULL
+            RETURNING amount, commission
+            """,
+            (ambassador_id, sub_id),
+        )
+        return self.cur.fetchall()
+
+    def subscription_owner(self, sub_id):
+        self.cur.execute("SELECT ambassador_id FROM stripe_subscriptions WHERE id = %s", (sub_id,))
+        row = self.cur.fetchone()
+        return row["ambassador_id"] if row else None
+
+    def insert_sales(self, sales):
+        """INSERT idempotent (objet Stripe) ; renvoie les lignes réellement créées."""
+        return execute_values(
+            self.cur,
+            """
+            INSERT INTO sales (
+                ambassador_id, customer_email, amount, subscription_id, date,
+                stripe_object_id, stripe_event_id, currency, kind, commission
+            )
+            VALUES %s
+            ON CONFLICT (stripe_object_id) DO NOTHING
+            RETURNING ambassador_id, amount, commission
+            """,
+            sales,
+            fetch=True,
+        )
+
+    def write_deltas(self, stats, signups):
+        if stats:
+            execute_values(
+                self.cur,
+                """
+                INSERT INTO ambassador_stats (
+                    ambassador_id, revenue_cents, sales_count,
+                    commission_unpaid_cents, active_subscriptions, updated_at
+                )
+                VALUES %s
+                ON CONFLICT (ambassador_id) DO UPDATE SET
+                    revenue_cents = ambassador_stats.revenue_cents + EXCLUDED.revenue_cents,
+                    sales_count = ambassador_stats.sales_count + EXCLUDED.sales_count,
+                    commission_unpaid_cents = ambassador_stats.commission_unpaid_cents + EXCLUDED.commission_unpaid_cents,
+                    active_subscriptions = GREATEST(ambassador_stats.active_subscriptions + EXCLUDED.active_subscriptions, 0),
+                    updated_at = now()
+                """,
+                stats,
+                template="(%s, %s, %s, %s, %s, now())",
+            )
+        if signups:
+            execute_values(
+                self.cur,
+                """
+                UPDATE ambassadors AS a
+                SET signups = a.signups + v.n, updated_at = now()
+                FROM (VALUES %s) AS v(id, n)
+                WHERE a.id = v.id
+                """,
+                signups,
+            )
+
+
+def _dedup(db, events):
+    unique = {}
+    for e in events:
+        unique.setdefault(e["id"], e)
+    if not unique:
+        return []
+    fresh = db.claim_events([(e["id"], e["type"]) for e in unique.values()])
+    return sorted((e for e in unique.values() if e["id"] in fresh), key=lambda e: e.get("created") or 0)
+
+
+def _resolve_codes(db, codes):
+    codes = sorted({c for c in codes if c})
+    if not codes:
+        return {}
+    return db.resolve_codes(codes)
+
+
+def _apply_subscription(db, deltas, sub_id, ambassador_id, status, status_at):
+    prev = db.lock_subscription(sub_id)
+    old_amb = prev["ambassador_id"] if prev else None
+    old_status = prev["status"] if prev else None
+    old_at = prev["status_at"] if prev else 0
+
+    amb = old_amb or ambassador_id
+    # Un statut plus ancien que celui déjà appliqué est ignoré (livraison désordonnée)
+    if status is None or status_at < old_at:
+        status, status_at = old_status, old_at
+
+    db.save_subscription(sub_id, amb, status, status_at)
+
+    was_active = old_amb is not None and old_status in ACTIVE_STATUSES
+    now_active = amb is not None and status in ACTIVE_STATUSES
+    if was_active != now_active:
+        deltas.add(amb, active=1 if now_active else -1)
+
+    if amb is not None and old_amb is None:
+        deltas.signup(amb)
+        for r in db.attach_orphan_sales(amb, sub_id):
+            deltas.add(amb, revenue=r["amount"], sales=1, unpaid=r["commission"])
+
+
+def process_events(db, events, rules=None) -> set:
+    """
+    Applique un lot d'événements Stripe dans la transaction courante de
+    `db` (PostgresStripeDB ou équivalent) : déduplication sur l'id
+    d'événement, attribution via le code `ref`, INSERT idempotent des ventes
+    (objet Stripe) et mise à jour des agrégats par ambassadeur. Renvoie les
+    ids d'ambassadeurs touchés. `rules` : voir commission_for.
+    """
+    events = _dedup(db, events)
+    if not events:
+        return set()
+
+    objects = [(e, (e.get("data") or {}).get("object") or {}) for e in events]
+    ambassador_by_code = _resolve_codes(db, [_ref_of(obj) for _e, obj in objects])
+    deltas = _Deltas()
+
+    # 1. Attribution et statut des abonnements (avant les ventes du même lot)
+    for event, obj in objects:
+        etype = event["type"]
+        created = int(event.get("created") or 0)
+        if etype == "checkout.session.completed" and obj.get("subscription"):
+            status = "active" if obj.get("payment_status") in ("paid", "no_payment_required") else None
+            _apply_subscription(
+                db, deltas, _subscription_of(obj), ambassador_by_code.get(_ref_of(obj)), status, created
+            )
+        elif etype.startswith("customer.subscription."):
+            status = "canceled" if etype == "customer.subscription.deleted" else obj.get("status")
+            _apply_subscription(
+                db, deltas, obj["id"], ambassador_by_code.get(_ref_of(obj)), status, created
+            )
+
+    # 2. Ventes
+    sales = []
+    for event, obj in objects:
+        etype = event["type"]
+        if etype in ("invoice.paid", "invoice.payment_succeeded"):
+            sale = _invoice_sale(event, obj)
+        elif etype == "checkout.session.completed":
+            sale = _checkout_sale(event, obj)
+        else:
+            continue
+        if not sale:
+            continue
+
+        ambassador_id = ambassador_by_code.get(sale["ref"])
+        if ambassador_id is None and sale["subscription_id"]:
+            ambassador_id = db.subscription_owner(sale["subscription_id"])
+        if ambassador_id is None:
+            logger.info("Vente Stripe %s non attribuée (ref=%r)", sale["stripe_object_id"], sale["ref"])
+
+        sales.append(
+            (
+                ambassador_id,
+                sale["customer_email"],
+                sale["amount"],
+                sale["subscription_id"],
+                sale["date"],
+                sale["stripe_object_id"],
+                sale["stripe_event_id"],
+                sale["currency"],
+                sale["kind"],
+                commission_for(sale["amount"], sale["kind"], rules),
+            )
+        )
+
+    if sales:
+        for r in db.insert_sales(sales):
+            if r["ambassador_id"] is not None:
+                deltas.add(r["ambassador_id"], revenue=r["amount"], sales=1, unpaid=r["commission"])
+
+    # Tout ambassadeur touché passe par l'UPDATE (signups + 0 au besoin) :
+    # son updated_at, validateur HTTP du dashboard, change avec ses ventes
+    db.write_deltas(
+        [(amb, *d) for amb, d in sorted(deltas.stats.items())],
+        [(amb, deltas.signups.get(amb, 0)) for amb in sorted(deltas.touched())],
+    )
+    return deltas.touched()
@@ -0,0 +1,133 @@
+import os
+import sys
+from contextlib import closing
+
+import pytest
+
+
+# Modules à plat à la racine du dépôt (app, outbox, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN_TOKEN = "test-admin"
+
+# Base Postgres jetable (vidée entre les tests) : sans elle, tests Postgres ignorés
+TEST_DATABASE_URL = (os.environ.get("TEST_DATABASE_URL") or "").strip()
+
+
+@pytest.fixture(scope="session")
+def pg_url():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL non définie")
+    import psycopg2
+    from migrations import upgrade
+
+    with closing(psycopg2.connect(TEST_DATABASE_URL)) as conn:
+        upgrade(conn)
+    return TEST_DATABASE_URL
+
+
+@pytest.fixture
+def pg_conn(pg_url):
+    """
+    Connexion à la base de test. Après le test, les tables sont vidées
+    (sauf schema_migrations et les compteurs de version posés par les
+    migrations).
+    """
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(pg_url, cursor_factory=RealDictCursor)
+    yield conn
+    conn.rollback()
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT tablename FROM pg_tables
+            WHERE schemaname = 'public'
+              AND tablename <> 'schema_migrations' AND tablename NOT LIKE '%\\_version'
+            """
+        )
+        tables = ", ".join(row["tablename"] for row in cur.fetchall())
+        # Sans les triggers (grand livre en ajout seul) le temps du nettoyage
+        cur.execute("SET LOCAL session_replication_role = replica")
+        cur.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path):
+    """Backend neuf : fichier SQLite temporaire, ou la base Postgres de test."""
+    if request.param == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        storage = SQLiteStorage(str(tmp_path / "test.sqlite3"))
+        storage.check_schema()
+    else:
+        from pg_storage import PostgresStorage
+
+        request.getfixturevalue("pg_conn")  # tables vidées après le test
+        storage = PostgresStorage(request.getfixturevalue("pg_url"))
+    yield storage
+    storage.close()
+
+
+@pytest.fixture
+def sql(storage):
+    """
+    sql(requête, params) sur le backend du test, dans sa propre transaction
+    (paramètres %s pour les deux) ; renvoie les lignes en dict.
+    """
+
+    def run(query: str, params=()):
+        if storage.name == "sqlite":
+            with storage._write() as conn:
+                cur = conn.execute(query.replace("%s", "?"), params)
+                return cur.fetchall() if cur.description else []
+        with closing(storage.connect()) as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                rows = [dict(r) for r in cur.fetchall()] if cur.description else []
+            conn.commit()
+        return rows
+
+    return run
+
+
+@pytest.fixture
+def codes(monkeypatch):
+    """Codes candidats imposés aux deux backends, dans l'ordre (aléatoires une fois épuisés)."""
+    import pg_storage
+    import sqlite_storage
+
+    queue = []
+    random_code = pg_storage.random_code
+
+    def next_code(is_banned=None):
+        return queue.pop(0) if queue else random_code(is_banned)
+
+    for module in (pg_storage, sqlite_storage):
+        monkeypatch.setattr(module, "random_code", next_code)
+    return queue
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    """
+    Module app importé une fois, sur une base SQLite temporaire (les
+    réglages sont lus à l'import) : sans limites, sans envois ni threads.
+    """
+    os.environ.update(
+        {
+            "STORAGE_BACKEND": "sqlite",
+            "SQLITE_PATH": str(tmp_path_factory.mktemp("app") / "app.sqlite3"),
+            "ADMIN_TOKEN": ADMIN_TOKEN,
+            "RATE_LIMIT_ENABLED": "0",
+            "BAN_POLL_INTERVAL": "0",
+        }
+    )
+    os.environ.pop("DATABASE_URL", None)
+    os.environ.pop("MAILJET_API_KEY", None)
+    import app
+
+    return app
@@ -0,0 +1,106 @@
+import pytest
+
+import antibot
+from antibot import ClickFilter, WindowedBloom, is_bot_user_agent
+
+
+BROWSER = "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Version/17.4 Mobile Safari/604.1"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(antibot.time, "monotonic", clock)
+    return clock
+
+
+def test_repeat_seen_within_window(clock):
+    bloom = WindowedBloom(capacity=1000, window=60)
+
+    assert not bloom.check_and_add("ABC123|f1")
+    assert bloom.check_and_add("ABC123|f1")
+    assert not bloom.check_and_add("ABC123|f2")
+    assert not bloom.check_and_add("XYZ789|f1")
+
+
+def test_key_kept_for_one_rotation(clock):
+    bloom = WindowedBloom(capacity=1000, window=60)
+    bloom.check_and_add("ABC123|f1")
+
+    # Rotation : la clé passe dans la génération précédente, encore reconnue
+    clock.now += 90
+    assert bloom.check_and_add("ABC123|f1")
+    assert bloom.stats()["rotations"] == 1
+
+
+def test_key_forgotten_after_two_rotations(clock):
+    bloom = WindowedBloom(capacity=1000, window=60)
+    bloom.check_and_add("ABC123|f1")
+
+    for i in range(2):
+        clock.now += 61
+        bloom.check_and_add(f"other|{i}")
+
+    assert bloom.stats()["rotations"] == 2
+    assert not bloom.check_and_add("ABC123|f1")
+
+
+def test_full_generation_rotates_early(clock):
+    bloom = WindowedBloom(capacity=10, window=3600)
+    keys = [f"ABC123|{i}" for i in range(10)]
+    for key in keys:
+        assert not bloom.check_and_add(key)
+
+    # Génération pleine bien avant la fin de la fenêtre
+    assert not bloom.check_and_add("ABC123|new")
+    stats = bloom.stats()
+    assert stats["rotations"] == 1 and stats["early_rotations"] == 1
+    assert stats["keys_current"] == 1
+    assert bloom.check_and_add(keys[0])
+
+
+def test_false_positive_rate_stays_near_target(clock):
+    bloom = WindowedBloom(capacity=2000, fp_rate=0.01, window=3600, sample_every=1)
+    for i in range(2000):
+        bloom.check_and_add(f"seen|{i}")
+
+    false_positives = sum(bloom.check_and_add(f"new|{i}") for i in range(2000))
+
+    # Les 2000 nouvelles clés font tourner le filtre : l'ancienne génération
+    # pleine compte encore, d'où une marge sur la cible
+    assert false_positives / 2000 < 0.03
+    stats = bloom.stats()
+    # Échantillon (ici toutes les clés) : 4000 clés nouvelles au total
+    assert stats["sampled_new"] == 4000
+    assert stats["measured_fp_rate"] < 0.03
+    assert stats["estimated_fp_rate"] < 0.03
+
+
+def test_bot_user_agents():
+    assert is_bot_user_agent("")
+    assert is_bot_user_agent("facebookexternalhit/1.1 (+http://www.facebook.com/externalhit_uatext.php)")
+    assert is_bot_user_agent("WhatsApp/2.23.20.0")
+    assert is_bot_user_agent("curl/8.5.0")
+    assert not is_bot_user_agent(BROWSER)
+
+
+def test_click_filter(clock):
+    click_filter = ClickFilter(bloom=WindowedBloom(capacity=1000, window=60))
+
+    assert click_filter.classify("ABC123", "f1", BROWSER) == "ok"
+    assert click_filter.classify("ABC123", "f1", BROWSER) == "duplicate"
+    assert click_filter.classify("ABC123", "f2", BROWSER, prefetch=True) == "bot"
+    assert click_filter.classify("ABC123", "f2", "Slackbot-LinkExpanding 1.0") == "bot"
+    # Les robots ne marquent pas l'empreinte : le vrai clic suivant compte
+    assert click_filter.classify("ABC123", "f2", BROWSER) == "ok"
+
+    stats = click_filter.stats()
+    assert (stats["accepted"], stats["duplicates"], stats["bots"], stats["prefetches"]) == (2, 1, 1, 1)
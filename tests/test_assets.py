@@ -0,0 +1,54 @@
+import os
+
+import assets
+from assets import AssetManifest, build_assets
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_manifest_loaded_without_hashing(tmp_path, monkeypatch):
+    static = str(tmp_path)
+    write(os.path.join(static, "css", "betty.css"), "body { color: #222; }\n" * 40)
+    write(os.path.join(static, "img", "logo.svg"), "<svg/>")
+    manifest = build_assets(static)
+
+    def no_hash(path):
+        raise AssertionError(f"{path} relu au chargement")
+
+    monkeypatch.setattr(assets, "_sha256", no_hash)
+    loaded = AssetManifest(static)
+
+    assert loaded.stale == []
+    assert loaded.filename("css/betty.css") == manifest["files"]["css/betty.css"]["path"]
+    assert loaded.encodings[loaded.filename("css/betty.css")] == tuple(
+        e for e, _ in assets.ENCODINGS if e in manifest["files"]["css/betty.css"]["encodings"]
+    )
+    assert loaded.fingerprint
+
+
+def test_source_changed_after_build_is_stale(tmp_path):
+    static = str(tmp_path)
+    css = os.path.join(static, "css", "betty.css")
+    write(css, "body { color: #222; }\n")
+    write(os.path.join(static, "app.js"), "console.log(1);\n")
+    build_assets(static)
+    built_at = os.stat(os.path.join(static, assets.DIST_DIR, assets.MANIFEST_NAME)).st_mtime
+
+    # Même taille, modifié après le build
+    write(css, "body { color: #333; }\n")
+    os.utime(css, (built_at + 5, built_at + 5))
+
+    loaded = AssetManifest(static)
+    assert loaded.stale == ["css/betty.css"]
+    assert loaded.filename("css/betty.css") == "css/betty.css"
+    assert loaded.filename("app.js").startswith("dist/app.")
+
+
+def test_missing_manifest_serves_original_names(tmp_path):
+    loaded = AssetManifest(str(tmp_path))
+    assert loaded.filename("css/betty.css") == "css/betty.css"
+    assert loaded.fingerprint == "" and loaded.stats()["files"] == 0
@@ -0,0 +1,82 @@
+import pytest
+
+from bans import BanList, BanSnapshot, ban_list_from_env
+
+
+def test_domain_covers_subdomains():
+    snapshot = BanSnapshot(domains={"exemple.com"})
+
+    assert snapshot.email_banned("a@exemple.com")
+    assert snapshot.email_banned("A@Mail.Exemple.COM ")
+    assert snapshot.email_banned("a@x.y.exemple.com")
+    assert not snapshot.email_banned("a@exemple.com.fr")
+    assert not snapshot.email_banned("a@pasexemple.com")
+    assert not snapshot.email_banned("")
+
+
+def test_emails_and_codes():
+    snapshot = BanSnapshot(emails={"spam@x.fr"}, codes={"ABC123"})
+
+    assert snapshot.email_banned(" Spam@X.fr")
+    assert not snapshot.email_banned("ham@x.fr")
+    assert snapshot.code_banned("abc123")
+    assert not snapshot.code_banned("XYZ789")
+    assert not snapshot.code_banned(None)
+    assert len(snapshot) == 2
+
+
+def test_env_lists_normalized(monkeypatch):
+    monkeypatch.setenv("BANNED_EMAILS", "Spam@X.fr, ")
+    monkeypatch.setenv("BANNED_DOMAINS", "@Exemple.com.,\nautre.org")
+    monkeypatch.setenv("BANNED_CODES", "abc123")
+    monkeypatch.setenv("BAN_POLL_INTERVAL", "0")
+
+    snapshot = ban_list_from_env(store=None).snapshot
+
+    assert snapshot.emails == {"spam@x.fr"}
+    assert snapshot.domains == {"exemple.com", "autre.org"}
+    assert snapshot.codes == {"ABC123"}
+
+
+@pytest.fixture
+def bans(storage):
+    changes = []
+    ban_list = BanList(
+        storage,
+        static=BanSnapshot(codes={"ENV001"}, version=-1),
+        poll_interval=0,
+        on_change=changes.append,
+    )
+    ban_list.changes = changes
+    return ban_list
+
+
+def test_reload_only_when_version_changes(bans, sql):
+    assert bans.refresh()
+    assert not bans.refresh()
+    assert bans.stats()["reloads"] == 1
+
+    # Écriture hors de l'app : les triggers de `bans` font avancer ban_version
+    sql("INSERT INTO bans (kind, value) VALUES ('domain', 'exemple.com')")
+
+    assert bans.refresh()
+    assert bans.snapshot.email_banned("a@mail.exemple.com")
+    # Liste d'environnement toujours fusionnée
+    assert bans.snapshot.code_banned("ENV001")
+    assert len(bans.changes) == 2
+
+
+def test_add_and_remove_swap_snapshot(bans):
+    bans.start()
+    before = bans.snapshot
+
+    assert bans.add("email", " Spam@X.fr ", reason="test") == "spam@x.fr"
+    assert bans.snapshot is not before
+    assert bans.snapshot.email_banned("spam@x.fr")
+    # L'ancien instantané n'est jamais modifié
+    assert not before.email_banned("spam@x.fr")
+
+    assert bans.remove("email", "SPAM@x.fr")
+    assert not bans.snapshot.email_banned("spam@x.fr")
+    assert not bans.remove("email", "spam@x.fr")
+    assert [r["value"] for r in bans.list()] == []
@@ -0,0 +1,134 @@
+import io
+
+import pytest
+
+from bulk_import import BulkImportError, CsvStream, ImportReport, validate_rows
+
+
+NOW = "2026-03-01T10:00:00Z"
+
+
+def welcome(row, is_new):
+    return ("ambassador_welcome", {"To": [{"Email": row["email"]}], "Subject": "Bienvenue"})
+
+
+def csv_rows(text, is_banned_email=None):
+    report = ImportReport()
+    return list(validate_rows(io.StringIO(text), report, is_banned_email)), report
+
+
+def emails_and_codes(sql):
+    return [(r["email"], r["code"]) for r in sql("SELECT email, code FROM ambassadors ORDER BY id")]
+
+
+def test_csv_stream_serializes_on_demand():
+    rows = [(i, f"Nom {i}", None) for i in range(1000)]
+    stream = CsvStream(rows, batch_size=7)
+
+    first = stream.read(5)
+    chunks = [first]
+    while True:
+        chunk = stream.read(64)
+        if not chunk:
+            break
+        assert len(chunk) <= 64
+        chunks.append(chunk)
+
+    assert first == "0,Nom"
+    lines = "".join(chunks).splitlines()
+    assert len(lines) == 1000
+    # None -> champ vide non quoté (NULL pour COPY ... FORMAT csv)
+    assert lines[999] == "999,Nom 999,"
+    assert stream.read() == ""
+
+
+def test_csv_stream_quotes_separators():
+    stream = CsvStream([(1, 'Dupont, "Jo"', "a\nb")])
+
+    assert stream.read() == '1,"Dupont, ""Jo""","a\nb"\n'
+
+
+def test_validate_rows_reports_each_rejected_line():
+    rows, report = csv_rows(
+        "Name, EMAIL ,payout_preference\n"
+        "Alice,Alice@X.fr,PayPal\n"
+        ",bob@x.fr,\n"
+        "Carol,carol-at-x,\n"
+        "Dan,dan@x.fr,cheque\n"
+        "Alice bis,alice@x.fr,\n"
+        "Eve,eve@spam.fr,\n",
+        is_banned_email=lambda email: email.endswith("@spam.fr"),
+    )
+
+    assert rows == [(2, "Alice", "alice@x.fr", "paypal", None)]
+    assert report.rows == 6
+    assert [(e["line"], e["error"]) for e in report.errors] == [
+        (3, "nom et email obligatoires"),
+        (4, "email invalide"),
+        (5, "payout_preference inconnue : cheque"),
+        (6, "email en double dans le fichier"),
+        (7, "email banni"),
+    ]
+
+
+def test_validate_rows_requires_columns():
+    with pytest.raises(BulkImportError):
+        csv_rows("name,courriel\nAlice,alice@x.fr\n")
+
+
+def test_import_updates_known_and_inserts_new(storage, sql):
+    storage.signup("Alice", "alice@x.fr", "paypal", None, NOW)
+    rows, report = csv_rows("name,email,payout_identifier\nAlice M.,alice@x.fr,FR76\nBob,bob@x.fr,\n")
+
+    inserted = storage.import_ambassadors(rows, NOW, report, email_for=welcome)
+
+    assert [r["email"] for r in inserted] == ["bob@x.fr"]
+    assert (report.inserted, report.updated, report.emails) == (1, 1, 1)
+    alice = sql("SELECT * FROM ambassadors WHERE email = 'alice@x.fr'")[0]
+    assert (alice["name"], alice["payout_preference"], alice["payout_identifier"]) == ("Alice M.", "paypal", "FR76")
+    assert [r["to_email"] for r in sql("SELECT to_email FROM email_outbox")] == ["bob@x.fr"]
+
+
+def test_import_skip_leaves_known_rows(storage, sql):
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+    rows, report = csv_rows("name,email\nAutre nom,alice@x.fr\n")
+
+    assert storage.import_ambassadors(rows, NOW, report, on_existing="skip") == []
+    assert (report.skipped, report.updated) == (1, 0)
+    assert sql("SELECT name FROM ambassadors")[0]["name"] == "Alice"
+
+
+def test_colliding_codes_redrawn(storage, sql, codes):
+    codes.append("AAAAAA")
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+
+    # Candidats : Bob en collision avec la base, Carol avec Dan (même fichier) ;
+    # seules les lignes restantes sont retirées, jusqu'à un code libre
+    codes.extend(["AAAAAA", "CCCCCC", "CCCCCC", "AAAAAA", "CCCCCC", "BBBBBB", "DDDDDD"])
+    rows, report = csv_rows("name,email\nBob,bob@x.fr\nCarol,carol@x.fr\nDan,dan@x.fr\n")
+
+    storage.import_ambassadors(rows, NOW, report)
+
+    assert report.inserted == 3
+    assert emails_and_codes(sql) == [
+        ("alice@x.fr", "AAAAAA"),
+        ("carol@x.fr", "CCCCCC"),
+        ("bob@x.fr", "BBBBBB"),
+        ("dan@x.fr", "DDDDDD"),
+    ]
+
+
+def test_import_gives_up_after_code_attempts(storage, sql, codes, monkeypatch):
+    monkeypatch.setattr("bulk_import.CODE_ATTEMPTS", 2)
+    codes.append("AAAAAA")
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+
+    codes.extend(["AAAAAA", "BBBBBB", "AAAAAA", "AAAAAA"])
+    rows, report = csv_rows("name,email\nBob,bob@x.fr\nCarol,carol@x.fr\n")
+
+    with pytest.raises(RuntimeError):
+        storage.import_ambassadors(rows, NOW, report, email_for=welcome)
+
+    # Tout ou rien : la ligne de Carol, insérée au premier tour, est annulée
+    assert emails_and_codes(sql) == [("alice@x.fr", "AAAAAA")]
+    assert sql("SELECT to_email FROM email_outbox") == []
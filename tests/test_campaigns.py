@@ -0,0 +1,105 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from bench.fake_mailjet import FakeMailjet, make_handler
+from campaigns import CampaignRunner, CampaignTemplate
+
+
+NOW = "2026-03-01T10:00:00Z"
+
+
+@pytest.fixture
+def mailjet(monkeypatch):
+    """Faux Mailjet (bench/fake_mailjet.py) sur un port libre, visé par MAILJET_API_URL."""
+    fake = FakeMailjet()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fake))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("MAILJET_API_URL", f"http://127.0.0.1:{server.server_port}/v3.1/send")
+    monkeypatch.setenv("MAILJET_API_KEY", "x")
+    monkeypatch.setenv("MAILJET_API_SECRET", "x")
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def ambassadors(storage):
+    return [storage.signup(f"Amb {i}", f"amb{i}@x.fr", None, None, NOW)[0] for i in range(7)]
+
+
+def runner(storage, **kwargs):
+    options = {"workers": 1, "batch_size": 2, "rate": 0, "max_retries": 0}
+    options.update(kwargs)
+    return CampaignRunner(
+        storage,
+        "releve-mars",
+        CampaignTemplate("releve"),
+        params={"periode": "mars 2026"},
+        context_for=lambda row: {"dashboard_url": "http://test/d", "short_link": f"http://test/l/{row['code']}"},
+        **options,
+    )
+
+
+def test_campaign_sends_each_ambassador_once(storage, ambassadors, mailjet):
+    result = runner(storage, workers=3).run()
+
+    assert result["error"] is None
+    assert result["run"] == {"sent": 7, "failed": 0, "skipped": 0}
+    assert result["campaign"]["status"] == "done"
+    assert result["campaign"]["last_ambassador_id"] == ambassadors[-1]["id"]
+    stats = mailjet.stats()
+    assert (stats["calls"], stats["recipients"], stats["duplicates"]) == (4, 7, 0)
+
+    # Relancée une fois terminée : rien n'est renvoyé
+    assert runner(storage).run()["run"] == {"sent": 0, "failed": 0, "skipped": 0}
+    assert mailjet.stats()["calls"] == 4
+
+
+def test_resume_after_failed_batch(storage, ambassadors, mailjet):
+    # 3e appel en 503 (sans nouvel essai) : le lot amb4/amb5 n'est pas enregistré
+    mailjet.fail_every = 3
+
+    first = runner(storage).run()
+
+    assert first["error"] and "503" in first["error"]
+    assert first["campaign"]["status"] == "interrupted"
+    # Le point de reprise s'arrête avant le lot en échec
+    assert first["campaign"]["last_ambassador_id"] == ambassadors[3]["id"]
+    assert set(mailjet.recipients) >= {f"amb{i}@x.fr" for i in range(4)}
+    assert not {"amb4@x.fr", "amb5@x.fr"} & set(mailjet.recipients)
+
+    mailjet.fail_every = 0
+    second = runner(storage).run()
+
+    assert second["error"] is None
+    assert second["campaign"]["status"] == "done"
+    assert second["campaign"]["sent"] == 7
+    # Reprise : seuls les destinataires manquants sont envoyés, sans doublon
+    assert set(mailjet.recipients) == {f"amb{i}@x.fr" for i in range(7)}
+    assert mailjet.stats()["duplicates"] == 0
+
+
+def test_rejected_messages_recorded_as_failed(storage, ambassadors, mailjet, sql):
+    mailjet.reject_every = 3
+
+    result = runner(storage).run()
+
+    # Mailjet répond 400 avec un statut par message : le lot n'est pas perdu
+    assert result["error"] is None
+    assert result["run"] == {"sent": 5, "failed": 2, "skipped": 0}
+    failed = sql("SELECT error FROM email_campaign_sends WHERE status = 'failed' ORDER BY ambassador_id")
+    assert [r["error"] for r in failed] == ["fake: rejet de amb2@x.fr", "fake: rejet de amb5@x.fr"]
+
+
+def test_excluded_recipients_skipped(storage, ambassadors, mailjet):
+    banned = {ambassadors[0]["id"], ambassadors[1]["id"]}
+
+    result = runner(storage, is_excluded=lambda row: row["id"] in banned).run()
+
+    assert result["run"] == {"sent": 5, "failed": 0, "skipped": 2}
+    # Lot entièrement exclu : pas d'appel Mailjet
+    assert mailjet.stats()["calls"] == 3
+    assert "amb0@x.fr" not in mailjet.recipients
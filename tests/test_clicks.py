@@ -0,0 +1,63 @@
+import re
+import datetime
+
+import pytest
+
+
+TODAY = datetime.datetime.now(datetime.timezone.utc).date()
+BROWSER = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+
+
+@pytest.fixture
+def alice(storage):
+    return storage.signup("Alice", "alice@x.fr", None, None, "2026-03-01T10:00:00Z")[0]
+
+
+def click(storage, ambassador, day=TODAY, fingerprint="f"):
+    clicked_at = datetime.datetime.combine(day, datetime.time(10), datetime.timezone.utc)
+    storage.insert_click_events([(ambassador["id"], ambassador["code"], day, clicked_at, fingerprint)])
+
+
+def shown_clicks(response) -> int:
+    html = response.get_data(as_text=True)
+    return int(re.search(r"Clics sur votre lien</div>\s*<div class=\"stat-value\">\s*(\d+)", html).group(1))
+
+
+def test_unrolled_clicks_until_next_rollup(storage, alice):
+    yesterday = TODAY - datetime.timedelta(days=1)
+    click(storage, alice)
+    click(storage, alice, fingerprint="g")
+    click(storage, alice, day=yesterday)
+
+    assert storage.unrolled_clicks(alice["id"]) == {TODAY: 2, yesterday: 1}
+
+    storage.rollup_clicks("2026-03-02T10:00:00Z")
+    assert storage.unrolled_clicks(alice["id"]) == {}
+    series, _stats = storage.dashboard_data(alice["id"], days=2)
+    assert series == [(yesterday, 1), (TODAY, 2)]
+
+    # Seuls les événements après le point de reprise sont relus
+    click(storage, alice)
+    assert storage.unrolled_clicks(alice["id"]) == {TODAY: 1}
+
+
+def test_dashboard_counts_flushed_clicks_before_rollup(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "CLICK_ROLLUP_INTERVAL", 0)
+    ambassador = app_module.storage.signup("Bob", "dashboard-clicks@x.fr", None, None, "2026-03-01T10:00:00Z")[0]
+    client = app_module.app.test_client()
+    url = f"/dashboard?code={ambassador['code']}"
+
+    before = client.get(url)
+    assert client.get(f"/l/{ambassador['code']}", headers={"User-Agent": BROWSER}).status_code == 302
+    app_module.click_buffer.flush()
+    after = client.get(url)
+
+    # Flush sans rollup : fiche inchangée, clic compté quand même
+    assert (shown_clicks(before), shown_clicks(after)) == (0, 1)
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert "Last-Modified" not in after.headers
+    assert client.get(url, headers={"If-None-Match": before.headers["ETag"]}).status_code == 200
+
+    app_module.run_click_rollup()
+    assert app_module.storage.unrolled_clicks(ambassador["id"]) == {}
+    assert shown_clicks(client.get(url)) == 1
@@ -0,0 +1,35 @@
+import pytest
+
+from envconf import env_bool, env_float, env_int
+
+
+@pytest.mark.parametrize("raw", ["1", "true", "Yes", " on "])
+def test_env_bool_true(monkeypatch, raw):
+    monkeypatch.setenv("FLAG", raw)
+    assert env_bool("FLAG", False) is True
+
+
+@pytest.mark.parametrize("raw", ["0", "false", "NO", "off"])
+def test_env_bool_false(monkeypatch, raw):
+    monkeypatch.setenv("FLAG", raw)
+    assert env_bool("FLAG", True) is False
+
+
+@pytest.mark.parametrize("raw", [None, "", "  ", "peut-être"])
+def test_env_bool_default(monkeypatch, raw):
+    if raw is None:
+        monkeypatch.delenv("FLAG", raising=False)
+    else:
+        monkeypatch.setenv("FLAG", raw)
+    assert env_bool("FLAG", True) is True
+    assert env_bool("FLAG", False) is False
+
+
+def test_env_numbers_fall_back_on_invalid(monkeypatch):
+    monkeypatch.setenv("N", " 42 ")
+    assert env_int("N", 1) == 42
+    monkeypatch.setenv("N", "4.5")
+    assert env_int("N", 1) == 1
+    assert env_float("N", 1.0) == 4.5
+    monkeypatch.setenv("N", "")
+    assert env_float("N", 2.5) == 2.5
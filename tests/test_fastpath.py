@@ -0,0 +1,136 @@
+import itertools
+
+import pytest
+
+from fastpath import ShortLinkDispatcher, client_ip
+from ratelimit import MemoryStore, RateLimiter, Rule
+
+
+BROWSER = "Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"
+_emails = itertools.count(1)
+
+
+@pytest.fixture(params=["fast", "flask"])
+def client(request, app_module, monkeypatch):
+    """
+    Client de test servi par le fast path, ou par la route Flask seule :
+    chaque test vérifie que les deux répondent de la même façon.
+    """
+    if request.param == "flask":
+        assert isinstance(app_module.app.wsgi_app, ShortLinkDispatcher)
+        monkeypatch.setattr(app_module.app, "wsgi_app", app_module.app.wsgi_app.app)
+    app_module.ambassador_cache.clear()
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def ambassador(app_module):
+    n = next(_emails)
+    row, _ = app_module.storage.signup(f"Amb {n}", f"fastpath{n}@x.fr", None, None, "2026-03-01T10:00:00Z")
+    return row
+
+
+def clicks(app_module, ambassador) -> int:
+    app_module.click_buffer.flush()
+    row = app_module.storage._conn().execute(
+        "SELECT count(*) AS n FROM click_events WHERE ambassador_id = ?", (ambassador["id"],)
+    ).fetchone()
+    return row["n"]
+
+
+def redirects(app_module, status_class: str) -> int:
+    """Requêtes comptées sous l'endpoint redirect_with_ref (histogramme /metrics)."""
+    series = app_module.metrics.requests._series.get(("redirect_with_ref", status_class))
+    return sum(series[:-1]) if series else 0
+
+
+def test_known_code_redirects_and_counts_once(app_module, client, ambassador):
+    before = redirects(app_module, "3xx")
+
+    first = client.get(f"/l/{ambassador['code'].lower()}", headers={"User-Agent": BROWSER})
+    again = client.get(f"/l/{ambassador['code']}", headers={"User-Agent": BROWSER})
+
+    assert first.status_code == again.status_code == 302
+    assert first.headers["Location"] == app_module.build_tracking_target(ambassador["code"])
+    assert first.headers["Cache-Control"] == app_module.REDIRECT_CACHE_CONTROL
+    # Fiche mise en cache par la première requête
+    assert app_module.ambassador_cache.lookup("code", ambassador["code"]) is not app_module.MISSING
+    # Rechargement par le même client : redirigé, pas compté
+    assert clicks(app_module, ambassador) == 1
+    assert redirects(app_module, "3xx") == before + 2
+
+
+def test_bots_and_prefetch_not_counted(app_module, client, ambassador):
+    url = f"/l/{ambassador['code']}"
+
+    assert client.get(url, headers={"User-Agent": "facebookexternalhit/1.1"}).status_code == 302
+    assert client.head(url, headers={"User-Agent": BROWSER}).status_code == 302
+    assert client.get(url, headers={"User-Agent": BROWSER, "Sec-Purpose": "prefetch"}).status_code == 302
+
+    assert clicks(app_module, ambassador) == 0
+
+
+def test_unknown_code_still_redirects(app_module, client):
+    response = client.get("/l/ZZZ999", headers={"User-Agent": BROWSER})
+
+    assert response.status_code == 302
+    assert response.headers["Location"] == app_module.build_tracking_target("ZZZ999")
+
+
+def test_banned_code_and_email_are_not_found(app_module, client, ambassador):
+    other = app_module.storage.signup("Banni", f"fastpath{next(_emails)}@spam.fr", None, None, "2026-03-01T10:00:00Z")[0]
+    ban_list = app_module.ban_list
+    ban_list.add("code", ambassador["code"])
+    ban_list.add("domain", "spam.fr")
+    before = redirects(app_module, "4xx")
+
+    try:
+        assert client.get(f"/l/{ambassador['code']}").status_code == 404
+        assert client.get(f"/l/{other['code']}").status_code == 404
+    finally:
+        ban_list.remove("code", ambassador["code"])
+        ban_list.remove("domain", "spam.fr")
+
+    assert clicks(app_module, ambassador) == clicks(app_module, other) == 0
+    assert redirects(app_module, "4xx") == before + 2
+
+
+def test_rate_limited_on_unknown_codes_only(app_module, client, ambassador, monkeypatch):
+    limiter = RateLimiter(MemoryStore(), {"redirect": Rule.parse("2/60")})
+    monkeypatch.setattr(app_module, "rate_limiter", limiter)
+    url = f"/l/{ambassador['code']}"
+
+    def get(ip, path=url, **extra):
+        return client.get(path, headers={"User-Agent": BROWSER, **extra}, environ_base={"REMOTE_ADDR": ip})
+
+    # Lien valide en rafale depuis une seule IP : un défaut de cache compté, puis jamais limité
+    assert {get("203.0.113.7").status_code for _ in range(10)} == {302}
+
+    assert [get("203.0.113.7", f"/l/ZZZ{n:03d}").status_code for n in range(2)] == [302, 429]
+    limited = get("203.0.113.7", "/l/ZZZ100")
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert limited.headers["Content-Type"].startswith("text/plain")
+    assert "Location" not in limited.headers
+    # Code inconnu déjà en cache négatif : toujours compté
+    assert get("203.0.113.7", "/l/ZZZ000").status_code == 429
+    # X-Forwarded-For choisi par le client : ignoré sans proxy de confiance
+    assert get("203.0.113.7", "/l/ZZZ101", **{"X-Forwarded-For": "198.51.100.1"}).status_code == 429
+    # Le lien en cache passe toujours ; autre client : non limité
+    assert get("203.0.113.7").status_code == 302
+    assert get("203.0.113.8", "/l/ZZZ102").status_code == 302
+
+
+def test_client_ip_behind_trusted_proxies():
+    environ = {"REMOTE_ADDR": "10.0.0.1", "HTTP_X_FORWARDED_FOR": "1.2.3.4, 203.0.113.7"}
+
+    assert client_ip(environ) == "10.0.0.1"
+    # Entrée ajoutée par le proxy, pas celle fournie par le client
+    assert client_ip(environ, 1) == "203.0.113.7"
+    assert client_ip(environ, 2) == "1.2.3.4"
+    assert client_ip(environ, 3) == "10.0.0.1"
+
+
+def test_other_paths_fall_through_to_flask(app_module, client):
+    assert client.get("/l/ABC-12").status_code == 302
+    assert client.post("/l/ABC123").status_code == 405
@@ -0,0 +1,28 @@
+NOW = "2026-03-01T10:00:00Z"
+
+
+def test_every_write_moves_the_version(storage, sql):
+    versions = [storage.listing_version()]
+
+    alice, _ = storage.signup("Alice", "alice@x.fr", None, None, NOW)
+    versions.append(storage.listing_version())
+    bob, _ = storage.signup("Bob", "bob@x.fr", None, None, NOW)
+    versions.append(storage.listing_version())
+
+    # Modification d'une ligne qui n'est pas la dernière écrite
+    sql("UPDATE ambassadors SET clicks = clicks + 1 WHERE id = %s", (alice["id"],))
+    versions.append(storage.listing_version())
+
+    # Suppression de la ligne au plus grand numéro : la version avance quand même
+    sql("DELETE FROM ambassadors WHERE id = %s", (alice["id"],))
+    versions.append(storage.listing_version())
+    sql("DELETE FROM ambassadors WHERE id = %s", (bob["id"],))
+    versions.append(storage.listing_version())
+
+    assert versions == sorted(set(versions))
+
+
+def test_unchanged_table_keeps_its_version(storage):
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+
+    assert storage.listing_version() == storage.listing_version()
@@ -0,0 +1,156 @@
+import time
+import logging
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import outbox
+from bench.fake_mailjet import FakeMailjet, make_handler
+from mailing import build_ambassador_welcome_message
+from outbox import OutboxWorker, drain_outbox
+
+
+@pytest.fixture
+def mailjet(monkeypatch):
+    fake = FakeMailjet()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(fake))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("MAILJET_API_URL", f"http://127.0.0.1:{server.server_port}/v3.1/send")
+    monkeypatch.setenv("MAILJET_API_KEY", "key")
+    monkeypatch.setenv("MAILJET_API_SECRET", "secret")
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+
+def welcome(email):
+    return build_ambassador_welcome_message(
+        to_email=email,
+        firstname="",
+        code="ABC123",
+        dashboard_url="https://ambassadeurs.test/dashboard?code=ABC123",
+        short_link="https://ambassadeurs.test/l/ABC123",
+        tracking_target="https://www.spectramedia.online/?ref=ABC123",
+    )
+
+
+def enqueue(storage, *emails):
+    """Inscriptions avec email de bienvenue mis en outbox dans la même transaction."""
+    for email in emails:
+        storage.signup(
+            "Alice", email, None, None, "2026-03-01T10:00:00Z",
+            email_for=lambda row, is_new: ("ambassador_welcome", welcome(row["email"])),
+        )
+
+
+def epoch(value) -> float:
+    return value.timestamp() if hasattr(value, "timestamp") else value
+
+
+def rows(sql):
+    return [
+        {**row, "next_attempt_at": epoch(row["next_attempt_at"])}
+        for row in sql(
+            "SELECT to_email, status, attempts, next_attempt_at, last_error, provider_message_id "
+            "FROM email_outbox ORDER BY id"
+        )
+    ]
+
+
+def make_due(storage, sql):
+    due = "0" if storage.name == "sqlite" else "now()"
+    sql(f"UPDATE email_outbox SET next_attempt_at = {due} WHERE status = 'pending'")
+
+
+def test_drain_sends_one_batch(mailjet, storage, sql):
+    enqueue(storage, "a@x.fr", "b@x.fr", "c@x.fr")
+
+    counts = drain_outbox(storage)
+
+    assert counts == {"batches": 1, "sent": 3, "retried": 0, "failed": 0}
+    assert mailjet.calls == 1
+    assert [(r["status"], r["attempts"]) for r in rows(sql)] == [("sent", 1)] * 3
+    assert all(r["provider_message_id"] for r in rows(sql))
+    # Rien de dû : pas d'appel Mailjet
+    assert drain_outbox(storage)["batches"] == 0
+    assert mailjet.calls == 1
+
+
+def test_rejected_message_retried_with_backoff(mailjet, storage, sql):
+    enqueue(storage, "a@x.fr", "b@x.fr", "c@x.fr")
+    mailjet.reject_every = 3  # 3e message du lot : 400 avec détail par message
+
+    before = time.time()
+    counts = drain_outbox(storage)
+
+    assert counts == {"batches": 1, "sent": 2, "retried": 1, "failed": 0}
+    rejected = rows(sql)[2]
+    assert rejected["status"] == "pending" and rejected["attempts"] == 1
+    assert "rejet de c@x.fr" in rejected["last_error"]
+    assert rejected["next_attempt_at"] == pytest.approx(before + outbox.OUTBOX_BACKOFF_BASE, abs=5)
+    # Pas encore dû
+    assert drain_outbox(storage)["batches"] == 0
+
+    make_due(storage, sql)
+    mailjet.reject_every = 1
+    before = time.time()
+    assert drain_outbox(storage)["retried"] == 1
+    rejected = rows(sql)[2]
+    assert rejected["attempts"] == 2
+    # Délai doublé
+    assert rejected["next_attempt_at"] == pytest.approx(before + 2 * outbox.OUTBOX_BACKOFF_BASE, abs=5)
+
+    make_due(storage, sql)
+    mailjet.reject_every = 0
+    assert drain_outbox(storage)["sent"] == 1
+    assert [r["status"] for r in rows(sql)] == ["sent"] * 3
+    assert mailjet.stats()["duplicates"] == 0
+
+
+def test_failed_after_max_attempts(mailjet, storage, sql, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    enqueue(storage, "a@x.fr")
+    mailjet.reject_every = 1
+
+    results = []
+    for _ in range(4):
+        results.append(drain_outbox(storage))
+        make_due(storage, sql)
+
+    assert [c["retried"] for c in results] == [1, 1, 0, 0]
+    assert [c["failed"] for c in results] == [0, 0, 1, 0]
+    (row,) = rows(sql)
+    assert row["status"] == "failed" and row["attempts"] == 3
+    assert mailjet.calls == 3
+
+
+def test_whole_batch_refused_stops_the_pass(mailjet, storage, sql):
+    enqueue(storage, *[f"{i}@x.fr" for i in range(5)])
+    mailjet.fail_every = 1  # 503 à chaque appel
+
+    counts = drain_outbox(storage, batch_size=2)
+
+    assert counts == {"batches": 1, "sent": 0, "retried": 2, "failed": 0}
+    assert mailjet.calls == 1
+    assert [r["status"] for r in rows(sql)] == ["pending"] * 5
+
+
+def test_worker_stops_without_credentials(storage, sql, monkeypatch, caplog):
+    monkeypatch.delenv("MAILJET_API_KEY", raising=False)
+    monkeypatch.delenv("MAILJET_API_SECRET", raising=False)
+    enqueue(storage, "a@x.fr")
+    worker = OutboxWorker(storage, interval=0.01)
+
+    with caplog.at_level(logging.WARNING, logger="outbox"):
+        worker.kick()
+        worker._thread.join(timeout=2)
+        assert not worker._thread.is_alive()
+        worker.kick()
+        worker.kick()
+
+    # Un seul avertissement, thread non relancé, message gardé en file
+    assert len([r for r in caplog.records if "Worker outbox arrêté" in r.message]) == 1
+    assert not worker._thread.is_alive()
+    assert rows(sql)[0]["status"] == "pending"
@@ -0,0 +1,104 @@
+import pytest
+
+from payouts import CommissionRules, PayoutError, parse_period
+
+
+NOW = "2026-06-01T00:00:00Z"
+
+
+@pytest.fixture
+def alice(storage):
+    return storage.signup("Alice", "alice@x.fr", "virement", "FR76", NOW)[0]
+
+
+def add_sale(sql, ambassador_id, amount, date, kind="first", subscription_id=None):
+    sql(
+        "INSERT INTO sales (ambassador_id, amount, date, kind, subscription_id) VALUES (%s, %s, %s, %s, %s)",
+        (ambassador_id, amount, date, kind, subscription_id),
+    )
+
+
+def ledger(sql, kind="commission"):
+    return [r["amount_cents"] for r in sql("SELECT amount_cents FROM commission_ledger WHERE kind = %s ORDER BY id", (kind,))]
+
+
+def test_parse_period():
+    assert parse_period("2026-03") == "2026-03-01"
+    assert parse_period(" 2026-03-15 ") == "2026-03-01"
+    assert parse_period("") is None
+    with pytest.raises(PayoutError):
+        parse_period("2026-13")
+
+
+def test_rules_applied_per_sale(storage, sql, alice):
+    add_sale(sql, alice["id"], 10000, "2026-01-05T10:00:00Z")
+    for day in (5, 6, 7):
+        add_sale(sql, alice["id"], 1990, f"2026-02-0{day}T10:00:00Z", "renewal", "sub_1")
+    add_sale(sql, alice["id"], 500, "2026-02-08T10:00:00Z", "renewal", "sub_2")
+    rules = CommissionRules(upfront_rate=0.3, recurring_cents=1000, recurring_months=2, sale_cap_cents=2500)
+
+    result = storage.update_commission_ledger(rules)
+
+    # 30 % plafonné à 25 €, 10 € pour les 2 premières mensualités, puis 0 ;
+    # une mensualité plus petite que le forfait est prise en entier
+    assert ledger(sql) == [2500, 1000, 1000, 0, 500]
+    assert (result["entries"], result["amount_cents"]) == (5, 5000)
+
+
+def test_period_cap_clamps_across_runs(storage, sql, alice):
+    rules = CommissionRules(upfront_rate=0.5, period_cap_cents=5000)
+    add_sale(sql, alice["id"], 6000, "2026-03-01T10:00:00Z")
+    add_sale(sql, alice["id"], 6000, "2026-03-02T10:00:00Z")
+    add_sale(sql, alice["id"], 6000, "2026-03-03T10:00:00Z")
+    storage.update_commission_ledger(rules)
+
+    # Passage suivant : le plafond tient compte de ce qui est déjà au grand livre
+    add_sale(sql, alice["id"], 6000, "2026-03-20T10:00:00Z")
+    add_sale(sql, alice["id"], 6000, "2026-04-01T10:00:00Z")
+    storage.update_commission_ledger(rules)
+
+    assert ledger(sql) == [3000, 2000, 0, 0, 3000]
+    totals = {str(r["period"])[:7]: r["commission_cents"] for r in storage.commission_statement(NOW)}
+    assert totals == {"2026-03": 5000, "2026-04": 3000}
+
+
+def test_empty_run_not_recorded(storage, sql, alice):
+    rules = CommissionRules()
+    add_sale(sql, alice["id"], 10000, "2026-01-05T10:00:00Z")
+
+    first = storage.update_commission_ledger(rules)
+    again = storage.update_commission_ledger(rules)
+
+    assert first["run_id"] is not None and first["entries"] == 1
+    assert again["run_id"] is None and again["entries"] == 0
+    assert again["checkpoint"] == first["checkpoint"]
+    assert [r["entries"] for r in sql("SELECT entries FROM commission_runs")] == [1]
+
+    # Passage complet sans vente nouvelle : rien n'est réécrit
+    assert storage.update_commission_ledger(rules, full=True)["run_id"] is None
+    assert ledger(sql) == [3000]
+
+
+def test_payout_reference_is_idempotent(storage, sql, alice):
+    rules = CommissionRules(hold_days=30)
+    add_sale(sql, alice["id"], 10000, "2026-01-05T10:00:00Z")
+    # Encore dans le délai de rétention au moment du versement
+    add_sale(sql, alice["id"], 20000, "2026-05-20T10:00:00Z")
+    storage.update_commission_ledger(rules)
+
+    paid = storage.pay_commissions("VIR-2026-06", NOW)
+    again = storage.pay_commissions("VIR-2026-06", NOW)
+
+    assert [(r["ambassador_id"], r["cents"]) for r in paid] == [(alice["id"], 3000)]
+    assert again == []
+    assert ledger(sql, "payout") == [-3000]
+
+    statement = {str(r["period"])[:7]: r for r in storage.commission_statement(NOW)}
+    assert (statement["2026-01"]["paid_cents"], statement["2026-01"]["payable_cents"]) == (3000, 0)
+    assert (statement["2026-05"]["pending_cents"], statement["2026-05"]["payable_cents"]) == (6000, 0)
+
+    # Nouvelle référence une fois la commission acquise : seul le solde est versé
+    later = storage.pay_commissions("VIR-2026-07", "2026-07-01T00:00:00Z")
+    assert [r["cents"] for r in later] == [6000]
+    assert ledger(sql, "payout") == [-3000, -6000]
+
@@ -0,0 +1,136 @@
+import math
+
+import pytest
+
+import ratelimit
+from ratelimit import MemoryStore, RateLimiter, RedisStore, Rule
+
+
+class FakeRedis:
+    """
+    Faux client redis-py : exécute en Python la logique du script Lua
+    _REDIS_TAKE (hash tokens / ts, horloge TIME du serveur réglable).
+    """
+
+    def __init__(self, clock=lambda: 1_700_000_000.0):
+        self.clock = clock
+        self.hashes = {}
+        self.expires = {}
+        self.down = False
+
+    def eval(self, script, numkeys, *keys_and_args):
+        if self.down:
+            raise ConnectionError("Redis injoignable")
+        assert script == ratelimit._REDIS_TAKE and numkeys == 1
+        key, rate, burst = keys_and_args
+        rate, burst = float(rate), float(burst)
+        # TIME : secondes et microsecondes
+        seconds = self.clock()
+        now = int(seconds) + int(round((seconds - int(seconds)) * 1_000_000)) / 1_000_000
+        b = self.hashes.get(key, {})
+        tokens = float(b["tokens"]) if "tokens" in b else burst
+        ts = float(b["ts"]) if "ts" in b else now
+        tokens = min(burst, tokens + max(0, now - ts) * rate)
+        allowed = 0
+        if tokens >= 1:
+            tokens -= 1
+            allowed = 1
+        self.hashes[key] = {"tokens": repr(tokens), "ts": repr(now)}
+        self.expires[key] = math.ceil(burst / rate * 1000) + 1000
+        return [allowed, repr(tokens).encode("ascii")]
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture(params=["memory", "redis"])
+def store(request, clock):
+    """Les deux stores, sur la même horloge."""
+    if request.param == "memory":
+        return MemoryStore()
+    return RedisStore(FakeRedis(clock=lambda: 1_700_000_000.0 + clock.now))
+
+
+def test_parse_rule():
+    rule = Rule.parse("5/60")
+    assert rule.burst == 5 and rule.rate == pytest.approx(5 / 60)
+    assert Rule.parse("") is None
+    assert Rule.parse("0/60") is None
+    assert repr(Rule.parse("30/60s")) == "30/60s"
+
+
+def test_burst_then_limited(store):
+    limiter = RateLimiter(store, {"inscription": Rule.parse("5/60")})
+    results = [limiter.check("inscription", "1.2.3.4")[0] for _ in range(6)]
+    assert results == [True] * 5 + [False]
+    # Autre client, autre seau
+    assert limiter.check("inscription", "5.6.7.8") == (True, 0)
+    assert limiter.stats()["limited_by_rule"] == {"inscription": 1}
+
+
+def test_retry_after(store, clock):
+    limiter = RateLimiter(store, {"inscription": Rule.parse("5/60")})
+    for _ in range(5):
+        limiter.check("inscription", "ip")
+    # Un jeton toutes les 12 s
+    assert limiter.check("inscription", "ip") == (False, 12)
+    clock.now += 7.5
+    assert limiter.check("inscription", "ip") == (False, 5)
+    clock.now += 4.5
+    assert limiter.check("inscription", "ip") == (True, 0)
+    assert limiter.check("inscription", "ip") == (False, 12)
+
+
+def test_refill_capped_at_burst(store, clock):
+    limiter = RateLimiter(store, {"dashboard": Rule.parse("3/3")})
+    for _ in range(3):
+        assert limiter.check("dashboard", "ip")[0]
+    assert not limiter.check("dashboard", "ip")[0]
+    clock.now += 2
+    assert [limiter.check("dashboard", "ip")[0] for _ in range(3)] == [True, True, False]
+    # Longue pause : le seau se remplit jusqu'à la rafale, pas au-delà
+    clock.now += 3600
+    assert [limiter.check("dashboard", "ip")[0] for _ in range(4)] == [True, True, True, False]
+
+
+def test_unknown_or_disabled_rule_allows():
+    limiter = RateLimiter(MemoryStore(), {"redirect": Rule.parse(""), "dashboard": Rule.parse("1/60")})
+    assert all(limiter.check("redirect", "ip")[0] for _ in range(100))
+    assert limiter.check("inconnue", "ip") == (True, 0)
+    assert "redirect" not in limiter.stats()["rules"]
+
+
+def test_redis_key_and_expiry():
+    redis = FakeRedis()
+    RateLimiter(RedisStore(redis), {"inscription": Rule.parse("5/60")}).check("inscription", "ip")
+    assert list(redis.hashes) == ["rl:inscription:ip"]
+    assert redis.expires["rl:inscription:ip"] == 61_000
+
+
+def test_redis_down_fails_open():
+    redis = FakeRedis()
+    limiter = RateLimiter(RedisStore(redis), {"inscription": Rule.parse("1/60")})
+    assert limiter.check("inscription", "ip") == (True, 0)
+    assert limiter.check("inscription", "ip")[0] is False
+
+    redis.down = True
+    assert [limiter.check("inscription", "ip") for _ in range(3)] == [(True, 0)] * 3
+    stats = limiter.stats()
+    assert stats["store_errors"] == 3
+    assert stats["store"] == "RedisStore"
+
+    # Retour de Redis : le seau reprend là où il en était
+    redis.down = False
+    assert limiter.check("inscription", "ip")[0] is False
@@ -0,0 +1,245 @@
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import replica
+from conftest import ADMIN_TOKEN
+from db_pool import PoolExhausted
+from pg_storage import PostgresStorage
+from replica import ReplicaMonitor, primary_until, sticky_to_primary
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.closed = False
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params=None):
+        self.pool.queries.append(sql)
+        if self.pool.query_error is not None:
+            raise self.pool.query_error
+
+    def fetchone(self):
+        return {"lag": self.pool.lag}
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        assert not self.closed, "connexion rendue deux fois"
+        self.closed = True
+        self.pool.returned += 1
+
+
+class FakePool:
+    """Pool de connexions : réplique en panne, saturée, en retard, ou erreur de requête."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lag = 0.0
+        self.down = False
+        self.exhausted = False
+        self.query_error = None
+        self.queries = []
+        self.borrowed = 0
+        self.returned = 0
+
+    def getconn(self):
+        if self.down:
+            raise psycopg2.OperationalError(f"could not connect to {self.name}")
+        if self.exhausted:
+            raise PoolExhausted(self.name)
+        self.borrowed += 1
+        return FakeConnection(self)
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(replica.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def storage(clock):
+    storage = PostgresStorage("postgresql://primaire/betty", read_dsn="postgresql://replique/betty")
+    storage.replica = ReplicaMonitor(max_lag=5.0, check_interval=2.0, retry_after=10.0)
+    storage._pool = FakePool("primaire")
+    storage._read_pool = FakePool("replique")
+    return storage
+
+
+def read(storage):
+    with storage.replica_reads():
+        conn = storage.connect_read()
+    conn.close()
+    return conn.pool.name
+
+
+def test_outside_replica_reads_uses_primary(storage):
+    assert storage.connect_read().pool.name == "primaire"
+    assert storage._read_pool.borrowed == 0
+
+
+def test_replica_used_when_fresh(storage, clock):
+    assert [read(storage) for _ in range(3)] == ["replique"] * 3
+    # Retard mesuré une fois par intervalle
+    assert len(storage._read_pool.queries) == 1
+    clock.now += 2.5
+    read(storage)
+    assert len(storage._read_pool.queries) == 2
+    assert storage.replica.stats()["replica_reads"] == 4
+
+
+def test_lag_over_threshold_falls_back_then_recovers(storage, clock):
+    storage._read_pool.lag = 12.0
+    assert read(storage) == "primaire"
+    assert storage.replica.stats()["state"] == "lagging"
+    # Connexion de mesure rendue au pool de la réplique
+    assert storage._read_pool.returned == storage._read_pool.borrowed == 1
+
+    # Pas de nouvelle mesure avant l'intervalle : primaire sans toucher la réplique
+    assert read(storage) == "primaire"
+    assert storage._read_pool.borrowed == 1
+
+    storage._read_pool.lag = 0.5
+    clock.now += 2.5
+    assert read(storage) == "replique"
+    stats = storage.replica.stats()
+    assert stats["state"] == "ok" and stats["lag_seconds"] == 0.5
+    assert stats["primary_fallbacks"] == 2
+
+
+def test_connect_error_then_retry_after(storage, clock):
+    storage._read_pool.down = True
+    assert read(storage) == "primaire"
+    assert storage.replica.stats()["state"] == "down"
+
+    # Réplique revenue, mais pas de nouvel essai avant retry_after
+    storage._read_pool.down = False
+    clock.now += 5
+    assert read(storage) == "primaire"
+    assert storage._read_pool.borrowed == 0
+
+    clock.now += 5
+    assert read(storage) == "replique"
+    assert storage.replica.stats()["errors"] == 1
+
+
+def test_lag_query_error_marks_replica_down(storage):
+    storage._read_pool.query_error = psycopg2.OperationalError("server closed the connection")
+    assert read(storage) == "primaire"
+    assert storage.replica.stats()["state"] == "down"
+    assert storage._read_pool.returned == 1
+
+
+def test_pool_exhausted_releases_the_check(storage):
+    storage._read_pool.exhausted = True
+    assert read(storage) == "primaire"
+    # Sans verdict : la mesure reste à faire par le prochain appel
+    assert storage.replica.stats()["state"] == "unknown"
+    storage._read_pool.exhausted = False
+    assert read(storage) == "replique"
+
+
+def test_unexpected_error_releases_the_check(storage):
+    storage._read_pool.query_error = KeyError("lag")
+    with pytest.raises(KeyError):
+        with storage.replica_reads():
+            storage.connect_read()
+    assert storage._read_pool.returned == 1
+
+    storage._read_pool.query_error = None
+    assert read(storage) == "replique"
+    assert storage.replica.stats()["checks"] == 1
+
+
+# --------------------
+# Cookie de lecture fraîche
+# --------------------
+def test_sticky_cookie_window():
+    assert sticky_to_primary(primary_until(15), 15)
+    assert not sticky_to_primary(primary_until(-5), 15)
+    # Date forgée loin dans le futur : ignorée
+    assert not sticky_to_primary(primary_until(3600), 15)
+    assert not sticky_to_primary("abc", 15)
+    assert not sticky_to_primary(None, 15)
+
+
+@pytest.fixture
+def routed(app_module, monkeypatch):
+    """Routes read-only de l'app : compte les passages dans replica_reads()."""
+    entered = []
+
+    @contextmanager
+    def replica_reads():
+        entered.append(True)
+        yield
+
+    monkeypatch.setattr(app_module.storage, "replica_reads", replica_reads)
+    return entered
+
+
+def test_sticky_cookie_forces_primary(app_module, routed):
+    client = app_module.app.test_client()
+    url = f"/admin/ambassadors.json?token={ADMIN_TOKEN}"
+
+    assert client.get(url).status_code == 200
+    assert len(routed) == 1
+
+    client.set_cookie(app_module.READ_STICKY_COOKIE, primary_until(app_module.READ_STICKY_SECONDS))
+    assert client.get(url).status_code == 200
+    assert len(routed) == 1
+
+    client.set_cookie(app_module.READ_STICKY_COOKIE, primary_until(-1))
+    assert client.get(url).status_code == 200
+    assert len(routed) == 2
+
+
+def test_primary_lookup_not_coalesced_with_replica_read(app_module, monkeypatch):
+    """Une lecture sur le primaire ne reprend pas la lecture en cours sur la réplique."""
+    started, release = threading.Event(), threading.Event()
+    routes = []
+
+    def find_ambassador(field, value):
+        routes.append(app_module.storage.reads_replica())
+        if len(routes) == 1:
+            started.set()
+            release.wait(5)
+        return None
+
+    monkeypatch.setattr(app_module.storage, "find_ambassador", find_ambassador)
+    monkeypatch.setattr(
+        app_module.storage, "reads_replica", lambda: threading.current_thread().name == "replica-read"
+    )
+
+    monkeypatch.setattr(app_module.single_flight, "timeout", 1.0)
+    coalesced = app_module.single_flight.stats()["coalesced"]
+
+    reader = threading.Thread(
+        target=app_module.lookup_ambassador, args=("email", "nouveau@exemple.fr"), name="replica-read"
+    )
+    reader.start()
+    try:
+        assert started.wait(5)
+        # Même clé, pendant la lecture sur la réplique : requête à part sur le primaire
+        assert app_module.lookup_ambassador("email", "nouveau@exemple.fr") is None
+        assert routes == [True, False]
+        assert app_module.single_flight.stats()["coalesced"] == coalesced
+    finally:
+        release.set()
+        reader.join(5)
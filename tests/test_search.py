@@ -0,0 +1,149 @@
+import time
+
+import pytest
+
+from search import PrefixIndex, SearchError, build_search_query, parse_search_args, split_results
+from sqlite_storage import SQLiteStorage
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "search.sqlite3"))
+    storage.check_schema()
+    storage.search_index_refresh = 3600
+    insert(storage, 1, "Alice Martin", "alice@exemple.fr", "ALI001")
+    return storage
+
+
+def insert(storage, ambassador_id, name, email, code, payout_identifier=None):
+    with storage._write() as conn:
+        conn.execute(
+            """
+            INSERT INTO ambassadors (id, name, email, code, payout_identifier, created_at)
+            VALUES (?, ?, ?, ?, ?, '2026-01-01T00:00:00Z')
+            """,
+            (ambassador_id, name, email, code, payout_identifier),
+        )
+
+
+def search(storage, q):
+    return [row["id"] for row in storage.search_ambassadors({"q": q, "limit": 10, "offset": 0})]
+
+
+def row(ambassador_id, name, email, code, payout_identifier=None):
+    return {"id": ambassador_id, "name": name, "email": email, "code": code, "payout_identifier": payout_identifier}
+
+
+def test_parse_search_args():
+    assert parse_search_args({"q": "  Alice   MARTIN ", "limit": "500", "offset": "-3"}) == {
+        "q": "alice martin",
+        "limit": 100,
+        "offset": 0,
+    }
+    with pytest.raises(SearchError):
+        parse_search_args({"q": " "})
+    with pytest.raises(SearchError):
+        parse_search_args({"q": "alice", "limit": "dix"})
+
+
+def test_fuzzy_only_from_three_characters():
+    short, _ = build_search_query({"q": "al", "limit": 20, "offset": 0})
+    longer, params = build_search_query({"q": "ali", "limit": 20, "offset": 0})
+
+    assert "word_similarity" not in short and "word_similarity" in longer
+    # Une ligne de plus que la page : page suivante ou non
+    assert params["limit"] == 21
+    assert split_results(list(range(21)), {"limit": 20, "offset": 40}) == (list(range(20)), 60)
+    assert split_results(list(range(3)), {"limit": 20, "offset": 0}) == ([0, 1, 2], None)
+
+
+def test_prefix_index_ranking():
+    index = PrefixIndex(
+        [
+            row(1, "Marc Dupont", "dupont@x.fr", "ZZZ001"),
+            row(2, "Jean Marc", "jean@x.fr", "MAR002"),
+            row(3, "Lucie", "marc.l@x.fr", "LUC003"),
+            row(4, "Paul", "paul@x.fr", "PAU004", "marcel-paypal"),
+        ],
+        version=1,
+    )
+
+    # Code, puis email, puis nom (premier mot ou suivants), puis identifiant
+    assert index.search("mar", 10) == [2, 3, 1, 4]
+    assert index.search("dupont", 10) == [1]
+    assert index.search("mar", 2, offset=1) == [3, 1, 4]
+    # Correspondance exacte de l'email en tête
+    assert index.search("marc.l@x.fr", 10) == [3]
+
+
+def test_new_rows_found_immediately(storage):
+    assert search(storage, "alice") == [1]
+
+    insert(storage, 2, "Bob Durand", "bob@exemple.fr", "BOB002")
+
+    assert search(storage, "durand") == [2]
+    assert storage._search.max_id == 2
+
+
+def test_stale_entries_rechecked(storage):
+    assert search(storage, "alice") == [1]
+
+    # Fiche renommée : l'index (pas encore reconstruit) la propose, la
+    # relecture en base l'écarte
+    with storage._write() as conn:
+        conn.execute("UPDATE ambassadors SET name = 'Carole Martin', email = 'carole@exemple.fr' WHERE id = 1")
+
+    assert search(storage, "alice") == []
+
+
+def test_prefix_index_add_skips_known_ids():
+    index = PrefixIndex([row(1, "Alice", "a@x.fr", "A1")], version=1)
+    rows = [row(2, "Bob", "b@x.fr", "B2")]
+    index.add(rows, 2)
+    size = len(index.entries)
+    # Même lot ajouté par un second thread : ignoré
+    index.add(rows, 2)
+    assert len(index.entries) == size
+    assert index.max_id == 2 and index.version == 2 and index.stale
+    assert index.search("bob", 10) == [2]
+
+
+def test_new_rows_caught_up_once(storage, monkeypatch):
+    assert search(storage, "alice") == [1]
+    index = storage._search
+
+    insert(storage, 2, "Bob Durand", "bob@exemple.fr", "BOB002")
+    calls = []
+    add = index.add
+    monkeypatch.setattr(index, "add", lambda rows, version=None: calls.append(len(rows)) or add(rows, version))
+
+    assert search(storage, "bob") == [2]
+    assert search(storage, "bob") == [2]
+    assert search(storage, "alice") == [1]
+    # Une seule requête de rattrapage pour cette version de la table
+    assert calls == [1]
+    assert index.version == storage.listing_version()
+    assert index.stale
+
+    insert(storage, 3, "Bobby Petit", "bobby@exemple.fr", "BOB003")
+    assert search(storage, "bob") == [2, 3]
+    assert calls == [1, 1]
+
+
+def test_stale_index_rebuilt_in_background(storage):
+    assert search(storage, "alice") == [1]
+    first = storage._search
+
+    with storage._write() as conn:
+        conn.execute("UPDATE ambassadors SET name = 'Carole Martin' WHERE id = 1")
+    storage.search_index_refresh = 0
+    # Ancien index : "carole" absent ; la reconstruction part en tâche de fond
+    assert search(storage, "carole") == []
+
+    deadline = time.monotonic() + 5
+    while storage._search is first and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert storage._search is not first
+    assert not storage._search_refreshing
+    assert not storage._search.stale
+    assert search(storage, "carole") == [1]
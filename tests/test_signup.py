@@ -0,0 +1,59 @@
+import pytest
+
+import pg_storage
+import sqlite_storage
+
+
+NOW = "2026-03-01T10:00:00Z"
+
+
+def welcome(row, is_new):
+    return ("ambassador_welcome", {"To": [{"Email": row["email"]}], "Subject": "Bienvenue"})
+
+
+def emails_and_codes(sql):
+    return [(r["email"], r["code"]) for r in sql("SELECT email, code FROM ambassadors ORDER BY id")]
+
+
+def test_insert_then_update_same_row(storage):
+    first, is_new = storage.signup("Alice Martin", "alice@x.fr", "paypal", None, NOW)
+    again, is_new_again = storage.signup("Alice M.", "alice@x.fr", None, None, NOW)
+
+    assert is_new and not is_new_again
+    assert again["id"] == first["id"] and again["code"] == first["code"]
+    assert again["name"] == "Alice M."
+    # Champ absent du formulaire : valeur existante conservée
+    assert again["payout_preference"] == "paypal"
+
+
+def test_code_collision_retried_in_same_transaction(storage, sql, codes):
+    codes.append("AAAAAA")
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+
+    # Deux collisions sur le code puis un code libre : la transaction reste
+    # utilisable (savepoint côté Postgres) et l'outbox est écrite avec la ligne
+    codes.extend(["AAAAAA", "AAAAAA", "BBBBBB"])
+    row, is_new = storage.signup("Bob", "bob@x.fr", None, None, NOW, email_for=welcome)
+
+    assert is_new and row["code"] == "BBBBBB"
+    assert emails_and_codes(sql) == [("alice@x.fr", "AAAAAA"), ("bob@x.fr", "BBBBBB")]
+    assert [r["to_email"] for r in sql("SELECT to_email FROM email_outbox")] == ["bob@x.fr"]
+
+
+def test_gives_up_after_code_attempts(storage, sql, codes, monkeypatch):
+    for module in (pg_storage, sqlite_storage):
+        monkeypatch.setattr(module, "CODE_ATTEMPTS", 3)
+    codes.append("AAAAAA")
+    storage.signup("Alice", "alice@x.fr", None, None, NOW)
+
+    codes.extend(["AAAAAA"] * 3)
+    with pytest.raises(RuntimeError):
+        storage.signup("Bob", "bob@x.fr", None, None, NOW, email_for=welcome)
+
+    assert emails_and_codes(sql) == [("alice@x.fr", "AAAAAA")]
+    assert sql("SELECT to_email FROM email_outbox") == []
+
+
+def test_rejected_row_rolled_back(storage, sql):
+    assert storage.signup("Alice", "alice@x.fr", None, None, NOW, accept=lambda row: False) is None
+    assert emails_and_codes(sql) == []
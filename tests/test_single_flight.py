@@ -0,0 +1,111 @@
+import time
+import threading
+
+import pytest
+
+from cache import SingleFlight
+
+
+def run_concurrently(n, target):
+    """Lance `n` threads sur target() ; renvoie (threads, résultats, exceptions)."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(target())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def wait_for_waiters(flight, n):
+    """Attend que `n` appels soient en attente du premier."""
+    for _ in range(500):
+        if flight.stats()["coalesced"] >= n:
+            return
+        time.sleep(0.01)
+    raise AssertionError("appels jamais regroupés")
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return {"code": "ABC123"}
+
+    threads, results, errors = run_concurrently(5, lambda: flight.do(("code", "ABC123"), load))
+    wait_for_waiters(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert errors == [] and results == [{"code": "ABC123"}] * 5
+    stats = flight.stats()
+    assert (stats["calls"], stats["leaders"], stats["coalesced"], stats["in_flight"]) == (5, 1, 4, 0)
+    assert stats["coalesce_ratio"] == 0.8
+
+
+def test_error_shared_with_waiters():
+    flight = SingleFlight(timeout=5)
+    release = threading.Event()
+
+    def load():
+        release.wait(5)
+        raise RuntimeError("base indisponible")
+
+    threads, results, errors = run_concurrently(3, lambda: flight.do("k", load))
+    wait_for_waiters(flight, 2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [] and [str(e) for e in errors] == ["base indisponible"] * 3
+    assert flight.stats()["errors"] == 1
+
+    # Rien n'est gardé : l'appel suivant relance la fonction
+    assert flight.do("k", lambda: "ok") == "ok"
+
+
+def test_nothing_kept_between_calls():
+    flight = SingleFlight()
+    values = iter([1, 2])
+
+    assert flight.do("k", lambda: next(values)) == 1
+    assert flight.do("k", lambda: next(values)) == 2
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_waiter_runs_its_own_call_after_timeout():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=lambda: flight.do("k", lambda: release.wait(5) and "leader"))
+    leader.start()
+    for _ in range(500):
+        if flight.stats()["in_flight"]:
+            break
+        time.sleep(0.01)
+
+    # Premier appel bloqué : l'attente est bornée
+    assert flight.do("k", lambda: "waiter") == "waiter"
+    assert flight.stats()["timeouts"] == 1
+
+    release.set()
+    leader.join(5)
+
+
+def test_distinct_keys_do_not_wait():
+    flight = SingleFlight(timeout=5)
+
+    with pytest.raises(ValueError):
+        flight.do(("code", "A"), lambda: int("x"))
+    assert flight.do(("code", "B"), lambda: "b") == "b"
+    assert flight.stats()["leaders"] == 2
@@ -0,0 +1,223 @@
+import os
+import json
+import copy
+import threading
+from contextlib import closing
+
+import pytest
+
+from payouts import CommissionRules
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "stripe")
+SUBSCRIPTION = "sub_1QzB7hLkdIwHu7ixQ3rSt9uV"
+
+
+def event(name: str) -> dict:
+    """Événement Stripe enregistré (tests/fixtures/stripe/<name>.json)."""
+    with open(os.path.join(FIXTURES, f"{name}.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def ambassadors(sql):
+    sql(
+        "INSERT INTO ambassadors (id, name, email, code, created_at) "
+        "VALUES (1, 'Alice', 'alice@exemple.fr', 'ABC123', '2025-12-01T00:00:00Z'), "
+        "(2, 'Bob', 'bob@exemple.fr', 'XYZ789', '2025-12-01T00:00:00Z')"
+    )
+
+
+def stats(sql, ambassador_id: int = 1) -> dict:
+    rows = sql(
+        "SELECT revenue_cents, sales_count, commission_paid_cents, commission_unpaid_cents, active_subscriptions "
+        "FROM ambassador_stats WHERE ambassador_id = %s",
+        (ambassador_id,),
+    )
+    return rows[0] if rows else None
+
+
+def signups(sql, ambassador_id: int = 1) -> int:
+    return sql("SELECT signups FROM ambassadors WHERE id = %s", (ambassador_id,))[0]["signups"]
+
+
+def sales(sql):
+    return sql("SELECT ambassador_id, amount, kind, commission, subscription_id FROM sales ORDER BY id")
+
+
+def test_subscription_checkout_then_invoices(storage, sql):
+    touched = storage.apply_stripe_events([event("checkout_subscription"), event("invoice_paid_create"), event("invoice_paid_cycle")])
+
+    assert touched == {1}
+    assert [(s["ambassador_id"], s["kind"], s["commission"]) for s in sales(sql)] == [
+        (1, "first", 2397),  # 30 % de 79,90 €
+        (1, "renewal", 1000),
+    ]
+    assert stats(sql) == {
+        "revenue_cents": 15980,
+        "sales_count": 2,
+        "commission_paid_cents": 0,
+        "commission_unpaid_cents": 3397,
+        "active_subscriptions": 1,
+    }
+    assert signups(sql) == 1
+    assert stats(sql, 2) is None
+
+
+def test_duplicate_event_ignored(storage, sql):
+    payment = event("checkout_payment")
+
+    # Même id dans le lot, puis relivré par Stripe
+    assert storage.apply_stripe_events([payment, copy.deepcopy(payment)]) == {1}
+    assert storage.apply_stripe_events([payment]) == set()
+
+    assert len(sales(sql)) == 1
+    assert stats(sql) == {
+        "revenue_cents": 12900,
+        "sales_count": 1,
+        "commission_paid_cents": 0,
+        "commission_unpaid_cents": 3870,
+        "active_subscriptions": 0,
+    }
+    # Achat unique : pas d'abonnement, pas d'inscription comptée
+    assert signups(sql) == 0
+
+
+def test_same_object_under_new_event_id_counted_once(storage, sql):
+    storage.apply_stripe_events([event("invoice_paid_create"), event("checkout_subscription")])
+    replay = event("invoice_paid_create")
+    replay["id"] = "evt_1QzB7lLkdIwHu7ixRePlAy00"
+
+    # Vente déjà enregistrée (stripe_object_id) : aucun agrégat touché
+    assert storage.apply_stripe_events([replay]) == set()
+    assert len(sales(sql)) == 1
+    assert stats(sql)["revenue_cents"] == 7990
+
+
+def test_sale_before_signup_attached_later(storage, sql):
+    # Facture livrée avant le checkout qui porte le code ambassadeur
+    assert storage.apply_stripe_events([event("invoice_paid_create")]) == set()
+    assert [(s["ambassador_id"], s["subscription_id"]) for s in sales(sql)] == [(None, SUBSCRIPTION)]
+    assert stats(sql) is None
+
+    assert storage.apply_stripe_events([event("checkout_subscription")]) == {1}
+    assert [s["ambassador_id"] for s in sales(sql)] == [1]
+    assert stats(sql) == {
+        "revenue_cents": 7990,
+        "sales_count": 1,
+        "commission_paid_cents": 0,
+        "commission_unpaid_cents": 2397,
+        "active_subscriptions": 1,
+    }
+    assert signups(sql) == 1
+
+    # Mensualité suivante : attribuée via l'abonnement, sans code
+    storage.apply_stripe_events([event("invoice_paid_cycle")])
+    assert stats(sql)["sales_count"] == 2
+    assert signups(sql) == 1
+
+
+def test_subscription_status_out_of_order(storage, sql):
+    storage.apply_stripe_events([event("checkout_subscription")])
+    assert stats(sql)["active_subscriptions"] == 1
+
+    # Résiliation livrée avant la mise à jour past_due, plus ancienne
+    storage.apply_stripe_events([event("subscription_deleted")])
+    assert stats(sql)["active_subscriptions"] == 0
+    storage.apply_stripe_events([event("subscription_updated_past_due")])
+    assert stats(sql)["active_subscriptions"] == 0
+
+    (row,) = sql(
+        "SELECT ambassador_id, status, status_at FROM stripe_subscriptions WHERE id = %s", (SUBSCRIPTION,)
+    )
+    assert row == {"ambassador_id": 1, "status": "canceled", "status_at": event("subscription_deleted")["created"]}
+
+
+def test_past_due_stays_active(storage, sql):
+    storage.apply_stripe_events([event("checkout_subscription"), event("subscription_updated_past_due")])
+    assert stats(sql)["active_subscriptions"] == 1
+
+
+def test_subscription_status_reversed_in_one_batch(storage, sql):
+    # Un lot est appliqué dans l'ordre de création des événements
+    storage.apply_stripe_events([event("subscription_deleted"), event("subscription_updated_past_due"), event("checkout_subscription")])
+    assert stats(sql)["active_subscriptions"] == 0
+    assert signups(sql) == 1
+
+
+@pytest.mark.parametrize("order", [("checkout_subscription", "subscription_created"), ("subscription_created", "checkout_subscription")])
+def test_checkout_and_subscription_created_in_either_order(storage, sql, order):
+    # subscription.created ne porte pas le code : l'attribution vient du checkout
+    for name in order:
+        storage.apply_stripe_events([event(name)])
+
+    (row,) = sql("SELECT ambassador_id, status FROM stripe_subscriptions WHERE id = %s", (SUBSCRIPTION,))
+    assert row == {"ambassador_id": 1, "status": "active"}
+    assert signups(sql) == 1
+    assert stats(sql)["active_subscriptions"] == 1
+
+
+def test_concurrent_checkout_and_subscription_created(storage, sql):
+    if storage.name != "postgres":
+        pytest.skip("transactions concurrentes : Postgres seulement (SQLite sérialise les écritures)")
+    from stripe_sales import PostgresStripeDB, process_events
+
+    # Checkout appliqué dans une transaction encore ouverte...
+    with closing(storage.connect()) as conn:
+        with conn.cursor() as cur:
+            process_events(PostgresStripeDB(cur), [event("checkout_subscription")])
+        # ... pendant que subscription.created arrive sur une autre connexion
+        other = threading.Thread(target=storage.apply_stripe_events, args=([event("subscription_created")],))
+        other.start()
+        other.join(0.5)
+        # Bloqué sur la ligne de l'abonnement jusqu'au commit du checkout
+        assert other.is_alive()
+        conn.commit()
+    other.join(5)
+
+    (row,) = sql("SELECT ambassador_id FROM stripe_subscriptions WHERE id = %s", (SUBSCRIPTION,))
+    assert row["ambassador_id"] == 1
+    assert signups(sql) == 1
+    assert stats(sql)["active_subscriptions"] == 1
+
+
+def test_batch_deltas_across_ambassadors(storage, sql):
+    other = event("checkout_payment")
+    other["id"] = "evt_1QzC0dLkdIwHu7ixOtHeR0gg"
+    other["data"]["object"]["id"] = "cs_test_c3Ms1Bd5zAxD2wYoP4qR6tUvWxYzAb"
+    other["data"]["object"]["metadata"] = {"ref": "xyz789"}
+    other["data"]["object"]["amount_total"] = 4900
+
+    touched = storage.apply_stripe_events(
+        [event("invoice_paid_cycle"), other, event("checkout_payment"), event("checkout_subscription"),
+         event("invoice_paid_create")]
+    )
+
+    assert touched == {1, 2}
+    assert stats(sql) == {
+        "revenue_cents": 7990 + 7990 + 12900,
+        "sales_count": 3,
+        "commission_paid_cents": 0,
+        "commission_unpaid_cents": 2397 + 1000 + 3870,
+        "active_subscriptions": 1,
+    }
+    assert stats(sql, 2) == {
+        "revenue_cents": 4900,
+        "sales_count": 1,
+        "commission_paid_cents": 0,
+        "commission_unpaid_cents": 1470,
+        "active_subscriptions": 0,
+    }
+
+
+def test_estimate_uses_ledger_rules_then_ledger_corrects_it(storage, sql):
+    rules = CommissionRules(upfront_rate=0.3, recurring_cents=1000, sale_cap_cents=2000, period_cap_cents=1500)
+    storage.apply_stripe_events([event("checkout_subscription"), event("invoice_paid_create"), event("invoice_paid_cycle")], rules)
+
+    # Estimation du webhook : plafond par vente appliqué (30 % de 79,90 € -> 20 €)
+    assert [s["commission"] for s in sales(sql)] == [2000, 1000]
+    assert stats(sql)["commission_unpaid_cents"] == 3000
+
+    # Plafond mensuel connu au passage du grand livre : l'écart est reporté
+    storage.update_commission_ledger(rules)
+    assert stats(sql)["commission_unpaid_cents"] == 2500